@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Compare Pillow and OpenCV slice encoders per save format
+# Usage: python benchmarks/bench_encoders.py [path/to/image] [--repeat NUM]
+
+import os
+import sys
+import timeit
+import argparse
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from scan_image_slicer.scis_encoder import SliceEncoder
+
+class Param:
+    pass
+
+# Create photo-like test slice (smooth gradients with grain)
+def create_slice(w=2400, h=1600):
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, w, dtype=np.float32)
+    y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+    img = np.dstack([
+        200 * x * (1 - y) + 30,
+        120 + 80 * np.sin(6 * x + 3 * y),
+        180 * y + 40 * x,
+    ])
+    img += rng.normal(0, 6, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def create_p(save_format, **kw):
+    p = Param()
+    p.save_format = save_format
+    p.encoder = "auto"
+    p.png_optimize = False
+    p.png_compression = 3
+    p.jpeg_optimize = True
+    p.jpeg_quality = 95
+    p.webp_lossless = False
+    p.webp_method = 4
+    p.webp_quality = 90
+
+    for key, value in kw.items():
+        setattr(p, key, value)
+
+    return p
+
+CASES = [
+    ("jpeg q95 optimize", create_p("jpeg")),
+    ("jpeg q80", create_p("jpeg", jpeg_quality=80, jpeg_optimize=False)),
+    ("png level 3", create_p("png")),
+    ("png optimize", create_p("png", png_optimize=True)),
+    ("webp q90 method 4", create_p("webp")),
+    ("webp q90 method 6", create_p("webp", webp_method=6)),
+    ("webp lossless", create_p("webp", webp_lossless=True)),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark slice encoders")
+    parser.add_argument("image", nargs="?", help="Image to use as the slice")
+    parser.add_argument("--repeat", type=int, default=5, help="Encodes per case")
+    args = parser.parse_args()
+
+    img = cv.imread(args.image) if args.image else create_slice()
+    filters = [1.0, 1.0, 1.0, 1.0, 0, 0.0, ""]
+
+    print(f"Slice: {img.shape[1]}x{img.shape[0]} px, {args.repeat} encodes per case\n")
+    print(f"{'case':<20} {'encoder':<8} {'ms/slice':>10} {'size kb':>10}")
+
+    for name, p in CASES:
+        for backend in ["pillow", "opencv"]:
+            p.encoder = backend
+            encoder = SliceEncoder(p)
+            data = encoder.encode(img, filters)
+            seconds = timeit.timeit(lambda: encoder.encode(img, filters), number=args.repeat)
+            print(f"{name:<20} {backend:<8} {seconds / args.repeat * 1000:>10.1f} {len(data) / 1024:>10.0f}")
+
+        p.encoder = "auto"
+        print(f"{'':<20} auto -> {SliceEncoder(p).backend}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Measure import time of the command-line tool with python -X importtime
+# Usage: python benchmarks/bench_startup.py [--repeat NUM] [--top NUM]
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+ENTRY = "scan_image_slicer.scan_image_slicer"
+
+# Modules that should only be imported by the modes that need them
+LAZY_MODULES = [
+    "FreeSimpleGUI",
+    "tkinter",
+    "ruamel.yaml",
+    "pillow_lut",
+    "scipy",
+]
+
+# Import the entry point in a fresh interpreter and parse the importtime report
+def measure():
+    code = f"import sys, {ENTRY}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=SRC)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, check=True
+    )
+
+    modules = {}
+
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+
+    return modules, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup import time")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreter runs")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.repeat)]
+    totals = [modules[ENTRY] / 1000 for modules, _ in runs]
+    modules, loaded = runs[-1]
+
+    print(f"Import {ENTRY}: median {statistics.median(totals):.1f} ms, min {min(totals):.1f} ms ({args.repeat} runs)\n")
+    print(f"{'module':<50} {'cumulative ms':>14}")
+
+    for name, cumulative in sorted(modules.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"{name:<50} {cumulative / 1000:>14.1f}")
+
+    if loaded:
+        print(f"\nWARNING: lazy modules imported at startup: {', '.join(loaded)}")
+        return 1
+
+    print("\nLazy modules not imported at startup: " + ", ".join(LAZY_MODULES))
+
+if __name__ == "__main__":
+    sys.exit(main())
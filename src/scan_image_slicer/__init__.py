@@ -1,3 +1,5 @@
 '''
 A tool for detecting and slicing images
-'''
\ No newline at end of file
+'''
+
+from .scis_api import Settings, detect, slice_image, slice_batch, detect_batch
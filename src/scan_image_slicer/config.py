@@ -21,10 +21,37 @@ input: "/path/to/input/"
 # Your slices will be placed here under unique directory
 output: "/path/to/output/"
 
+# Backend for reading scanned images (pillow/tiled/mmap)
+# pillow = read the whole image into memory
+# tiled = read only the parts that are needed, lowers memory use with very large scans
+# mmap = memory-map the image file, workers share the same pages
+# Tiled and mmap work with uncompressed TIFF and BMP files, others are read as a whole
+read-backend: "pillow"
+
+# Read files of upcoming tasks ahead of the workers, helps with network storage (NFS/SMB)
+# Value is the max amount of MB read ahead and not yet sliced
+# With the pillow backend workers read each file in large chunks and decode it from memory
+# 0 = disabled
+prefetch-mb: 0
+
+# Number of threads reading ahead, and max reads at once from the same mount
+prefetch-threads: 4
+prefetch-mount-limit: 2
+
 # Number of workers used for multiprocessing
 # Use half of physical cpu cores as a safe default value
 workers: 2
 
+# Tasks in flight per worker, the next tasks are submitted as results come in
+# Keeps memory of large runs low, Ctrl-C only waits for the tasks in flight
+task-window: 4
+
+# Run workers as threads or processes (thread, process)
+# Threads share the caches and image buffers of one process and need much less memory,
+# the heavy work (decoding, OpenCV, filters, encoding) runs in parallel outside the GIL
+# Thread workers are also the natural choice on free-threaded Python builds
+executor: "process"
+
 # Skip the need to confirm action modes (True/False)
 skip-confirm: False
 
@@ -38,6 +65,16 @@ minimum-size: 1.00
 # Maximum size of the sliced image in % compared to scanned image (1-100)
 maximum-size: 45.00
 
+# Slice detection (fixed/pyramid)
+# fixed = detect slices from one overview of the scan (max 900 px wide)
+# pyramid = find slices in a small overview, then refine the edges of each slice from
+# a crop of the scan at higher resolution, gives tighter slices on large scans
+detect-mode: "fixed"
+
+# Width of the coarse overview, and max size of the refined crops (pyramid detection)
+coarse-width: 400
+refine-size: 600
+
 # Enable count mode (True/False)
 count-mode: False
 
@@ -50,6 +87,93 @@ preview-mode: False
 # Enable slice mode (True/False)
 slice-mode: False
 
+# Enable watch mode (True/False)
+# Keeps running and slices new or changed images in the input directory
+# Images that exist when watch mode starts are not sliced
+watch-mode: False
+
+# Seconds between input directory checks in watch mode
+watch-interval: 2.0
+
+# Seconds an image has to stay unchanged before it is sliced in watch mode
+watch-settle: 5.0
+
+# Enable stream mode (True/False)
+# Reads scans from stdin and writes the slices as tar stream to stdout
+# Input is a tar stream or concatenated image files (JPEG, PNG, WEBP or BMP)
+stream-mode: False
+
+# Read scans from a file or named pipe instead of stdin
+# "-" = stdin
+stream-input: "-"
+
+# Enable serve mode (True/False)
+# Runs a local HTTP service for detecting and slicing images
+# POST /detect returns the regions as JSON, POST /slice returns the slices as tar
+# Send the image as request body or use ?path= relative to the input directory
+serve-mode: False
+
+# Address and port of the HTTP service
+# Use 127.0.0.1 to only accept requests from this computer
+serve-host: "127.0.0.1"
+serve-port: 8765
+
+# Max number of requests running or waiting for a worker
+# Requests over the limit are rejected with 503 so the client can retry later
+serve-queue: 16
+
+# Seconds before a request times out
+serve-timeout: 120.0
+
+# Max size of an uploaded image in MB
+serve-max-upload: 1024
+
+# Test mode writes detection overlays as contact sheets instead of showing the GUI (True/False)
+# Overlays are rendered in parallel with all workers, index.html and index.json list
+# the valid and rejected regions of every image
+headless-test: False
+
+# Number of overlays on one contact sheet
+sheet-tiles: 20
+
+# Width of an overlay on the contact sheet
+tile-width: 360
+
+# Show throughput (megapixels, slices and bytes per second), queue depth
+# and worker utilization in the progress bar of count and slice mode (True/False)
+progress-stats: False
+
+# Write run metrics of count and slice mode into file
+# prometheus = replaced on every update, point node exporter textfile collector to it (*.prom)
+# jsonl = one line per update, appended
+# "" = disabled
+metrics-file: ""
+metrics-format: "prometheus"
+
+# Seconds between metrics file updates
+metrics-interval: 10.0
+
+# Time limits of an image in count, slice and headless test mode, in seconds (0 = disabled)
+# Images over the soft limit get a warning, images over the hard limit are stopped
+# (the worker is killed and replaced) and quarantined so later runs skip them
+soft-timeout: 0.0
+hard-timeout: 0.0
+
+# Enable worker mode (True/False)
+# Claims tasks from the shared work queue and slices them until the queue is empty
+# Any number of workers on any host can work on the same queue
+worker-mode: False
+
+# Path to shared work queue (e.g. directory on NFS mounted by all hosts)
+# Slice mode puts the tasks into the queue instead of slicing them
+# Input and output paths have to be the same on all hosts
+# "" = disabled
+queue-path: ""
+
+# Seconds a task stays claimed without heartbeat from its worker
+# After that the task goes back to the queue for another worker
+queue-lease: 60.0
+
 # Scale using factor value (e.g: 0.5, 1.5, 50.0)
 # 0 = disabled
 scale-factor: 0
@@ -109,6 +233,11 @@ auto-rotate: "disable"
 # Save format (png|jpeg|webp)
 save-format: "jpeg"
 
+# Encoder for slices (auto/pillow/opencv)
+# opencv = encode straight from the image buffer, skips PIL conversion if only denoise is used
+# auto = use opencv unless the format settings need pillow (PNG optimize, WebP lossless or method other than 4)
+encoder: "auto"
+
 # Optimize PNG files (True/False)
 png-optimize: True
 
@@ -133,6 +262,32 @@ webp-method: 4
 # Note: if you enable lossless webp then this value becomes the compression rate
 webp-quality: 90
 
+# Skip duplicate scans in slice and watch mode (off/scan/slice)
+# Compares a perceptual hash of each scan with the scans sliced before, also in earlier runs
+# scan = skip scans that were already sliced
+# slice = also skip single slices that were already sliced from another scan
+# Hashes are kept in output directory (.scis_hash_index.jsonl)
+# Skipped scans and slices are listed in duplicates.jsonl inside the run directory
+dedup-mode: "off"
+
+# Max number of differing bits (of 64) for a duplicate (0-16)
+# 0 = only identical images, raise this if rescans of the same sheet are not caught
+dedup-distance: 4
+
+# Write slices into archive containers instead of separate files (none/tar/zip)
+# Each archive gets an index file (.jsonl) listing slice name, source image, region and byte offset
+# none = save slices as separate files
+output-archive: "none"
+
+# Create one archive per slice run or one per input folder (run/folder)
+archive-shard: "run"
+
+# Save extra renditions of each slice into parallel output trees (<run>_<name>)
+# Spec is "name:option=value,..." with options width, height, scale, format and quality
+# Renditions are scaled down from the filtered slice, other save settings come from above
+# Example: ["web:width=1600,format=webp,quality=80", "thumb:width=300,quality=70"]
+#renditions: []
+
 # GUI font scale
 font-scale: 1.0
 
@@ -148,4 +303,14 @@ view-width: 960
 # Max image height inside GUI
 view-height: 800
 
+# Test and preview mode start with a scrollable grid of detection thumbnails of all tasks (True/False)
+# Click a thumbnail to open the image, thumbnails are cached in the config directory
+browse-grid: False
+
+# Width of thumbnails in the grid
+thumb-width: 200
+
+# Number of thumbnail columns in the grid
+grid-columns: 5
+
 '''
\ No newline at end of file
@@ -55,6 +55,8 @@ def conf_parser_p(p):
     parser.add_argument("-conf", "--config-file", metavar="FILE", is_config_file=True, help="Path to custom config file")
     parser.add_argument("-skip", "--skip-confirm", action="store_true", help="Skip the need to confirm action modes")
     parser.add_argument("-work", "--workers", metavar="NUM", type=int, help="Number of workers for multiprocessing")
+    parser.add_argument("-window", "--task-window", metavar="NUM", type=int, default=4, help="Tasks in flight per worker, more are submitted as results come in")
+    parser.add_argument("-exec", "--executor", metavar="TEXT", type=str, default="process", help="Run workers as threads or processes (thread, process)")
     parser.add_argument("-name", "--project-name", metavar="TEXT", type=str, help="Project name")
 
     mode_group = parser.add_argument_group("Modes")
@@ -63,16 +65,30 @@ def conf_parser_p(p):
     mode_select_group.add_argument("-count", "--count-mode", action="store_true", help="Enable count mode")
     mode_select_group.add_argument("-preview", "--preview-mode", action="store_true", help="Enable preview mode")
     mode_select_group.add_argument("-slice", "--slice-mode", action="store_true", help="Enable slice mode")
+    mode_select_group.add_argument("-watch", "--watch-mode", action="store_true", help="Enable watch mode")
+    mode_select_group.add_argument("-serve", "--serve-mode", action="store_true", help="Enable serve mode")
+    mode_select_group.add_argument("-stream", "--stream-mode", action="store_true", help="Enable stream mode")
+    mode_select_group.add_argument("-worker", "--worker-mode", action="store_true", help="Enable worker mode")
 
     path_group = parser.add_argument_group("Paths")
     path_group.add_argument("-i", "--input", metavar="PATH", type=str, help="PATH to input directory")
     path_group.add_argument("-o", "--output", metavar="PATH", type=str, help="PATH to output directory")
     path_group.add_argument("-lutP", "--filter-lut-path", metavar="FILE", type=str, help="Path to lut .cube file")
 
+    read_group = parser.add_argument_group("Image reading")
+    read_group.add_argument("-read", "--read-backend", metavar="TEXT", type=str, default="pillow", help="Backend for reading scanned images (pillow, tiled, mmap)")
+
+    read_group.add_argument("-prefetch", "--prefetch-mb", metavar="NUM", type=int, default=0, help="Read files of upcoming tasks ahead, max MB read ahead (0 = disabled)")
+    read_group.add_argument("-prefetchT", "--prefetch-threads", metavar="NUM", type=int, default=4, help="Number of threads reading ahead")
+    read_group.add_argument("-prefetchM", "--prefetch-mount-limit", metavar="NUM", type=int, default=2, help="Max files read ahead at once from the same mount")
+
     detect_group = parser.add_argument_group("Image slice detection")
     detect_group.add_argument("-white", "--white-threshold", metavar="NUM", type=int, help="White level between slices (1-255)")
     detect_group.add_argument("-min", "--minimum-size", metavar="NUM", type=float, help="Minimum slice size in %% (1-100)")
     detect_group.add_argument("-max", "--maximum-size", metavar="NUM", type=float, help="Maximum slice size in %% (1-100)")
+    detect_group.add_argument("-detect", "--detect-mode", metavar="TEXT", type=str, default="fixed", help="Slice detection (fixed, pyramid)")
+    detect_group.add_argument("-coarseW", "--coarse-width", metavar="NUM", type=int, default=400, help="Width of the coarse pass in pyramid detection (100-1000)")
+    detect_group.add_argument("-refineS", "--refine-size", metavar="NUM", type=int, default=600, help="Max size of the refined slice crops in pyramid detection (100-4000)")
 
     scale_group = parser.add_argument_group("Image slice scaling")
     scale_group.add_argument("-scaleF", "--scale-factor", metavar="NUM", type=float, help="Scale slice with factor value")
@@ -93,6 +109,7 @@ def conf_parser_p(p):
 
     format_group = parser.add_argument_group("File format")
     format_group.add_argument("-save", "--save-format", metavar="TEXT", type=str, help="File format for slices")
+    format_group.add_argument("-enc", "--encoder", metavar="TEXT", type=str, default="auto", help="Encoder for slices (auto, pillow, opencv)")
     format_group.add_argument("-pngO", "--png-optimize", action="store_true", help="Try to optimize PNG file")
     format_group.add_argument("-pngC", "--png-compression", metavar="NUM", type=int, help="Try to compress PNG file (0-9)")
     format_group.add_argument("-jpegO", "--jpeg-optimize", action="store_true", help="Optimize JPEG file")
@@ -101,10 +118,53 @@ def conf_parser_p(p):
     format_group.add_argument("-webpM", "--webp-method", metavar="NUM", type=int, help="WebP saving speed/quality tradeoff (0-6)")
     format_group.add_argument("-webpQ", "--webp-quality", metavar="NUM", type=int, help="Quality of WebP file (1-100)")
 
+    output_group = parser.add_argument_group("Slice output")
+    output_group.add_argument("-archive", "--output-archive", metavar="TEXT", type=str, default="none", help="Write slices into archive containers (none, tar, zip)")
+    output_group.add_argument("-shard", "--archive-shard", metavar="TEXT", type=str, default="run", help="Create one archive per run or per input folder (run, folder)")
+    output_group.add_argument("-rend", "--renditions", nargs="+", metavar="SPEC", type=str, default=[], help="Save extra renditions of each slice (e.g. 'web:width=1600,format=webp,quality=80')")
+
+    dedup_group = parser.add_argument_group("Duplicate scans")
+    dedup_group.add_argument("-dedup", "--dedup-mode", metavar="TEXT", type=str, default="off", help="Skip duplicate scans or slices (off, scan, slice)")
+    dedup_group.add_argument("-dedupD", "--dedup-distance", metavar="NUM", type=int, default=4, help="Max differing bits of perceptual hash (0-16)")
+
+    watch_group = parser.add_argument_group("Watch mode")
+    watch_group.add_argument("-watchI", "--watch-interval", metavar="NUM", type=float, default=2.0, help="Seconds between input directory checks")
+    watch_group.add_argument("-watchS", "--watch-settle", metavar="NUM", type=float, default=5.0, help="Seconds an image has to stay unchanged before slicing")
+
+    stream_group = parser.add_argument_group("Stream mode")
+    stream_group.add_argument("-streamI", "--stream-input", metavar="PATH", type=str, default="-", help="Read scans from file or named pipe instead of stdin (-)")
+
+    serve_group = parser.add_argument_group("Serve mode")
+    serve_group.add_argument("-host", "--serve-host", metavar="TEXT", type=str, default="127.0.0.1", help="Address the HTTP service listens on")
+    serve_group.add_argument("-port", "--serve-port", metavar="NUM", type=int, default=8765, help="Port the HTTP service listens on")
+    serve_group.add_argument("-serveQ", "--serve-queue", metavar="NUM", type=int, default=16, help="Max requests running or waiting, others are rejected")
+    serve_group.add_argument("-serveT", "--serve-timeout", metavar="NUM", type=float, default=120.0, help="Seconds before a request times out")
+    serve_group.add_argument("-serveM", "--serve-max-upload", metavar="NUM", type=int, default=1024, help="Max size of uploaded image in MB")
+
+    sheet_group = parser.add_argument_group("Headless test mode")
+    sheet_group.add_argument("-headless", "--headless-test", action="store_true", default=False, help="Test mode writes detection overlays as contact sheets instead of showing the GUI")
+    sheet_group.add_argument("-sheetT", "--sheet-tiles", metavar="NUM", type=int, default=20, help="Number of overlays on one contact sheet")
+    sheet_group.add_argument("-tileW", "--tile-width", metavar="NUM", type=int, default=360, help="Width of an overlay on the contact sheet")
+
+    metrics_group = parser.add_argument_group("Run metrics")
+    metrics_group.add_argument("-stats", "--progress-stats", action="store_true", help="Show throughput and worker utilization in the progress bar")
+    metrics_group.add_argument("-metrics", "--metrics-file", metavar="FILE", type=str, default="", help="Write run metrics into file (e.g. for node exporter textfile collector)")
+    metrics_group.add_argument("-metricsF", "--metrics-format", metavar="TEXT", type=str, default="prometheus", help="Format of metrics file (prometheus, jsonl)")
+    metrics_group.add_argument("-metricsI", "--metrics-interval", metavar="NUM", type=float, default=10.0, help="Seconds between metrics file updates")
+
+    limit_group = parser.add_argument_group("Time limits")
+    limit_group.add_argument("-softT", "--soft-timeout", metavar="NUM", type=float, default=0.0, help="Warn about images that take longer than this many seconds (0 = disabled)")
+    limit_group.add_argument("-hardT", "--hard-timeout", metavar="NUM", type=float, default=0.0, help="Stop and quarantine images that take longer than this many seconds (0 = disabled)")
+
+    queue_group = parser.add_argument_group("Shared work queue")
+    queue_group.add_argument("-queue", "--queue-path", metavar="PATH", type=str, default="", help="PATH to shared work queue, slice mode queues tasks instead of slicing")
+    queue_group.add_argument("-queueL", "--queue-lease", metavar="NUM", type=float, default=60.0, help="Seconds without heartbeat before a task goes back to the queue")
+
     list_group = parser.add_argument_group("List information")
     list_group.add_argument("-listI", "--list-images", action="store_true", default=False, help="List all compatible scanned images")
     list_group.add_argument("-listF", "--list-file", action="store_true", default=False, help="Save list of compatible scanned images as text file")
     list_group.add_argument("-listT", "--list-tasks", action="store_true", default=False, help="List tasks")
+    list_group.add_argument("-noScan", "--no-scan", action="store_true", default=False, help="Use image catalog from the last scan without scanning input path")
 
     task_group = parser.add_argument_group("Task handling")
     task_group.add_argument("-addA", "--add-all", action="store_true", default=False, help="Add all compatible images")
@@ -112,13 +172,26 @@ def conf_parser_p(p):
     task_group.add_argument("-addN", "--add-new", metavar="NUM", type=int, help="Add compatible images by modified timestamp (newest)")
     task_group.add_argument("-addO", "--add-old", metavar="NUM", type=int, help="Add compatible images by modified timestamp (oldest)")
     task_group.add_argument("-addR", "--add-random", metavar="NUM", type=int, help="Add compatible images randomly")
+    task_group.add_argument("-addG", "--add-glob", nargs="+", metavar="PATTERN", type=str, help="Add compatible images by relative path pattern (e.g. 'Album/*.jpg')")
+    task_group.add_argument("-addRe", "--add-regex", metavar="REGEX", type=str, help="Add compatible images by regular expression on relative path")
+    task_group.add_argument("-addF", "--add-folder", nargs="+", metavar="PATH", type=str, help="Add compatible images inside subfolders of input path (including their subfolders)")
+    task_group.add_argument("-onlyF", "--only-format", nargs="+", metavar="FORMAT", type=str, help="Only keep added images in these formats")
+    task_group.add_argument("-onlyA", "--only-after", metavar="DATE", type=str, help="Only keep added images modified on or after date (YYYY-MM-DD)")
+    task_group.add_argument("-onlyB", "--only-before", metavar="DATE", type=str, help="Only keep added images modified before date (YYYY-MM-DD)")
+    task_group.add_argument("-onlyMin", "--only-min-size", metavar="MB", type=float, help="Only keep added images of at least this size")
+    task_group.add_argument("-onlyMax", "--only-max-size", metavar="MB", type=float, help="Only keep added images of at most this size")
+    task_group.add_argument("-onlyN", "--only-not-sliced", action="store_true", default=False, help="Only keep added images that earlier runs in output path have not sliced")
     task_group.add_argument("-remID", "--remove-id", nargs="+", metavar="NUM", type=int, help="Remove already added compatible images by ID")
+    task_group.add_argument("-resume", "--resume", metavar="RUN_ID", type=str, help="Continue interrupted slice run")
 
     gui_group = parser.add_argument_group("GUI Settings")
     gui_group.add_argument("-fontS", "--font-scale", metavar="NUM", type=float, help="Font scale for GUI")
     gui_group.add_argument("-theme", "--theme", metavar="TEXT", type=str, help="Color theme for FreeSimpleGUI")
     gui_group.add_argument("-viewW", "--view-width", metavar="NUM", type=int, help="Max image width inside GUI")
     gui_group.add_argument("-viewH", "--view-height", metavar="NUM", type=int, help="Max image height inside GUI")
+    gui_group.add_argument("-browse", "--browse-grid", action="store_true", default=False, help="Test and preview mode start with a thumbnail grid of all tasks")
+    gui_group.add_argument("-thumbW", "--thumb-width", metavar="NUM", type=int, default=200, help="Width of thumbnails in the grid")
+    gui_group.add_argument("-gridC", "--grid-columns", metavar="NUM", type=int, default=5, help="Number of thumbnail columns in the grid")
 
     unknown = None
 
@@ -151,6 +224,14 @@ def conf_parser_p(p):
         p.run_mode = "slice mode"
     elif p.count_mode:
         p.run_mode = "count mode"
+    elif p.watch_mode:
+        p.run_mode = "watch mode"
+    elif p.serve_mode:
+        p.run_mode = "serve mode"
+    elif p.stream_mode:
+        p.run_mode = "stream mode"
+    elif p.worker_mode:
+        p.run_mode = "worker mode"
     else:
         p.run_mode = ""
 
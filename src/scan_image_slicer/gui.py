@@ -8,19 +8,20 @@ import FreeSimpleGUI as sg
 from PIL import Image
 from .utils import *
 from .gui_widgets import *
+from .scis_thumbs import ThumbnailLoader, thumb_size, THUMB_SETTINGS
 
 # Popup info message
 def popup_msg(msg):
     sg.popup(f"{msg}", auto_close=True, auto_close_duration=3, no_titlebar=True)
 
 # Show preview of sliced image
-def show_preview_gui(p, scis_img):
+def show_preview_gui(p, scis_img, shared=None):
     logger = logging.getLogger()
     sg.theme(p.theme)
     window_title = "Scan-Image-Slicer - Preview mode"
     layout = []
     widgets = []
-    preview_images = scis_img.create_preview_images(p)
+    preview_images = scis_img.create_preview_images(p, shared)
     image_count = len(preview_images)
     sentinel = False
     image_index = 0
@@ -348,4 +349,168 @@ def show_test_gui(p, scis_img):
             window["false_slice_count"].update(update_ignored_count_txt(scis_img.false_slice_count))
 
     window.close()
-    return scis_img.slice_count, sentinel
\ No newline at end of file
+    return scis_img.slice_count, sentinel
+
+# PNG data of a cached JPEG thumbnail for the GUI
+def thumb_buffer(jpeg):
+    return pil_to_buffer(cv_to_pil(cv.imdecode(np.frombuffer(jpeg, np.uint8), cv.IMREAD_COLOR)))
+
+# Show scrollable grid of detection thumbnails for all tasks
+# Only the visible cells are drawn, the same cells are reused while scrolling and
+# clicking a cell opens the test or preview window of the image
+def show_browser_gui(p, queue, images, shared=None):
+    sg.theme(p.theme)
+    window_title = f"Scan-Image-Slicer - {p.run_mode.capitalize()}"
+    layout = []
+    widgets = []
+    grid = []
+    thumb_w, thumb_h = thumb_size(p)
+    columns = p.grid_columns
+    rows = max(1, min(p.view_height // (thumb_h + 40), -(-len(images) // columns)))
+    max_offset = max(-(-len(images) // columns) - rows, 0)
+    placeholder = pil_to_buffer(cv_to_pil(np.full((thumb_h, thumb_w, 3), 64, dtype=np.uint8)))
+    loader = ThumbnailLoader(p, queue, images)
+    offset = 0
+    result = 0
+
+    # Index of the image in the cell
+    def cell_index(row, column):
+        return (offset + row) * columns + column
+
+    # Visible images first, then the next page
+    def wanted():
+        first = offset * columns
+        return list(range(first, min(first + 2 * rows * columns, len(images))))
+
+    def str_status():
+        return f"Images {offset * columns + 1}-{min((offset + rows) * columns, len(images))} of {len(images)}"
+
+    def update_cell(row, column):
+        i = cell_index(row, column)
+        tile = loader.tiles.get(i)
+
+        if i >= len(images):
+            window[("thumb", row, column)].update(data=placeholder)
+            window[("label", row, column)].update("")
+        elif not tile:
+            window[("thumb", row, column)].update(data=placeholder)
+            window[("label", row, column)].update(f"{images[i].id}: {images[i].name}\nLoading..")
+        elif not tile["jpeg"]:
+            window[("thumb", row, column)].update(data=placeholder)
+            window[("label", row, column)].update(f"{images[i].id}: {images[i].name}\nCould not read image")
+        else:
+            window[("thumb", row, column)].update(data=thumb_buffer(tile["jpeg"]))
+            window[("label", row, column)].update(f"{images[i].id}: {images[i].name}\n{tile['valid']} valid, {tile['rejected']} rejected")
+
+    def update_grid():
+        loader.request(wanted())
+
+        for row in range(rows):
+            for column in range(columns):
+                update_cell(row, column)
+
+        window["status"].update(str_status())
+
+    def scroll(to):
+        nonlocal offset
+        to = min(max(int(to), 0), max_offset)
+
+        if to != offset:
+            offset = to
+            window["scroll"].update(value=offset)
+            update_grid()
+
+    # Grid of reusable cells
+    for row in range(rows):
+        grid.append([
+            Column([
+                [Image(placeholder, key=("thumb", row, column), enable_events=True, size=(thumb_w, thumb_h))],
+                [Text(p, "", key=("label", row, column), size=(max(10, thumb_w // 8), 2))],
+            ])
+            for column in range(columns)
+        ])
+
+    widgets.append([Header(p, f"{len(images)} images")])
+    widgets.append([Text(p, "", key="status")])
+    widgets.append([Text(p, "Click a thumbnail to open it")])
+    widgets.append([sg.HorizontalSeparator(p=(0, 5))])
+    widgets.append([Button(p, "Page up"), Button(p, "Page down")])
+    widgets.append([Button(p, "Close")])
+
+    scrollbar = sg.Slider(range=(0, max_offset), default_value=0, orientation="v", disable_number_display=True,
+                          enable_events=True, disabled=not max_offset, expand_y=True, key="scroll")
+
+    layout.append([Column(grid), scrollbar, Column(widgets)])
+
+    # Window stays open while images are opened from it
+    window = Window(window_title, layout, finalize=True)
+
+    for key, event in [("<Prior>", "Page up"), ("<Next>", "Page down"), ("<Up>", "row_up"), ("<Down>", "row_down"),
+                       ("<MouseWheel>", "wheel"), ("<Button-4>", "row_up"), ("<Button-5>", "row_down")]:
+        window.bind(key, event)
+
+    update_grid()
+
+    # Run the GUI, check for rendered thumbnails between events
+    while True:
+        event, values = window.read(timeout=100 if loader.busy() else None)
+
+        if event in [sg.WIN_CLOSED, "Close"]:
+            break
+
+        if event == sg.TIMEOUT_EVENT:
+            for i in loader.poll():
+                row, column = divmod(i - offset * columns, columns)
+
+                if row in range(rows):
+                    update_cell(row, column)
+
+        if event == "scroll":
+            scroll(values["scroll"])
+
+        if event == "wheel":
+            scroll(offset - (1 if window.user_bind_event.delta > 0 else -1))
+
+        if event in ["row_up", "row_down"]:
+            scroll(offset + (1 if event == "row_down" else -1))
+
+        if event in ["Page up", "Page down"]:
+            scroll(offset + (rows if event == "Page down" else -rows))
+
+        # Open image, Next image goes on with the following images and Abort returns to the grid
+        if isinstance(event, tuple) and event[0] == "thumb":
+            i = cell_index(event[1], event[2])
+            settings = [getattr(p, name) for name in THUMB_SETTINGS]
+
+            while i < len(images):
+                images[i].slice_count = 0
+                images[i].false_slice_count = 0
+
+                if p.test_mode:
+                    val, sentinel = show_test_gui(p, images[i])
+                else:
+                    val, sentinel = show_preview_gui(p, images[i], shared)
+                    images[i].release_preview_images()
+
+                result += val
+
+                if sentinel:
+                    break
+
+                i += 1
+
+            # Thumbnails of new detection values
+            if settings != [getattr(p, name) for name in THUMB_SETTINGS]:
+                loader.reset()
+
+            # Show the last opened image
+            row = min(i, len(images) - 1) // columns
+
+            if row not in range(offset, offset + rows):
+                scroll(row)
+
+            update_grid()
+
+    loader.close()
+    window.close()
+    return result
@@ -2,7 +2,6 @@
 # website:   http://www.pyimagesearch.com
 
 # import the necessary packages
-from scipy.spatial import distance as dist
 import numpy as np
 import cv2
 
@@ -26,6 +25,7 @@ def order_points(pts):
     # top-left and right-most points; by the Pythagorean
     # theorem, the point with the largest distance will be
     # our bottom-right point
+    from scipy.spatial import distance as dist # Edit: import scipy only when perspective fix is used
     D = dist.cdist(tl[np.newaxis], rightMost, "euclidean")[0]
     (br, tr) = rightMost[np.argsort(D)[::-1], :]
 
@@ -33,7 +33,7 @@ def order_points(pts):
     # bottom-right, and bottom-left order
     return np.array([tl, tr, br, bl], dtype="float32")
 
-def four_point_transform(image, pts, bvalue): # Edit: add param bvalue so we can use custom border color (instead of default black)
+def four_point_size(pts): # Edit: size of the warped image without warping, split from four_point_transform
     # obtain a consistent order of the points and unpack them
     # individually
     rect = order_points(pts)
@@ -53,6 +53,13 @@ def four_point_transform(image, pts, bvalue): # Edit: add param bvalue so we can
     heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
     maxHeight = max(int(heightA), int(heightB))
 
+    return maxWidth, maxHeight
+
+def four_point_transform(image, pts, bvalue): # Edit: add param bvalue so we can use custom border color (instead of default black)
+    # obtain a consistent order of the points and the size of the new image
+    rect = order_points(pts)
+    (maxWidth, maxHeight) = four_point_size(pts)
+
     # now that we have the dimensions of the new image, construct
     # the set of destination points to obtain a "birds eye view",
     # (i.e. top-down view) of the image, again specifying points
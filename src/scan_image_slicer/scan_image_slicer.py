@@ -4,10 +4,19 @@ import os
 import sys
 import multiprocessing
 
+from multiprocessing.managers import SyncManager
+
 from .confparser import conf_parser_p
 from .scis import *
 from .utils import create_statusline
 from .scis_logger import *
+from .scis_watch import watch_input
+from .scis_server import serve_requests
+from .scis_stream import stream_slices
+from .scis_journal import resume_tasks
+from .scis_tasks import has_task_options
+from .scis_catalog import open_catalog
+from .scis_queue import enqueue_tasks, work_queue
 
 class Param:
     pass
@@ -15,7 +24,9 @@ class Param:
 def main():
     p = Param()
     tasks = []
-    queue = multiprocessing.Manager().Queue(-1)
+    manager = SyncManager()
+    manager.start(ignore_sigint)
+    queue = manager.Queue(-1)
 
     # Create path for config file based on platform
     if sys.platform in ["win32", "cygwin"]:
@@ -45,15 +56,33 @@ def main():
     p = conf_parser_p(p)
 
     if p.cont:
-        # Print the statusline
-        print(create_statusline(p.name, p.version, p.description, p.path_config_file), flush=True)
+        # Print the statusline (stdout is for slices in stream mode)
+        out = sys.stderr if p.stream_mode else sys.stdout
+        print(create_statusline(p.name, p.version, p.description, p.path_config_file), file=out, flush=True)
 
         # Parse params
         p = parse_p(p)
 
-    if p.cont:
-        # Collect images from input path
-        images = collect_images(p.input)
+    if p.cont and p.watch_mode:
+        # Slice new images as they arrive in the input path
+        watch_input(queue, p)
+
+    elif p.cont and p.serve_mode:
+        # Slice images sent to the HTTP service
+        serve_requests(p)
+
+    elif p.cont and p.stream_mode:
+        # Slice scans from stdin and write the slices to stdout
+        stream_slices(p)
+
+    elif p.cont and p.worker_mode:
+        # Slice tasks from the shared work queue
+        work_queue(queue, p)
+
+    elif p.cont:
+        # Collect images from input path (the catalog keeps IDs the same across runs)
+        catalog = open_catalog(p)
+        images = catalog.images(p.input)
 
         if images:
             # List all compatible images from input directory
@@ -65,10 +94,14 @@ def main():
                 save_imagelist_as_txt(p.output, p.project_name, images)
 
             # Add or remove tasks
-            if any([p.add_all, p.add_id, p.add_new, p.add_old, p.add_random, p.remove_id]):
+            if has_task_options(p):
                 tasks = handle_tasks(p, images)
                 tasks = sorted(tasks, key=int)
 
+            # Continue interrupted slice run with the tasks it has left
+            if p.resume:
+                tasks = resume_tasks(p, images)
+
             # List tasks
             if p.list_tasks:
                 list_tasks(tasks, images)
@@ -77,15 +110,29 @@ def main():
             if any([p.test_mode, p.preview_mode, p.slice_mode, p.count_mode]):
                 if tasks:
                     if confirm(p.skip_confirm, len(tasks), p.run_mode):
-                        run_tasks(queue, p, tasks, images)
 
-                        if p.slice_mode:
-                            sequential_parallel_rename(p)
+                        # Workers on any host slice the queued tasks
+                        if p.slice_mode and p.queue_path:
+                            enqueue_tasks(p, tasks, images)
+
+                        else:
+                            finished = run_tasks(queue, p, tasks, images, catalog)
+
+                            if finished and p.slice_mode and p.output_archive == "none":
+                                sequential_parallel_rename(p)
+
+                # Resumed run was interrupted after slicing all images
+                elif p.resume and p.cont:
+                    sequential_parallel_rename(p)
+                    logger.info(f"Output: {p.unique_path}\n")
+
                 else:
                     logger.info("Add some tasks before using action modes\n")
         else:
             logger.info(f"No compatible images found at: {p.input}\n")
 
+        catalog.close()
+
     if p.run_mode:
         logger.info(f"View runlog at: {p.log_path}\n")
 
@@ -1,96 +1,383 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import timeit
 import random
 import logging
 
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from operator import itemgetter
+from itertools import islice
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from tqdm.auto import tqdm
 from time import strftime, localtime, gmtime
-from .gui import show_preview_gui, show_test_gui
-from .scis_image import ScanImageSlicerImage
+from .scis_archive import start_archive, stop_archive
+from .scis_slicer import check_slice_values
+from .scis_encoder import SliceEncoder
+from .scis_journal import start_journal, journal_image, journal_source, remove_stale_slices, RunJournal
+from .scis_dedup import start_dedup, stop_dedup
+from .scis_metrics import start_metrics, stop_metrics
+from .scis_prefetch import start_prefetch
+from .scis_shm import SharedWorkers
+from .scis_executor import create_executor, EXECUTORS
+from .scis_watchdog import BatchWorkers, Watchdog, RunReport, skip_quarantined
+from .scis_logger import ignore_sigint
+from .scis_rendition import renditions_from_p, rendition_path, rendition_renames
+from .scis_sheets import ContactSheets, tile_size
+from .scis_tasks import TaskIndex, parse_date, add_options, only_options, has_task_options
 from .utils import *
 
-def run_tasks(queue, p, tasks, images):
+def run_tasks(queue, p, tasks, images, catalog=None):
     logger = logging.getLogger()
 
-    # Create unique run id
-    p.run_id = p.project_name + "_{:%Y_%m_%d_%H_%M_%S}".format(datetime.now())
-
-    # Create unique run path
-    p.unique_path = os.path.join(p.output, p.run_id)
+    # Create unique run id and path (resumed runs continue in their old path)
+    if not p.resume:
+        p.run_id = p.project_name + "_{:%Y_%m_%d_%H_%M_%S}".format(datetime.now())
+        p.unique_path = os.path.join(p.output, p.run_id)
 
     result = 0
     workers = 1
+    journal = None
+    dedup = None
+    metrics = None
+    sheets = None
+    stopped = False
+    report = RunReport(p)
 
     start = timeit.default_timer()
     logger.info("%s started @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
 
+    # Modes that go through the tasks without the GUI
+    batch = p.count_mode or p.slice_mode or (p.test_mode and p.headless_test)
+
     # Enable more workers if needed
-    if p.count_mode or p.slice_mode:
+    if batch:
         workers = p.workers
 
-    # Do we need multiprocessing?
-    if workers > 1 and len(tasks) > 1:
+    # Images that hung or crashed a worker in earlier runs are skipped
+    if batch:
+        tasks, quarantine = skip_quarantined(p, tasks, images, report)
+
+    # Time limits of the images, hard limit needs workers that can be killed
+    watchdog = Watchdog(p.soft_timeout, p.hard_timeout)
+    isolated = batch and p.hard_timeout > 0
 
-        logger.info(f"Use multiprocessing with {workers} workers")
+    # Headless test mode writes the detection overlays as contact sheets
+    if p.test_mode and p.headless_test:
+        sheets = ContactSheets(p, len(tasks))
 
-        with ProcessPoolExecutor(max_workers=workers) as executor:
+    # Start archive writer for the slices
+    if p.slice_mode and p.output_archive != "none":
+        archive = start_archive(p, workers)
+
+    # Keep journal of finished images so the run can be resumed
+    elif p.slice_mode:
+        journal = RunJournal(p.unique_path) if p.resume else start_journal(p, tasks, images)
+        suffix = SliceEncoder(p).suffix
+
+    # Share hash index of scans and slices between the workers
+    if p.slice_mode and p.dedup_mode != "off":
+        dedup = start_dedup(p)
+
+    # Collect throughput of all workers for progress stats and metrics file
+    if p.count_mode or p.slice_mode:
+        metrics = start_metrics(p, len(tasks))
 
-            # Create progress bar for our tasks
-            with tqdm(total=len(tasks), desc=":: Progress", unit=" images", ncols=100) as pbar:
-                futures = {}
+    # Read files of the next tasks ahead of the workers
+    prefetcher = start_prefetch(p, [images[task] for task in tasks])
 
-                # Split our tasks for the executor
-                for i, task in enumerate(tasks):
+    # Progress bar needs more room for the stats
+    ncols = 160 if p.progress_stats else 100
 
-                    if p.count_mode:
-                        future = executor.submit(images[task].count_slices, queue, p)
-                    elif p.slice_mode:
-                        future = executor.submit(images[task].save_slices, queue, p)
+    # Do we need multiprocessing? Hard time limits always need worker processes
+    if (workers > 1 and len(tasks) > 1) or isolated:
 
-                    futures[future] = i
+        logger.info(f"Use multiprocessing with {workers} {p.executor} workers")
 
-                for future in as_completed(futures):
-                    i = futures[future]
-                    result += future.result()
-                    pbar.update(1)
+        # Workers ignore Ctrl-C, the main process stops them after their images are done
+        # With a hard time limit every worker is its own process so it can be killed alone
+        executor = BatchWorkers(p.executor, workers, isolated, ignore_sigint)
+
+        # Only a window of tasks is in flight, the next ones are submitted as results come in
+        limit = workers if isolated else workers * p.task_window
+        pending = iter(enumerate(tasks))
+        futures = {}
+
+        def submit(i, task):
+            if p.count_mode:
+                return executor.submit(i, images[task].count_slices, queue, p)
+            elif p.slice_mode:
+                return executor.submit(i, images[task].save_slices, queue, p)
+            elif sheets:
+                return executor.submit(i, images[task].create_test_tile, queue, p, *tile_size(p))
+
+        # Image gave no result, the run goes on without it
+        def skip(i, image):
+            if dedup:
+                p.dedup_index.discard(journal_source(p, image))
+
+            if sheets:
+                sheets.add(i, {"id": image.id, "source": journal_source(p, image), "valid": 0, "rejected": 0, "jpeg": None})
+
+            pbar.update(1)
+
+            if prefetcher:
+                prefetcher.done(image.filepath)
+
+        # Worker process died, only the image it was running is quarantined
+        # The other images of its pool run again, images that were already writing to an archive can't
+        def crashed(i, future):
+            image = images[tasks[i]]
+            started, lost = executor.crashed(future)
+
+            if started and journal:
+                remove_stale_slices(p, image, suffix)
+
+            if lost:
+                reason = "Worker crashed"
+                logger.error(f"[ID:{image.id}] - ({image.name}) - {reason}, quarantined")
+                report.add("failed", image, error=reason)
+                quarantine.add(image, p.run_id, reason)
+            elif started and p.slice_mode and p.output_archive != "none":
+                reason = "Worker of another image crashed"
+                logger.error(f"[ID:{image.id}] - ({image.name}) - {reason}")
+                report.add("failed", image, error=reason)
+            elif not stopped:
+                if dedup:
+                    p.dedup_index.discard(journal_source(p, image))
+
+                futures[submit(i, tasks[i])] = i
+                return
+
+            skip(i, image)
+
+        # Hand finished images to the progress bar, journal, catalog and contact sheets
+        def collect(done):
+            nonlocal result
+
+            for future in done:
+
+                # Image was started again after a crash
+                if future not in futures:
+                    continue
+
+                i = futures.pop(future)
+                image = images[tasks[i]]
+                watchdog.forget(future)
+
+                try:
+                    count = future.result()
+                except BrokenProcessPool:
+                    crashed(i, future)
+                    continue
+                except Exception as e:
+                    executor.done(future)
+                    logger.error(f"[ID:{image.id}] - ({image.name}) - {e}")
+                    report.add("failed", image, error=str(e))
+                    skip(i, image)
+                    continue
+
+                executor.done(future)
+
+                if sheets:
+                    sheets.add(i, count)
+                    count = count["valid"]
+
+                result += count
+                pbar.update(1)
+
+                if prefetcher:
+                    prefetcher.done(image.filepath)
+
+                if journal:
+                    journal_image(p, journal, image, count, suffix)
+
+                # Hashes are saved only after the scan is journaled, so a resumed run slices it again
+                if dedup:
+                    p.dedup_index.commit(journal_source(p, image))
+
+                if catalog and not sheets:
+                    catalog.record(image, count, p.run_id if p.slice_mode else None)
+
+        # Warn about slow images, stop and quarantine images over the hard limit
+        def watch():
+            slow, expired = watchdog.check(futures, executor.start_times())
+
+            for future, seconds in slow:
+                image = images[tasks[futures[future]]]
+                logger.warning(f"[ID:{image.id}] - ({image.name}) - Still running after {seconds:.0f} seconds")
+                report.add("slow", image, seconds=round(seconds, 1))
+
+            for future, seconds in expired:
+                i = futures.pop(future)
+                image = images[tasks[i]]
+                watchdog.forget(future)
+                executor.kill(future)
+
+                reason = f"Stopped after {seconds:.0f} seconds"
+                logger.error(f"[ID:{image.id}] - ({image.name}) - {reason}, quarantined")
+                report.add("timeout", image, seconds=round(seconds, 1))
+                quarantine.add(image, p.run_id, reason)
+
+                if journal:
+                    remove_stale_slices(p, image, suffix)
+
+                skip(i, image)
+
+        # Create progress bar for our tasks
+        with tqdm(total=len(tasks), desc=":: Progress", unit=" images", ncols=ncols) as pbar:
+
+            if metrics:
+                metrics.attach(pbar)
+
+            try:
+                while True:
+                    for i, task in islice(pending, limit - len(futures)):
+                        futures[submit(i, task)] = i
+
+                    if not futures:
+                        break
+
+                    if metrics:
+                        p.metrics.set_queue_depth(len(futures))
+
+                    collect(wait(futures, timeout=watchdog.interval(), return_when=FIRST_COMPLETED).done)
+                    watch()
+
+                    if metrics:
+                        p.metrics.set_queue_depth(len(futures))
+
+            except KeyboardInterrupt:
+                stopped = True
+
+                # Images that have not started are dropped, running ones are finished
+                for future in futures:
+                    future.cancel()
+
+                for future in [future for future in futures if future.cancelled()]:
+                    del futures[future]
+                    executor.done(future)
+
+                logger.info(f"Stopping {p.run_mode}, waiting for {len(futures)} images to finish (Ctrl-C again to abort)")
+
+                try:
+                    while futures:
+                        collect(wait(futures, timeout=watchdog.interval(), return_when=FIRST_COMPLETED).done)
+                        watch()
+                except KeyboardInterrupt:
+                    logger.info("Aborting")
+
+        executor.shutdown(wait=not futures, cancel_futures=True)
+
+    # Grid browser of all tasks, images are opened from there
+    elif p.browse_grid and (p.test_mode or p.preview_mode) and not sheets:
+        from .gui import show_browser_gui
+
+        shared = SharedWorkers(p.workers, p.executor) if p.preview_mode and p.workers > 1 else None
+        result = show_browser_gui(p, queue, [images[task] for task in tasks], shared)
+
+        if shared:
+            shared.close()
     else:
 
+        # Load GUI only for the modes that use it
+        if (p.test_mode and not sheets) or p.preview_mode:
+            from .gui import show_preview_gui, show_test_gui
+
+        # Preview slices are cut by workers from a scan in shared memory
+        shared = SharedWorkers(p.workers, p.executor) if p.preview_mode and p.workers > 1 else None
+
         # Create progress bar for our tasks
-        pbar = tqdm(tasks, desc=":: Progress", unit=" images", ncols=100)
+        pbar = tqdm(tasks, desc=":: Progress", unit=" images", ncols=ncols)
 
-        # Go over tasks one by one
-        for task in pbar:
-            if p.count_mode:
-                result += images[task].count_slices(queue, p)
+        if metrics:
+            metrics.attach(pbar)
 
-            if p.test_mode:
-                val, sentinel = show_test_gui(p, images[task])
-                result += val
+        # Go over tasks one by one, Ctrl-C stops the run
+        try:
+            for n, task in enumerate(pbar):
+                if metrics:
+                    p.metrics.set_queue_depth(len(tasks) - n)
 
-                if sentinel:
-                    break
+                if p.count_mode:
+                    count = images[task].count_slices(queue, p)
+                    result += count
 
-            elif p.preview_mode:
-                val, sentinel = show_preview_gui(p, images[task])
-                result += val
+                    if catalog:
+                        catalog.record(images[task], count)
 
-                if sentinel:
-                    break
+                if sheets:
+                    tile = images[task].create_test_tile(queue, p, *tile_size(p))
+                    sheets.add(n, tile)
+                    result += tile["valid"]
 
-            elif p.slice_mode:
-                result += images[task].save_slices(queue, p)
+                elif p.test_mode:
+                    val, sentinel = show_test_gui(p, images[task])
+                    result += val
+
+                    if sentinel:
+                        break
+
+                elif p.preview_mode:
+                    val, sentinel = show_preview_gui(p, images[task], shared)
+                    images[task].release_preview_images()
+                    result += val
+
+                    if sentinel:
+                        break
+
+                elif p.slice_mode:
+                    count = images[task].save_slices(queue, p)
+                    result += count
+
+                    if journal:
+                        journal_image(p, journal, images[task], count, suffix)
+
+                    if dedup:
+                        p.dedup_index.commit(journal_source(p, images[task]))
+
+                    if catalog:
+                        catalog.record(images[task], count, p.run_id)
+
+                if prefetcher:
+                    prefetcher.done(images[task].filepath)
+
+        except KeyboardInterrupt:
+            stopped = True
+            logger.info(f"Stopping {p.run_mode}")
+
+        if shared:
+            shared.close()
+
+    if prefetcher:
+        prefetcher.close()
+
+    # Stop archive writer
+    if p.slice_mode and p.output_archive != "none":
+        stop_archive(p, archive)
+
+    if journal:
+        journal.close()
+
+    if dedup:
+        stop_dedup(p, dedup)
+
+    if p.count_mode or p.slice_mode:
+        stop_metrics(p, metrics)
+
+    if sheets:
+        sheets.close()
+
+    # Report slow, stopped and failed images
+    report_file = report.write(len(tasks), stopped) if batch else None
 
     # Stop timer and calculate time lapsed
     stop = timeit.default_timer()
     seconds = (stop - start)
     timer_result = strftime("%H hours, %M minutes and %S seconds", gmtime(seconds))
 
-    logger.info("%s finished @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info("%s %s @ %s", p.run_mode.capitalize(), "stopped" if stopped else "finished", strftime("%a %d %b %Y %H:%M:%S", localtime()))
     logger.info("Time lapsed: %s", timer_result)
 
     # Report results
@@ -100,13 +387,30 @@ def run_tasks(queue, p, tasks, images):
     if p.slice_mode:
         logger.info(f"Output: {p.unique_path}\n")
 
+        for rendition in renditions_from_p(p):
+            logger.info(f"Rendition {rendition.name}: {rendition_path(p, rendition)}\n")
+
+    if sheets:
+        logger.info(f"Contact sheets: {os.path.join(p.unique_path, 'index.html')}\n")
+
+    if report.images:
+        logger.info(f"Slow images: {report.count('slow')}, stopped: {report.count('timeout')}, failed: {report.count('failed')}, skipped as quarantined: {report.count('quarantined')}")
+        logger.info(f"Report: {report_file}\n")
+
+    # Slices of a stopped run keep their temporary names until the run is resumed
+    if stopped and journal:
+        logger.info(f"Continue the run with: --resume {p.run_id}\n")
+
+    return not stopped
+
 # Parse parameters
 def parse_p(p):
     logger = logging.getLogger()
     errors = []
 
     # Sanitize value paths
-    p.input = os.path.normpath(os.path.expanduser(p.input))
+    # Input is resolved so catalog and quarantine keep the same keys however the path is given
+    p.input = os.path.realpath(os.path.expanduser(p.input))
     p.output = os.path.normpath(os.path.expanduser(p.output))
 
     if p.filter_lut_path:
@@ -116,31 +420,108 @@ def parse_p(p):
     if not p.project_name:
         p.project_name = "NewProject"
 
-    # Make sure input path exists
-    if not os.path.exists(p.input):
-        errors.append(f"Input path does not exist: {p.input}")
+    if p.queue_path:
+        p.queue_path = os.path.normpath(os.path.expanduser(p.queue_path))
 
-    # Make sure output path exists
-    if not os.path.exists(p.output):
-        errors.append(f"Output path does not exist: {p.output}")
+    # Stream mode does not use the input and output paths
+    if p.stream_mode:
+        if p.stream_input != "-" and not os.path.exists(p.stream_input):
+            errors.append(f"Stream input does not exist: {p.stream_input}")
 
-    # Make sure we have valid LUT file
-    if p.filter_lut_path:
-        if os.path.isfile(p.filter_lut_path):
-            if not p.filter_lut_path.lower().endswith(".cube"):
-                errors.append(f"LUT should be a valid .cube file")
-        else:
-            errors.append(f"Could not find LUT file at: {p.filter_lut_path}")
+    # Worker mode uses the paths of the queued run
+    elif p.worker_mode:
+        if not p.queue_path:
+            errors.append("Value of '-queue/--queue-path' is needed in worker mode")
 
-    # Go over value ranges
-    if not p.white_threshold in range(1, 256):
-        errors.append("Value of '-white/--white-threshold' should be between 1 and 255")
+    else:
+        # Make sure input path exists
+        if not os.path.exists(p.input):
+            errors.append(f"Input path does not exist: {p.input}")
 
-    if not int(p.minimum_size) in range(1, 101):
-        errors.append("Value of '-min/--minimum-size' should be between 1 and 100")
+        # Make sure output path exists
+        if not os.path.exists(p.output):
+            errors.append(f"Output path does not exist: {p.output}")
 
-    if not int(p.maximum_size) in range(1, 101):
-        errors.append("Value of '-max/--maximum-size' should be between 1 and 100")
+    if not p.dedup_mode in ["off", "scan", "slice"]:
+        errors.append("Value of '-dedup/--dedup-mode' should be one of off, scan or slice")
+
+    if not p.dedup_distance in range(0, 17):
+        errors.append("Value of '-dedupD/--dedup-distance' should be between 0 and 16")
+
+    if not p.output_archive in ["none", "tar", "zip"]:
+        errors.append("Value of '-archive/--output-archive' should be one of none, tar or zip")
+
+    if not p.archive_shard in ["run", "folder"]:
+        errors.append("Value of '-shard/--archive-shard' should be one of run or folder")
+
+    # Workers on other hosts can't reach local archive writer or hash index
+    if p.queue_path and p.slice_mode:
+        if p.output_archive != "none" or p.dedup_mode != "off":
+            errors.append("Value of '-queue/--queue-path' only works with '-archive/--output-archive' none and '-dedup/--dedup-mode' off")
+
+        if p.resume:
+            errors.append("Value of '-resume/--resume' can't be used with '-queue/--queue-path'")
+
+    if p.metrics_file:
+        p.metrics_file = os.path.normpath(os.path.expanduser(p.metrics_file))
+
+        if not os.path.isdir(os.path.dirname(p.metrics_file) or "."):
+            errors.append(f"Metrics file directory does not exist: {os.path.dirname(p.metrics_file)}")
+
+    if not p.prefetch_mb >= 0:
+        errors.append("Value of '-prefetch/--prefetch-mb' should be at least 0")
+
+    if not p.prefetch_threads >= 1:
+        errors.append("Value of '-prefetchT/--prefetch-threads' should be at least 1")
+
+    if not p.prefetch_mount_limit >= 1:
+        errors.append("Value of '-prefetchM/--prefetch-mount-limit' should be at least 1")
+
+    if not p.metrics_format in ["prometheus", "jsonl"]:
+        errors.append("Value of '-metricsF/--metrics-format' should be one of prometheus or jsonl")
+
+    if not p.metrics_interval > 0:
+        errors.append("Value of '-metricsI/--metrics-interval' should be more than 0")
+
+    if not p.queue_lease > 0:
+        errors.append("Value of '-queueL/--queue-lease' should be more than 0")
+
+    for option, value in [("-onlyA/--only-after", p.only_after), ("-onlyB/--only-before", p.only_before)]:
+        if value and not parse_date(value):
+            errors.append(f"Value of '{option}' should be a date (YYYY-MM-DD)")
+
+    for option, value in [("-onlyMin/--only-min-size", p.only_min_size), ("-onlyMax/--only-max-size", p.only_max_size)]:
+        if value is not None and not value >= 0:
+            errors.append(f"Value of '{option}' should be at least 0")
+
+    if p.only_format:
+        formats = [suffix[1:] for suffix in ACCEPTED_FORMATS]
+
+        if not all(format.lower().lstrip(".") in formats for format in p.only_format):
+            errors.append(f"Value of '-onlyF/--only-format' should be one of {', '.join(formats)}")
+
+    if p.add_regex:
+        try:
+            re.compile(p.add_regex)
+        except re.error as e:
+            errors.append(f"Value of '-addRe/--add-regex' should be a valid regular expression ({e})")
+
+    try:
+        if renditions_from_p(p) and p.output_archive != "none":
+            errors.append("Value of '-rend/--renditions' only works with '-archive/--output-archive' none")
+    except ValueError as e:
+        errors.append(f"Value of '-rend/--renditions' is not valid ({e})")
+
+    # Resume continues a slice run that writes separate files, using its own tasks
+    if p.resume:
+        if not p.slice_mode or p.output_archive != "none":
+            errors.append("Value of '-resume/--resume' only works with slice mode and '-archive/--output-archive' none")
+
+        if has_task_options(p):
+            errors.append("Value of '-resume/--resume' can't be used with task options, the run keeps its own tasks")
+
+    # Go over value ranges
+    errors += check_slice_values(p)
 
     if not p.view_height >= 100:
         errors.append("Value of '-viewH/--view_height' should be at least 100")
@@ -148,44 +529,51 @@ def parse_p(p):
     if not p.view_width >= 100:
         errors.append("Value of '-viewW/--view_width' should be at least 100")
 
-    if not p.filter_denoise in range(0, 6):
-        errors.append("Value of '-denoise/--filter-denoise' should be between 0 and 5")
+    if not p.task_window >= 1:
+        errors.append("Value of '-window/--task-window' should be at least 1")
 
-    if not int(p.filter_color * 100.0) in range(0, 201):
-        errors.append("Value of '-color/--filter-color' should be between 0.0 and 2.0")
+    if not p.executor in EXECUTORS:
+        errors.append("Value of '-exec/--executor' should be one of thread or process")
 
-    if not int(p.filter_contrast * 100.0) in range(0, 201):
-        errors.append("Value of '-contrast/--filter-contrast' should be between 0.0 and 2.0")
+    if not p.soft_timeout >= 0:
+        errors.append("Value of '-softT/--soft-timeout' should be at least 0")
 
-    if not int(p.filter_brightness * 100.0) in range(0, 201):
-        errors.append("Value of '-brightness/--filter-brightness' should be between 0.0 and 2.0")
+    if not p.hard_timeout >= 0:
+        errors.append("Value of '-hardT/--hard-timeout' should be at least 0")
 
-    if not int(p.filter_sharpness * 100.0) in range(0, 201):
-        errors.append("Value of '-sharpness/--filter-sharpness' should be between 0.0 and 2.0")
+    # Threads can't be killed and a stopped image could leave slices in the archive
+    if p.hard_timeout and (p.executor == "thread" or p.output_archive != "none"):
+        errors.append("Value of '-hardT/--hard-timeout' only works with '-exec/--executor' process and '-archive/--output-archive' none")
 
-    if not int(p.filter_lut_strength * 100.0) in range(0, 101):
-        errors.append("Value of '-lutS/--filter-lut-strength' should be between 0.0 and 1.0")
+    if not p.thumb_width in range(100, 601):
+        errors.append("Value of '-thumbW/--thumb-width' should be between 100 and 600")
 
-    if not p.perspective_fix in range(0, 90):
-        errors.append("Value of '-pfix/--perspective-fix' should be between 0 and 89")
+    if not p.grid_columns in range(1, 21):
+        errors.append("Value of '-gridC/--grid-columns' should be between 1 and 20")
 
-    if not p.auto_rotate in ["disable", "cw", "ccw"]:
-        errors.append("Value of '-autoR/--auto-rotate' should be one of disable, cw or ccw")
+    if not p.watch_interval > 0:
+        errors.append("Value of '-watchI/--watch-interval' should be larger than 0")
 
-    if not p.save_format in ["jpeg", "png", "webp"]:
-        errors.append("Value of '-save/--save-format' should be one of jpeg, png or webp")
+    if not p.watch_settle >= 0:
+        errors.append("Value of '-watchS/--watch-settle' should be at least 0")
 
-    if not p.png_compression in range(0, 10):
-        errors.append("Value of '-pngC/--png-compression' should be between 0 and 9")
+    if not p.serve_port in range(1, 65536):
+        errors.append("Value of '-port/--serve-port' should be between 1 and 65535")
 
-    if not p.jpeg_quality in range(0, 96):
-        errors.append("Value of '-jpegQ/--jpeg-quality' should be between 0 and 95")
+    if not p.serve_queue >= 1:
+        errors.append("Value of '-serveQ/--serve-queue' should be at least 1")
 
-    if not p.webp_method in range(0, 7):
-        errors.append("Value of '-webpM/--webp-method' should be between 0 and 6")
+    if not p.serve_timeout > 0:
+        errors.append("Value of '-serveT/--serve-timeout' should be larger than 0")
 
-    if not p.webp_quality in range(1, 101):
-        errors.append("Value of '-webpQ/--webp-quality' should be between 1 and 100")
+    if not p.serve_max_upload >= 1:
+        errors.append("Value of '-serveM/--serve-max-upload' should be at least 1")
+
+    if not p.sheet_tiles >= 1:
+        errors.append("Value of '-sheetT/--sheet-tiles' should be at least 1")
+
+    if not p.tile_width in range(100, 2001):
+        errors.append("Value of '-tileW/--tile-width' should be between 100 and 2000")
 
     # Abort on errors
     if errors:
@@ -230,15 +618,26 @@ def create_dots(chars):
 
     return dots
 
+# Line of image list, with the results of earlier runs from the catalog
+def image_line(image):
+    line = "[ID:" + str(image.id) + "]"
+    line += create_dots(len(line)) + image.name
+    line += " (" + image.size_mb + ")"
+
+    if image.last_count is not None:
+        line += f" - {image.last_count} slices"
+
+    if image.last_run:
+        line += f", sliced in {image.last_run}"
+
+    return line
+
 def list_images(images):
     logger = logging.getLogger()
     logger.info("List images:")
 
     for key in images.keys():
-        line = "[ID:" + str(images[key].id) + "]"
-        line += create_dots(len(line)) + images[key].name
-        line += " (" + images[key].size_mb + ")"
-        logger.info(line)
+        logger.info(image_line(images[key]))
 
     logger.info(f"Images found: {len(images)}\n")
 
@@ -250,10 +649,7 @@ def save_imagelist_as_txt(path, name, images):
     lines = []
 
     for key in images.keys():
-        line = "[ID:" + str(images[key].id) + "]"
-        line += create_dots(len(line)) + images[key].name
-        line += " (" + images[key].size_mb + ")"
-        lines.append(line + "\n")
+        lines.append(image_line(images[key]) + "\n")
 
     with open(fp, 'w') as outfile:
         try:
@@ -268,15 +664,21 @@ def save_imagelist_as_txt(path, name, images):
 
 def handle_tasks(p, images):
     logger = logging.getLogger()
-    tasks = []
+    index = TaskIndex(images, p.input)
+    tasks = {}
     warns = []
     info = []
 
+    # Tasks are kept in a dict (ordered set) so adding and removing stay cheap
+    def add_tasks(task_ids):
+        for task_id in task_ids:
+            tasks[task_id] = None
+
     def add_valid_task(task_id):
 
         if not task_id in tasks:
             if task_id in images:
-                tasks.append(task_id)
+                tasks[task_id] = None
             else:
                 warns.append(f"Image not found with ID: {task_id}")
         else:
@@ -285,7 +687,7 @@ def handle_tasks(p, images):
     def remove_valid_task(task_id):
 
         if task_id in tasks:
-            tasks.remove(task_id)
+            del tasks[task_id]
         else:
             warns.append(f"No task for image with ID: {task_id}")
 
@@ -294,7 +696,7 @@ def handle_tasks(p, images):
 
         info.append(f"Create task for all {len(images)} images")
 
-        tasks = list(images.keys())
+        add_tasks(images)
 
     # Add images with ID
     if p.add_id:
@@ -309,35 +711,81 @@ def handle_tasks(p, images):
 
         info.append(f"Create task for {p.add_new} newest images by modification date")
 
-        for i in range(p.add_new):
-            add_valid_task(i)
+        add_tasks(sorted(index.newest(p.add_new)))
 
     # Add old images by mtime
     if p.add_old:
 
         info.append(f"Create task for {p.add_old} oldest images by modification date")
 
-        for i in range(p.add_old):
-            add_valid_task((len(images)-1)-i)
+        add_tasks(sorted(index.oldest(p.add_old)))
 
     # Add random images
     if p.add_random:
 
-        pool = list(images.keys())
-        picks = []
+        picks = random.sample(sorted(index.ids), min(p.add_random, len(images)))
 
-        for i in range(p.add_random):
-            if pool:
-                pick = random.choice(pool)
+        info.append(f"Create task for random images with ID: {picks}")
 
-                if not pick in picks:
-                    picks.append(pick)
-                    pool.remove(pick)
+        add_tasks(picks)
 
-        info.append(f"Create task for random images with ID: {picks}")
+    # Add images by relative path
+    if p.add_glob:
+
+        info.append(f"Create task for images matching: {p.add_glob}")
+
+        add_tasks(sorted(index.glob(p.add_glob)))
+
+    if p.add_regex:
+
+        info.append(f"Create task for images matching regex: {p.add_regex}")
+
+        add_tasks(sorted(index.regex(p.add_regex)))
+
+    # Add images inside folders (and their subfolders)
+    if p.add_folder:
+
+        info.append(f"Create task for images inside folders: {p.add_folder}")
+
+        add_tasks(sorted(index.folder(p.add_folder)))
+
+    # Filters alone select from all images
+    if any(only_options(p)) and not any(add_options(p)):
+        add_tasks(images)
+
+    # Keep only images that match all filters
+    selected = None
+
+    def only(ids):
+        nonlocal selected
+        selected = ids if selected is None else selected & ids
+
+    if p.only_format:
+
+        info.append(f"Only images in format: {p.only_format}")
+
+        only(index.format(p.only_format))
 
-        for pick in picks:
-            add_valid_task(pick)
+    if p.only_after or p.only_before:
+
+        info.append(f"Only images modified between: {p.only_after or 'any'} - {p.only_before or 'any'}")
+
+        only(index.modified(parse_date(p.only_after), parse_date(p.only_before)))
+
+    if p.only_min_size or p.only_max_size:
+
+        info.append(f"Only images with size between: {p.only_min_size or 0} - {p.only_max_size or 'any'} MB")
+
+        only(index.size(p.only_min_size, p.only_max_size))
+
+    if p.only_not_sliced:
+
+        info.append("Only images not sliced in earlier runs")
+
+        only(index.not_sliced(p.output))
+
+    if selected is not None:
+        tasks = {task_id: None for task_id in tasks if task_id in selected}
 
     # Remove tasks by ID
     if p.remove_id:
@@ -357,7 +805,7 @@ def handle_tasks(p, images):
 
     logger.info(f"Tasks added: {len(tasks)}\n")
 
-    return tasks
+    return list(tasks)
 
 def list_tasks(tasks, images):
     logger = logging.getLogger()
@@ -365,11 +813,7 @@ def list_tasks(tasks, images):
 
     if tasks:
         for task in tasks:
-            image = images[task]
-            line = "[ID:" + str(image.id) + "]"
-            line += create_dots(len(line)) + image.name
-            line += " (" + image.size_mb + ")"
-            logger.info(line)
+            logger.info(image_line(images[task]))
 
         logger.info(f"Total: {len(tasks)}\n")
     else:
@@ -377,6 +821,8 @@ def list_tasks(tasks, images):
 
 def sequential_parallel_rename(p):
     logger = logging.getLogger()
+    journal = RunJournal(p.unique_path)
+    state = getattr(p, "resume_state", None)
     output_images = []
     counter = 0
     cur_path = ""
@@ -389,52 +835,52 @@ def sequential_parallel_rename(p):
     if p.save_format == "webp":
         suffix = ".webp"
 
+    # Finish rename of interrupted run, skip the files that were already renamed
+    if state and state["rename"]:
+        plan = [[os.path.join(p.unique_path, src), os.path.join(p.unique_path, dst)] for src, dst in state["rename"]]
+        output_images = [image for image in plan if os.path.exists(image[0])]
+
     # Walk through the unique directory inside output path and collect temporary images
-    for path, dirs, files in os.walk(os.path.normpath(p.unique_path)):
+    else:
+        for path, dirs, files in os.walk(os.path.normpath(p.unique_path)):
 
-        # Go through files one by one and rename them based on the directory names
-        for file in files:
+            # Go through files one by one (sorted so resumed runs get the same names)
+            # and rename them based on the directory names
+            for file in sorted(files):
 
-            # Only handle files with the right name and format
-            if file.lower().startswith("tmp_file_") and file.lower().endswith(suffix):
+                # Only handle files with the right name and format
+                if file.lower().startswith("tmp_file_") and file.lower().endswith(suffix):
 
-                # Reset counter if our path changes
-                if cur_path != path:
-                    counter = 0
-                    cur_path = path
+                    # Reset counter if our path changes
+                    if cur_path != path:
+                        counter = 0
+                        cur_path = path
 
-                counter += 1
+                    counter += 1
 
-                # Get relative path of file
-                rel_path = os.path.relpath(path, p.unique_path)
+                    # Get relative path of file
+                    rel_path = os.path.relpath(path, p.unique_path)
 
-                # Handle files that are in the root dir (.)
-                if rel_path == ".":
                     image = [
                         os.path.join(path, file),
-                        os.path.join(path, "output_" + str(counter)) + suffix
+                        os.path.join(path, create_slice_name(rel_path, counter, suffix))
                     ]
 
                     output_images.append(image)
 
-                # Handle files within folders
-                else:
-                    filename = ""
-                    parts = rel_path.split(os.sep)
-
-                    for part in parts:
-                        filename += part + "_"
+        plan = output_images
 
-                    image = [
-                        os.path.join(path, file),
-                        os.path.join(path, filename + str(counter) + suffix)
-                    ]
+        # Save rename plan before renaming anything
+        if journal.exists():
+            journal.write({"rename": [[os.path.relpath(name, p.unique_path) for name in image] for image in output_images]})
 
-                    output_images.append(image)
+    # Slices of the renditions get the same names in their own output trees
+    # The whole plan is checked, renditions may be left whose main slice was already renamed
+    output_images += rendition_renames(p, renditions_from_p(p), plan)
 
     # Do we need multiprocessing?
     if p.workers > 1 and len(output_images) > 1:
-        with ProcessPoolExecutor(max_workers=p.workers) as executor:
+        with create_executor(p.executor, p.workers) as executor:
 
             # Split our output images for the executor
             for i, output_image in enumerate(output_images):
@@ -446,68 +892,6 @@ def sequential_parallel_rename(p):
             os.rename(output_image[0], output_image[1])
             logger.debug(f"Rename {output_image[0]} to {output_image[1]}")
 
-# Collect images from input directory
-def collect_images(input):
-
-    id = 0
-    sorted_images = {}
-    scanned_images = []
-
-    # Only accept these formats for the Image
-    accepted_formats = [
-                ".bmp",
-                ".jpeg",
-                ".jpg",
-                ".png",
-                ".webp",
-                ".tiff",
-            ]
-
-    # Walk through the input folder and collect images
-    for path, dirs, files in os.walk(os.path.normpath(input)):
-
-        # Go through files one by one
-        for file in files:
-            skip_file = True
-            format = ""
-
-            # Only accept image formats defined above
-            for suffix in accepted_formats:
-                if file.lower().endswith(suffix):
-                    format = suffix[1:]
-                    skip_file = False
-
-            if not skip_file:
-
-                # Append our found data
-                image = [
-                    path,
-                    file,
-                    format,
-                    os.stat(os.path.join(path, file)).st_mtime,
-                    os.stat(os.path.join(path, file)).st_size]
-
-                scanned_images.append(image)
-
-    if scanned_images:
-
-        # Sort our images from newest to oldest (mtime)
-        scanned_images = sorted(scanned_images, key=itemgetter(3), reverse=True)
-
-        for scanned_image in scanned_images:
-
-                image = ScanImageSlicerImage(
-                    id,
-                    scanned_image[0],
-                    scanned_image[1],
-                    scanned_image[2],
-                    scanned_image[3],
-                    scanned_image[4],
-                )
-
-                # Add our image to dictionary using the image id as key
-                sorted_images[image.id] = image
-                id += 1
-
-        # Return our sorted images as a dictionary
-        return sorted_images
\ No newline at end of file
+    if journal.exists():
+        journal.write({"finished": True})
+        journal.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import cv2 as cv
+import numpy as np
+
+from io import BytesIO
+from concurrent.futures import wait, FIRST_COMPLETED
+from .scis_reader import ArrayImageReader, ScanImageReader, open_image_reader
+from .scis_encoder import SliceEncoder
+from .scis_shm import SharedArrayRef, SharedWorkers, attach
+from .scis_slicer import detect_scan, process_slice, slice_filters, check_slice_values
+from .utils import *
+
+# Number of images submitted per worker before slice_batch waits for results
+BATCH_BUFFER = 2
+
+# Settings for the API, defaults match the default config file
+# Example: Settings(white_threshold=220, save_format="png")
+class Settings:
+    white_threshold = 230
+    minimum_size = 1.0
+    maximum_size = 45.0
+    detect_mode = "fixed"
+    coarse_width = 400
+    refine_size = 600
+    read_backend = "pillow"
+    scale_factor = 0.0
+    scale_width = 0
+    scale_height = 0
+    filter_denoise = 1
+    filter_color = 1.0
+    filter_contrast = 1.0
+    filter_brightness = 1.0
+    filter_sharpness = 1.0
+    filter_lut_strength = 1.0
+    filter_lut_path = ""
+    perspective_fix = 0
+    auto_rotate = "disable"
+    save_format = "jpeg"
+    encoder = "auto"
+    png_optimize = True
+    png_compression = 3
+    jpeg_optimize = True
+    jpeg_quality = 95
+    webp_lossless = False
+    webp_method = 4
+    webp_quality = 90
+
+    def __init__(self, **kw):
+        for key, value in kw.items():
+            if not hasattr(Settings, key):
+                raise TypeError(f"Unknown setting: {key}")
+
+            setattr(self, key, value)
+
+        errors = check_slice_values(self)
+
+        if errors:
+            raise ValueError("\n".join(errors))
+
+# Names of all settings
+SETTING_NAMES = [key for key in vars(Settings) if not key.startswith("_")]
+
+# Create settings from the command-line params
+def settings_from_p(p):
+    return Settings(**{name: getattr(p, name) for name in SETTING_NAMES})
+
+# Accept Settings, dict of settings or None for defaults
+def create_settings(settings):
+    if settings is None:
+        return Settings()
+
+    if isinstance(settings, dict):
+        return Settings(**settings)
+
+    return settings
+
+# Open reader for NumPy array (BGR), encoded image bytes or path to image file
+def open_reader(image, settings):
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            image = cv.cvtColor(image, cv.COLOR_GRAY2BGR)
+        elif image.ndim == 3 and image.shape[2] == 4:
+            image = cv.cvtColor(image, cv.COLOR_BGRA2BGR)
+        elif image.ndim != 3 or image.shape[2] != 3:
+            raise ValueError(f"Image array should be BGR, BGRA or grayscale, got shape {image.shape}")
+
+        reader = ArrayImageReader(image)
+
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        reader = ScanImageReader(BytesIO(image))
+
+    else:
+        reader = open_image_reader(os.fspath(image), settings)
+
+        if not reader:
+            raise ValueError(f"Could not read image: {image}")
+
+        return reader
+
+    if not reader.open():
+        raise ValueError("Could not decode image")
+
+    return reader
+
+# Apply filters to slice and return it as BGR array
+def filter_slice(img, filters):
+    if pil_filters_active(filters):
+        return pil_to_cv(pil_filter_image(img, filters))
+
+    if filters[4]:
+        return cv_denoise(img, filters[4])
+
+    return img
+
+# Detect slices and return their regions [x, y, w, h] in full resolution
+def detect(image, settings=None):
+    settings = create_settings(settings)
+    reader = open_reader(image, settings)
+    img_resized, cnts = detect_scan(reader, settings)
+
+    return [reader.box(img_resized, cnt) for cnt in cnts]
+
+# Slice image and yield (region, slice) for each detected slice
+# Slices are filtered BGR arrays, or bytes in the save format when encode is True
+def slice_image(image, settings=None, encode=False):
+    settings = create_settings(settings)
+    reader = open_reader(image, settings)
+    img_resized, cnts = detect_scan(reader, settings)
+    filters = slice_filters(settings)
+    encoder = SliceEncoder(settings) if encode else None
+
+    def slices():
+        for cnt in cnts:
+            region = reader.box(img_resized, cnt)
+            sliced_img = process_slice(reader, img_resized, cnt, settings)
+
+            if encoder:
+                yield region, encoder.encode(sliced_img, filters)
+            else:
+                yield region, filter_slice(sliced_img, filters)
+
+    return slices()
+
+# Worker function for batch functions, images from the parent are shared arrays
+def batch_task(image, settings, encode):
+    if not isinstance(image, SharedArrayRef):
+        return list(slice_image(image, settings, encode))
+
+    # Slices can be views into the shared array, copy them before it goes away
+    with attach(image) as img:
+        return [(region, data if encode else data.copy()) for region, data in slice_image(img, settings, encode)]
+
+def batch_detect_task(image, settings):
+    if not isinstance(image, SharedArrayRef):
+        return detect(image, settings)
+
+    with attach(image) as img:
+        return detect(img, settings)
+
+# Run task for many images with a worker pool and yield (index, result) as they complete
+# Only a few images per worker are in flight, so images can come from a generator
+# Arrays are passed to worker processes through shared memory instead of pickling them
+def run_batch(task, images, workers, executor, *args):
+    logger = logging.getLogger()
+    workers = workers or os.cpu_count() or 1
+
+    with SharedWorkers(workers, executor) as shared:
+        limit = workers * BATCH_BUFFER
+        images = enumerate(images)
+        futures = {}
+
+        while True:
+            for index, image in images:
+                if isinstance(image, np.ndarray) and not shared.threads:
+                    array = shared.pool.put(image)
+                    futures[shared.submit(task, array, *args)] = index
+                    shared.pool.release(array)
+                else:
+                    futures[shared.executor.submit(task, image, *args)] = index
+
+                if len(futures) >= limit:
+                    break
+
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = futures.pop(future)
+                result = None
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"[{index}] - Could not process image: {e}")
+
+                yield index, result
+
+# Slice many images with a worker pool and yield (index, slices) as they complete
+# Slices is None if the image could not be sliced
+def slice_batch(images, settings=None, workers=None, encode=False, executor="process"):
+    return run_batch(batch_task, images, workers, executor, create_settings(settings), encode)
+
+# Detect slices of many images with a worker pool and yield (index, regions) as they complete
+# Regions is None if the image could not be read
+def detect_batch(images, settings=None, workers=None, executor="process"):
+    return run_batch(batch_detect_task, images, workers, executor, create_settings(settings))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import json
+import time
+import logging
+import tarfile
+import zipfile
+import threading
+
+from multiprocessing.managers import SyncManager
+
+from .utils import create_slice_name, create_slice_prefix
+from .scis_logger import ignore_sigint
+
+# Number of encoded slices buffered per worker before the workers have to wait
+ARCHIVE_BUFFER = 4
+
+# Write slices into archive containers instead of separate files
+# Every shard gets an index (.jsonl) with the name, source, region and data offset of each slice
+class SliceArchive:
+    def __init__(self, p):
+        self.path = p.unique_path
+        self.run_id = p.run_id
+        self.format = p.output_archive
+        self.shard = p.archive_shard
+        self.shards = {}
+        self.counters = {}
+        self.count = 0
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+
+    # Open the container for the shard (one per run or one per input folder)
+    def open_shard(self, rel_path):
+        name = self.run_id if self.shard == "run" else create_slice_prefix(rel_path)
+
+        if name not in self.shards:
+            container = os.path.join(self.path, name + "." + self.format)
+
+            if self.format == "tar":
+                archive = tarfile.open(container, "w")
+            else:
+                archive = zipfile.ZipFile(container, "w", zipfile.ZIP_STORED)
+
+            index = open(os.path.join(self.path, name + ".jsonl"), "w")
+            self.shards[name] = (archive, index)
+
+        return name, self.shards[name]
+
+    # Append encoded slice to the right shard and index it
+    def add(self, rel_path, source, region, suffix, data):
+        rel_path = os.path.normpath(rel_path)
+        shard, (archive, index) = self.open_shard(rel_path)
+
+        # Name slices the same way as the rename pass does for separate files
+        self.counters[rel_path] = self.counters.get(rel_path, 0) + 1
+        name = create_slice_name(rel_path, self.counters[rel_path], suffix)
+
+        if rel_path != ".":
+            name = "/".join(rel_path.split(os.sep) + [name])
+
+        if self.format == "tar":
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(data))
+            blocks = -(-len(data) // tarfile.BLOCKSIZE)
+            offset = archive.offset - blocks * tarfile.BLOCKSIZE
+        else:
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            archive.writestr(info, data)
+            offset = archive.fp.tell() - info.compress_size
+
+        entry = {
+            "name": name,
+            "source": source,
+            "region": region,
+            "shard": shard + "." + self.format,
+            "offset": offset,
+            "size": len(data),
+        }
+
+        index.write(json.dumps(entry) + "\n")
+        self.count += 1
+
+    def close(self):
+        for archive, index in self.shards.values():
+            archive.close()
+            index.close()
+
+# Collect encoded slices from the workers and write them into the archive
+def archive_listener(queue, archive):
+    logger = logging.getLogger()
+    failed = False
+
+    while True:
+        item = queue.get()
+
+        if item is None:
+            break
+
+        # Keep draining the queue after any failure so the workers never block
+        if failed:
+            continue
+
+        try:
+            archive.add(*item)
+        except Exception as e:
+            logger.error(f"Could not write to archive: {e}")
+            failed = True
+
+# Start archive writer thread and attach its queue to params
+def start_archive(p, workers):
+    manager = SyncManager()
+    manager.start(ignore_sigint)
+    p.archive_queue = manager.Queue(max(1, workers) * ARCHIVE_BUFFER)
+    archive = SliceArchive(p)
+    writer = threading.Thread(target=archive_listener, args=(p.archive_queue, archive))
+    writer.start()
+
+    return manager, archive, writer
+
+# Flush the queued slices and close the archive
+def stop_archive(p, handle):
+    manager, archive, writer = handle
+    p.archive_queue.put(None)
+    writer.join()
+    archive.close()
+    manager.shutdown()
+    del p.archive_queue
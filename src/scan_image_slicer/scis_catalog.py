@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import logging
+
+from .scis_image import ScanImageSlicerImage
+from .utils import image_format
+
+# Catalog file inside output directory, shared by all runs
+CATALOG_NAME = ".scis_catalog.sqlite3"
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    format TEXT NOT NULL,
+    missing INTEGER NOT NULL DEFAULT 0,
+    slice_count INTEGER,
+    last_run TEXT
+);
+"""
+
+# Persistent catalog of input images
+# IDs are given once and kept across runs, files that disappear keep their ID if they come back
+# Each scan only writes the files that were added, changed or removed since the last scan
+class ImageCatalog:
+    def __init__(self, path):
+        self.db = sqlite3.connect(os.path.join(path, CATALOG_NAME))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(CATALOG_SCHEMA)
+
+    # Bounds of paths inside input, compared as text so the unique index is used
+    def bounds(self, input):
+        prefix = os.path.join(input, "")
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    def has_images(self, input):
+        return self.db.execute("SELECT 1 FROM images WHERE missing = 0 AND path >= ? AND path < ? LIMIT 1", self.bounds(input)).fetchone() is not None
+
+    # Update catalog from input path, returns number of added, changed and removed images
+    def scan(self, input):
+        known = {}
+        added = []
+        changed = []
+        restored = []
+        found = set()
+
+        for row in self.db.execute("SELECT path, size, mtime, missing FROM images WHERE path >= ? AND path < ?", self.bounds(input)):
+            known[row[0]] = row[1:]
+
+        for filepath, format, stat in walk_images(input):
+            found.add(filepath)
+            row = known.get(filepath)
+
+            if not row:
+                added.append((filepath, stat.st_size, stat.st_mtime, format))
+
+            # Changed content has not been detected or sliced yet
+            elif row[0] != stat.st_size or row[1] != stat.st_mtime:
+                changed.append((stat.st_size, stat.st_mtime, format, filepath))
+
+            elif row[2]:
+                restored.append((filepath,))
+
+        removed = [(filepath,) for filepath, row in known.items() if not row[2] and filepath not in found]
+
+        # Oldest images get the lowest IDs
+        added.sort(key=lambda image: image[2])
+
+        with self.db:
+            self.db.executemany("INSERT INTO images (path, size, mtime, format) VALUES (?, ?, ?, ?)", added)
+            self.db.executemany("UPDATE images SET size = ?, mtime = ?, format = ?, missing = 0, slice_count = NULL, last_run = NULL WHERE path = ?", changed)
+            self.db.executemany("UPDATE images SET missing = 0 WHERE path = ?", restored)
+            self.db.executemany("UPDATE images SET missing = 1 WHERE path = ?", removed)
+
+        return len(added), len(changed), len(removed)
+
+    # Images inside input path from newest to oldest (mtime)
+    def images(self, input):
+        images = {}
+        query = "SELECT id, path, size, mtime, format, slice_count, last_run FROM images WHERE missing = 0 AND path >= ? AND path < ? ORDER BY mtime DESC, id DESC"
+
+        for id, filepath, size, mtime, format, slice_count, last_run in self.db.execute(query, self.bounds(input)):
+            path, name = os.path.split(filepath)
+            image = ScanImageSlicerImage(id, path, name, format, mtime, size)
+            image.last_count = slice_count
+            image.last_run = last_run
+            images[id] = image
+
+        return images
+
+    # Save detection count of image, and the run if it was sliced
+    def record(self, image, count, run_id=None):
+        with self.db:
+            if run_id:
+                self.db.execute("UPDATE images SET slice_count = ?, last_run = ? WHERE id = ?", (count, run_id, image.id))
+            else:
+                self.db.execute("UPDATE images SET slice_count = ? WHERE id = ?", (count, image.id))
+
+        image.last_count = count
+        image.last_run = run_id or image.last_run
+
+    def close(self):
+        self.db.close()
+
+# Walk input path, yields (filepath, format, stat) of compatible images
+def walk_images(input):
+    dirs = [os.path.normpath(input)]
+
+    while dirs:
+        try:
+            entries = list(os.scandir(dirs.pop()))
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+                continue
+
+            format = image_format(entry.name)
+
+            if format:
+                try:
+                    yield entry.path, format, entry.stat()
+                except OSError:
+                    continue
+
+# Open catalog and update it from input path unless asked to use it as is
+def open_catalog(p):
+    logger = logging.getLogger()
+    catalog = ImageCatalog(p.output)
+
+    if p.no_scan and catalog.has_images(p.input):
+        logger.info("Use image catalog without scanning input path")
+    else:
+        added, changed, removed = catalog.scan(p.input)
+
+        if any([added, changed, removed]):
+            logger.info(f"Image catalog updated: {added} new, {changed} changed, {removed} removed")
+
+    return catalog
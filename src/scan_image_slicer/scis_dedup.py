@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import threading
+import cv2 as cv
+
+from multiprocessing.managers import SyncManager
+
+from .scis_logger import ignore_sigint
+from .utils import cv_dhash
+
+# Hash index inside output directory, shared by all runs
+HASH_INDEX_NAME = ".scis_hash_index.jsonl"
+
+# Duplicate report inside the unique run path
+DUPLICATE_REPORT_NAME = "duplicates.jsonl"
+
+# Number of bits in a hash
+HASH_BITS = 64
+
+# Index of perceptual hashes of scans and slices
+# Scans match only if the whole scan and every detected slice match, so sheets with the
+# same layout but different photos are not duplicates
+# Hashes are split into distance + 1 parts, any hash within the distance shares at least
+# one part exactly, so only hashes in the same buckets need to be compared
+# Runs inside a manager process, workers share it through a proxy
+class HashIndex:
+    def __init__(self, index_path, report_path, run_id, distance):
+        self.index_path = index_path
+        self.report_path = report_path
+        self.run_id = run_id
+        self.distance = distance
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.pending = {}
+        self.index = None
+        self.report = None
+
+        # Bit ranges of hash parts
+        parts = distance + 1
+        bounds = [HASH_BITS * i // parts for i in range(parts + 1)]
+        self.parts = list(zip(bounds[:-1], bounds[1:]))
+
+        if os.path.isfile(index_path):
+            with open(index_path) as infile:
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    self.add(entry)
+
+    def keys(self, kind, hash):
+        return [(kind, i, (hash >> start) & ((1 << (end - start)) - 1)) for i, (start, end) in enumerate(self.parts)]
+
+    def add(self, entry):
+        hash = int(entry["hash"], 16)
+
+        for key in self.keys(entry["kind"], hash):
+            self.buckets.setdefault(key, []).append((hash, entry))
+
+    # Every slice hash has a match within the distance in the other list
+    def slices_match(self, slices, others):
+        others = [int(other, 16) for other in others]
+
+        if len(slices) != len(others):
+            return False
+
+        return all(any((hash ^ other).bit_count() <= self.distance for other in others) for hash in slices)
+
+    # Scan an entry was hashed from
+    def entry_scan(self, entry):
+        return entry.get("scan", entry["source"])
+
+    # Entries of the scan itself are no duplicates: slices of the same sheet may look alike
+    # and a resumed run claims the scans again that were hashed before it stopped
+    def own_entry(self, kind, entry, scan):
+        return self.entry_scan(entry) == scan and (kind == "slice" or entry["run"] == self.run_id)
+
+    # Closest entry within the distance
+    def find(self, kind, hash, scan, slices):
+        best = None
+
+        for key in self.keys(kind, hash):
+            for other, entry in self.buckets.get(key, []):
+                if self.own_entry(kind, entry, scan):
+                    continue
+
+                distance = (hash ^ other).bit_count()
+
+                if distance > self.distance or (best and distance >= best[0]):
+                    continue
+
+                if slices is None or self.slices_match(slices, entry.get("slices", [])):
+                    best = (distance, entry)
+
+        return best
+
+    # Return source of the original if hash is a duplicate, otherwise add it to the index
+    # Entries become persistent once the scan is committed
+    def claim(self, kind, hash, source, scan, slices=None):
+        with self.lock:
+            match = self.find(kind, hash, scan, slices)
+
+            if match:
+                distance, entry = match
+                self.write_report({
+                    "kind": kind,
+                    "source": source,
+                    "original": entry["source"],
+                    "original_run": entry["run"],
+                    "distance": distance,
+                })
+
+                return entry["source"]
+
+            entry = {"kind": kind, "hash": f"{hash:016x}", "source": source, "run": self.run_id}
+
+            if kind == "slice":
+                entry["scan"] = scan
+
+            if slices is not None:
+                entry["slices"] = [f"{slice:016x}" for slice in slices]
+
+            self.add(entry)
+            self.pending.setdefault(scan, []).append(entry)
+
+            return None
+
+    # Save hashes of a finished scan, called by the main process once the scan is journaled
+    def commit(self, scan):
+        with self.lock:
+            entries = self.pending.pop(scan, [])
+
+            if not self.index:
+                self.index = open(self.index_path, "a")
+
+            self.index.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            self.index.flush()
+
+    # Drop hashes of a scan that failed or was stopped
+    def discard(self, scan):
+        with self.lock:
+            entries = self.pending.pop(scan, [])
+
+            for entry in entries:
+                for key in self.keys(entry["kind"], int(entry["hash"], 16)):
+                    self.buckets[key] = [item for item in self.buckets[key] if item[1] is not entry]
+
+    def write_report(self, entry):
+        if not self.report:
+            os.makedirs(os.path.dirname(self.report_path), exist_ok=True)
+            self.report = open(self.report_path, "a")
+
+        self.report.write(json.dumps(entry) + "\n")
+        self.report.flush()
+
+    def close(self):
+        with self.lock:
+            for fp in [self.index, self.report]:
+                if fp:
+                    fp.close()
+
+            self.index = None
+            self.report = None
+
+class DedupManager(SyncManager):
+    pass
+
+DedupManager.register("HashIndex", HashIndex)
+
+# Hash of the slice area in the detection overview
+def slice_hash(img_resized, cnt):
+    x, y, w, h = cv.boundingRect(cnt)
+
+    return cv_dhash(img_resized[y:y + h, x:x + w])
+
+# Start hash index and attach its proxy to params
+def start_dedup(p):
+    manager = DedupManager()
+    manager.start(ignore_sigint)
+    p.dedup_index = manager.HashIndex(
+        os.path.join(p.output, HASH_INDEX_NAME),
+        os.path.join(p.unique_path, DUPLICATE_REPORT_NAME),
+        p.run_id,
+        p.dedup_distance
+    )
+
+    return manager
+
+def stop_dedup(p, manager):
+    p.dedup_index.close()
+    del p.dedup_index
+    manager.shutdown()
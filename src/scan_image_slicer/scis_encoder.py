@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import logging
+import cv2 as cv
+
+from .utils import *
+
+# Encode slices into bytes using either Pillow or OpenCV
+# OpenCV encodes straight from the NumPy buffer and skips the PIL conversion
+class SliceEncoder:
+    def __init__(self, p):
+        self.format = p.save_format
+        self.pil_params = {"format": p.save_format}
+        self.cv_params = []
+
+        # Define file format settings
+        if p.save_format == "png":
+            self.suffix = ".png"
+            self.pil_params["optimize"] = p.png_optimize
+            self.pil_params["compress_level"] = p.png_compression
+
+            # Pillow optimize means the highest zlib level
+            level = 9 if p.png_optimize else p.png_compression
+            self.cv_params = [cv.IMWRITE_PNG_COMPRESSION, level]
+
+        if p.save_format == "jpeg":
+            self.suffix = ".jpg"
+            self.pil_params["optimize"] = p.jpeg_optimize
+            self.pil_params["quality"] = p.jpeg_quality
+            self.cv_params = [
+                cv.IMWRITE_JPEG_QUALITY, p.jpeg_quality,
+                cv.IMWRITE_JPEG_OPTIMIZE, int(p.jpeg_optimize)
+            ]
+
+        if p.save_format == "webp":
+            self.suffix = ".webp"
+            self.pil_params["lossless"] = p.webp_lossless
+            self.pil_params["method"] = p.webp_method
+            self.pil_params["quality"] = p.webp_quality
+
+            # OpenCV saves lossless WebP with quality over 100
+            quality = 101 if p.webp_lossless else p.webp_quality
+            self.cv_params = [cv.IMWRITE_WEBP_QUALITY, quality]
+
+        self.backend = encoder_backend(p)
+
+    # Filter and encode BGR image
+    def encode(self, img, filters):
+        return self.encode_image(self.filter(img, filters))
+
+    # Apply filters for the backend, returns PIL image if the encoder or the filters need one
+    def filter(self, img, filters):
+        # PIL filters (LUT, color, contrast, brightness, sharpness) need a PIL image
+        if self.backend == "pillow" or pil_filters_active(filters):
+            return pil_filter_image(img, filters)
+
+        if filters[4]:
+            img = cv_denoise(img, filters[4])
+
+        return img
+
+    # Encode filtered image (PIL image or BGR array)
+    def encode_image(self, img):
+        logger = logging.getLogger()
+
+        if isinstance(img, Image.Image):
+            return self.encode_pil(img)
+
+        if self.backend == "pillow":
+            return self.encode_pil(cv_to_pil(img))
+
+        ok, buf = cv.imencode(self.suffix, img, self.cv_params)
+
+        if not ok:
+            logger.warning(f"OpenCV could not encode {self.format}, using Pillow")
+            return self.encode_pil(cv_to_pil(img))
+
+        return buf.tobytes()
+
+    def encode_pil(self, img):
+        with BytesIO() as buf:
+            img.save(buf, **self.pil_params)
+            return buf.getvalue()
+
+# Select encoder backend for the save format
+# Auto only uses OpenCV when it creates the same output as Pillow
+# OpenCV can't set the WebP method and has no PNG optimize (level 9 makes larger files)
+def encoder_backend(p):
+    if p.encoder != "auto":
+        return p.encoder
+
+    if p.save_format == "webp" and (p.webp_method != 4 or p.webp_lossless):
+        return "pillow"
+
+    if p.save_format == "png" and p.png_optimize:
+        return "pillow"
+
+    return "opencv"
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Backends for running the workers
+EXECUTORS = ["thread", "process"]
+
+# Pool of workers of the chosen backend
+# Threads share the caches, readers and buffers of the main process and the decoders,
+# OpenCV and the encoders release the GIL for the heavy work. Processes don't share
+# anything, so the Python parts of the work run in parallel on builds with the GIL
+# Initializer only runs for processes, signal handlers can't be set in threads
+def create_executor(executor, workers, initializer=None):
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scis-worker")
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=initializer)
@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
 
 import os
+import time
 from .utils import *
 from .scis_logger import queue_configurer
+from .scis_reader import open_image_reader
+from .scis_encoder import SliceEncoder
+from .scis_slicer import detect_scan, detect_overview, refine_slice, reduce_scan, process_slice, slice_filters
+from .scis_journal import write_atomic
+from .scis_dedup import slice_hash
+from .scis_metrics import record_image
+from .scis_rendition import renditions_from_p, rendition_dir, rendition_file, render
+from .scis_shm import attach, export
 
 class ScanImageSlicerImage:
     def __init__(self, id, path, name, format, mtime, size):
@@ -16,21 +25,26 @@ class ScanImageSlicerImage:
         self.filepath = os.path.join(path, name)
         self.slice_count = 0
         self.false_slice_count = 0
+        self.last_count = None
+        self.last_run = None
+
+    # Temporary filename of slice, renamed after slicing
+    def tmp_filename(self, index, suffix):
+        return "tmp_file_" + random_string(self.name, str(self.size), str(index)) + suffix
 
     # Count slices inside scanned image
     def count_slices(self, queue, p):
         logger = queue_configurer(queue)
-        img = pil_open_image(self.filepath)
+        start = time.time()
+        reader = open_image_reader(self.filepath, p)
 
-        if not img:
+        if not reader:
             return 0
 
-        img = pil_to_cv(img)
-        img_resized = cv_resize(img, w=min(900, img.shape[1]))
+        img_resized, cnts = detect_scan(reader, p)
+        self.slice_count += len(cnts)
 
-        for cnt in cv_detect_slices(cv_apply_wt(img_resized, p.white_threshold)):
-            if cv_is_cnt_in_range(img_resized, cnt, p.minimum_size, p.maximum_size):
-                self.slice_count += 1
+        record_image(p, start, reader, self.slice_count, 0)
 
         # Output warning if no images found
         if not self.slice_count:
@@ -42,93 +56,115 @@ class ScanImageSlicerImage:
     # Slice images and save them to the output folder
     def save_slices(self, queue, p):
         logger = queue_configurer(queue)
-        img = pil_open_image(self.filepath)
+        start = time.time()
+        bytes_written = 0
+        reader = open_image_reader(self.filepath, p, reduced=True)
 
-        if not img:
+        if not reader:
             return 0
 
-        img = pil_to_cv(img)
-        img_resized = cv_resize(img, w=min(900, img.shape[1]))
+        # Detect slices before anything is written
+        img_resized, cnts = detect_scan(reader, p)
 
         # Define file format settings
-        file_params = {}
-        file_params.setdefault("format", p.save_format)
-
-        if p.save_format == "png":
-            savefile_suffix = ".png"
-            file_params.setdefault("optimize", p.png_optimize)
-            file_params.setdefault("compress_level", p.png_compression)
-        if p.save_format == "jpeg":
-            savefile_suffix = ".jpg"
-            file_params.setdefault("optimize", p.jpeg_optimize)
-            file_params.setdefault("quality", p.jpeg_quality)
-        if p.save_format == "webp":
-            savefile_suffix = ".webp"
-            file_params.setdefault("lossless", p.webp_lossless)
-            file_params.setdefault("method", p.webp_method)
-            file_params.setdefault("quality", p.webp_quality)
+        encoder = SliceEncoder(p)
+        savefile_suffix = encoder.suffix
 
         # Define filters
-        filters = [
-            p.filter_color,
-            p.filter_contrast,
-            p.filter_brightness,
-            p.filter_sharpness,
-            p.filter_denoise,
-            p.filter_lut_strength,
-            p.filter_lut_path
-        ]
+        filters = slice_filters(p)
+
+        # Renditions are made from the same filtered slice
+        renditions = renditions_from_p(p)
+        rendition_encoders = {rendition.name: SliceEncoder(rendition) for rendition in renditions}
 
         # Define save path
-        save_path = os.path.normpath(os.path.join(p.unique_path, os.path.relpath(self.path, p.input)))
+        rel_path = os.path.relpath(self.path, p.input)
+        save_path = os.path.normpath(os.path.join(p.unique_path, rel_path))
+        source = os.path.relpath(self.filepath, p.input)
+        use_archive = p.output_archive != "none"
+        use_dedup = p.dedup_mode != "off"
+
+        # Skip scans that were already sliced in this or an earlier run
+        if use_dedup:
+            hashes = [slice_hash(img_resized, cnt) for cnt in cnts]
+            original = p.dedup_index.claim("scan", cv_dhash(img_resized), source, source, hashes)
+
+            if original:
+                logger.info(f"[ID:{self.id}] - ({self.name}) - Duplicate of {original}, skipping it..")
+                record_image(p, start, reader, 0, 0)
+                return 0
+
+        # Decode only as large as the scaled slices need
+        reduce_scan(reader, img_resized, cnts, p)
 
         # Create save path
-        if not os.path.exists(save_path):
+        if not use_archive and not os.path.exists(save_path):
             os.makedirs(save_path, exist_ok=True)
 
         # Make sure path was created
-        if not os.path.exists(save_path):
+        if not use_archive and not os.path.exists(save_path):
             logger.error(f"Could not create directory: {save_path}")
             return 0
 
+        # Create save paths of the renditions
+        for rendition in renditions:
+            os.makedirs(rendition_dir(p, rendition, save_path), exist_ok=True)
+
+        duplicates = 0
+
         # Loop through cnts and save slices
-        for cnt in cv_detect_slices(cv_apply_wt(img_resized, p.white_threshold)):
+        for i, cnt in enumerate(cnts):
 
-            # Make sure the area is between min/max sizes
-            if cv_is_cnt_in_range(img_resized, cnt, p.minimum_size, p.maximum_size):
+            # Skip slices that were already sliced from another scan
+            if p.dedup_mode == "slice":
+                original = p.dedup_index.claim("slice", hashes[i], f"{source}#{i}", source)
 
-                # Slice the image
-                sliced_img = cv_slice_img(img, img_resized, cnt, p.perspective_fix)
+                if original:
+                    logger.info(f"[ID:{self.id}] - ({self.name}) - Slice {i} is duplicate of {original}, skipping it..")
+                    duplicates += 1
+                    continue
 
-                # Resize the slice
-                if p.scale_factor:
-                    sliced_img = cv_resize(sliced_img, scale=p.scale_factor)
+            # Slice, scale and rotate the slice
+            region = reader.box(img_resized, cnt)
+            sliced_img = process_slice(reader, img_resized, cnt, p)
 
-                if p.scale_width:
-                    sliced_img = cv_resize(sliced_img, w=p.scale_width)
+            # Apply filters to slice and encode it
+            filtered_img = encoder.filter(sliced_img, filters)
+            data = encoder.encode_image(filtered_img)
 
-                if p.scale_height:
-                    sliced_img = cv_resize(sliced_img, h=p.scale_height)
+            # Define temporary filename
+            filename = self.tmp_filename(self.slice_count, savefile_suffix)
 
-                # Auto-rotate the slice
-                if p.auto_rotate in ["cw", "ccw"]:
-                    sliced_img = cv_auto_rotate(sliced_img, p.auto_rotate)
+            # Send the encoded slice to the archive writer
+            if use_archive:
+                p.archive_queue.put((rel_path, source, region, savefile_suffix, data))
 
-                # Apply filters to slice
-                sliced_img = pil_filter_image(sliced_img, filters)
+            # Save the slice (make sure it does not exist)
+            elif not os.path.isfile(os.path.join(save_path, filename)):
+                write_atomic(os.path.join(save_path, filename), data)
+            else:
+                logger.error(f"File already exists: {filename}")
+                return 0
 
-                # Define temporary filename
-                filename = "tmp_file_" + random_string(self.name, str(self.size), str(self.slice_count)) + savefile_suffix
+            # Scale the filtered slice down for each rendition, same name in the rendition tree
+            if renditions:
+                if not isinstance(filtered_img, np.ndarray):
+                    filtered_img = pil_to_cv(filtered_img)
 
-                # Save the slice (make sure it does not exist)
-                if not os.path.isfile(os.path.join(save_path, filename)):
-                    sliced_img.save(os.path.join(save_path, filename), **file_params)
-                else:
-                    logger.error(f"File already exists: {filename}")
-                    return 0
+                for rendition, rendition_img in render(filtered_img, renditions):
+                    rendition_data = rendition_encoders[rendition.name].encode_image(rendition_img)
+                    write_atomic(rendition_file(p, rendition, os.path.join(save_path, filename)), rendition_data)
+                    bytes_written += len(rendition_data)
 
-                # Up the counter
-                self.slice_count += 1
+            # Up the counter
+            self.slice_count += 1
+            bytes_written += len(data)
+
+        record_image(p, start, reader, self.slice_count, bytes_written)
+
+        if not self.slice_count and duplicates:
+            logger.info(f"[ID:{self.id}] - ({self.name}) - All slices duplicate, skipping it..")
+            return 0
 
         # Output warning if no images found
         if not self.slice_count:
@@ -139,9 +175,27 @@ class ScanImageSlicerImage:
 
     # Create test image for GUI
     def create_test_image(self, p):
+        img_view, valid, rejected = self.draw_test_image(p, p.view_width, p.view_height)
+        self.slice_count += valid
+        self.false_slice_count += rejected
+
+        return cv_to_pil(img_view)
+
+    # Draw valid and non-valid slices on the scan, fit into width x height
+    # Returns the image with the counts, worker threads may draw the same image at once
+    def draw_test_image(self, p, width, height):
+        valid = 0
+        rejected = 0
+
         # Load image
-        img = pil_to_cv(pil_open_image(self.filepath))
-        img_resized = cv_resize(img, w=900)
+        reader = open_image_reader(self.filepath, p)
+
+        if not reader:
+            return None, valid, rejected
+
+        img_view = reader.overview(900)
+        img_resized = detect_overview(reader, p) if p.detect_mode == "pyramid" else img_view
+        view_scale = img_view.shape[1] / img_resized.shape[1]
 
         # Define detection colors (BGR format)
         color_1 = (230, 97, 0)
@@ -152,43 +206,92 @@ class ScanImageSlicerImage:
 
             # Valid slice detected
             if cv_is_cnt_in_range(img_resized, cnt, p.minimum_size, p.maximum_size):
-                self.slice_count += 1
-                cv_draw_cnt(img_resized, cnt, color_1, 4)
+                if p.detect_mode == "pyramid":
+                    cnt = refine_slice(reader, img_resized, cnt, p)
+
+                valid += 1
+                cv_draw_cnt(img_view, np.float32(cnt * view_scale), color_1, 4)
 
             # Non-valid slice detected
             else:
-                self.false_slice_count += 1
-                cv_draw_cnt(img_resized, cnt, color_2, 4)
+                rejected += 1
+                cv_draw_cnt(img_view, np.float32(cnt * view_scale), color_2, 4)
 
         # Return detected slices
-        img_resized = cv_resize(img_resized, w=min(img_resized.shape[1], p.view_width))
-        img_resized = cv_resize(img_resized, h=min(img_resized.shape[0], p.view_height))
+        img_view = cv_resize(img_view, w=min(img_view.shape[1], width))
+        img_view = cv_resize(img_view, h=min(img_view.shape[0], height))
+
+        return img_view, valid, rejected
+
+    # Detection overlay for the contact sheets of headless test mode, encoded as JPEG
+    def create_test_tile(self, queue, p, width, height):
+        logger = queue_configurer(queue)
+        tile = {"id": self.id, "source": os.path.relpath(self.filepath, p.input), "valid": 0, "rejected": 0, "jpeg": None}
+        img_view, valid, rejected = self.draw_test_image(p, width, height)
+
+        if img_view is None:
+            logger.error(f"[ID:{self.id}] - ({self.name}) - Could not read image")
+            return tile
+
+        if not valid:
+            logger.warning(f"[ID:{self.id}] - ({self.name}) - No images found")
+
+        tile.update(valid=valid, rejected=rejected)
+        tile["jpeg"] = cv.imencode(".jpg", img_view, [cv.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
 
-        return cv_to_pil(img_resized)
+        return tile
 
     # Create array for preview images for the GUI
-    def create_preview_images(self, p):
+    def create_preview_images(self, p, shared=None):
         # Array for slices
         preview_images = []
 
         # Load image
-        img = pil_to_cv(pil_open_image(self.filepath))
-        img_resized = cv_resize(img, w=900)
+        reader = open_image_reader(self.filepath, p)
+        img_resized, cnts = detect_scan(reader, p)
 
-        for cnt in cv_detect_slices(cv_apply_wt(img_resized, p.white_threshold)):
+        # Slice in parallel, worker processes read the scan from shared memory
+        if shared and not shared.threads and reader.img is not None and len(cnts) > 1:
+            scan = shared.pool.put(reader.img)
+            futures = [shared.submit(preview_slice, scan, img_resized.shape, cnt, p.perspective_fix, p.auto_rotate) for cnt in cnts]
+            shared.pool.release(scan)
 
-            # Make sure the area is larger than minimum area size
-            if cv_is_cnt_in_range(img_resized, cnt, p.minimum_size, p.maximum_size):
+            self.preview_buffers = [shared.pool.adopt(future.result()) for future in futures]
+            self.shared = shared
+
+            return [buffer.array for buffer in self.preview_buffers]
 
-                # Slice the image
-                sliced_img = cv_slice_img(img, img_resized, cnt, p.perspective_fix)
+        # Worker threads slice the scan in memory directly
+        if shared and shared.threads and reader.img is not None and len(cnts) > 1:
+            sliced_imgs = shared.executor.map(lambda cnt: reader.slice(img_resized, cnt, p.perspective_fix), cnts)
+        else:
+            sliced_imgs = (reader.slice(img_resized, cnt, p.perspective_fix) for cnt in cnts)
 
-                # Auto-rotate the slice
-                if p.auto_rotate in ["cw", "ccw"]:
-                    sliced_img = cv_auto_rotate(sliced_img, p.auto_rotate)
+        for sliced_img in sliced_imgs:
 
-                # Append slice
-                preview_images.append(sliced_img)
+            # Auto-rotate the slice
+            if p.auto_rotate in ["cw", "ccw"]:
+                sliced_img = cv_auto_rotate(sliced_img, p.auto_rotate)
+
+            # Append slice
+            preview_images.append(sliced_img)
 
         # Return array of slices
-        return preview_images
\ No newline at end of file
+        return preview_images
+
+    # Give shared buffers of the preview slices back to the pool
+    def release_preview_images(self):
+        for buffer in getattr(self, "preview_buffers", []):
+            self.shared.pool.release(buffer)
+
+        self.preview_buffers = []
+
+# Worker function for the preview, slices the shared scan into a new shared array
+def preview_slice(ref, resized_shape, cnt, pfix, auto_rotate):
+    with attach(ref) as img:
+        sliced_img = cv_slice_img(img, np.broadcast_to(np.uint8(0), resized_shape), cnt, pfix)
+
+        if auto_rotate in ["cw", "ccw"]:
+            sliced_img = cv_auto_rotate(sliced_img, auto_rotate)
+
+        return export(sliced_img)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import logging
+
+from .scis_api import SETTING_NAMES
+from .scis_rendition import renditions_from_p, rendition_path, rendition_file
+
+# Journal file inside the unique run path
+JOURNAL_NAME = ".scis_journal.jsonl"
+
+# Suffix of slices that are still being written
+PARTIAL_SUFFIX = ".part"
+
+# Write-ahead journal of a slice run, one JSON entry per line
+# Entries: run header, finished images with their slices, rename plan and finish mark
+# Every entry is flushed to disk before the run moves on
+class RunJournal:
+    def __init__(self, path):
+        self.filepath = os.path.join(path, JOURNAL_NAME)
+        self.fp = None
+
+    def exists(self):
+        return os.path.isfile(self.filepath)
+
+    def write(self, entry):
+        if not self.fp:
+            self.fp = open(self.filepath, "a")
+
+        self.fp.write(json.dumps(entry) + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    # Read entries, a line cut short by a crash is ignored
+    def read(self):
+        entries = []
+
+        with open(self.filepath) as infile:
+            for line in infile:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+
+        return entries
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+# Write file so that it is either complete or missing after a crash
+def write_atomic(filepath, data):
+    partial = filepath + PARTIAL_SUFFIX
+
+    with open(partial, "wb") as outfile:
+        outfile.write(data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.replace(partial, filepath)
+
+# Source of image relative to input path, used as key in the journal
+def journal_source(p, image):
+    return os.path.relpath(image.filepath, p.input)
+
+# Start journal for a new slice run
+def start_journal(p, tasks, images):
+    os.makedirs(p.unique_path, exist_ok=True)
+    journal = RunJournal(p.unique_path)
+    journal.write({
+        "run_id": p.run_id,
+        "input": p.input,
+        "settings": {name: getattr(p, name) for name in SETTING_NAMES},
+        "renditions": p.renditions,
+        "tasks": [journal_source(p, images[task]) for task in tasks],
+    })
+
+    return journal
+
+# Record finished image, slices are already on disk
+def journal_image(p, journal, image, count, suffix):
+    journal.write({
+        "done": journal_source(p, image),
+        "slices": [image.tmp_filename(i, suffix) for i in range(count)],
+    })
+
+# Remove slices left by a worker that lost the task or was stopped
+def remove_stale_slices(p, image, suffix):
+    save_path = os.path.normpath(os.path.join(p.unique_path, os.path.relpath(image.path, p.input)))
+    renditions = renditions_from_p(p)
+    i = 0
+
+    while True:
+        filepath = os.path.join(save_path, image.tmp_filename(i, suffix))
+        filepaths = [filepath] + [rendition_file(p, rendition, filepath) for rendition in renditions]
+        found = False
+
+        for name in filepaths + [name + PARTIAL_SUFFIX for name in filepaths]:
+            if os.path.isfile(name):
+                os.remove(name)
+                found = True
+
+        if not found:
+            return
+
+        i += 1
+
+# Load state of interrupted run
+def load_journal(p):
+    journal = RunJournal(p.unique_path)
+
+    if not journal.exists():
+        return None
+
+    state = {"header": None, "done": {}, "rename": None, "finished": False}
+
+    for entry in journal.read():
+        if "run_id" in entry:
+            state["header"] = entry
+        elif "done" in entry:
+            state["done"][entry["done"]] = entry["slices"]
+        elif "rename" in entry:
+            state["rename"] = entry["rename"]
+        elif "finished" in entry:
+            state["finished"] = True
+
+    return state
+
+# Remove partial slices and slices of images that did not finish
+def clean_partial_output(p, done):
+    logger = logging.getLogger()
+    renditions = renditions_from_p(p)
+    keep = set()
+    removed = 0
+
+    for source, slices in done.items():
+        rel_path = os.path.dirname(source)
+
+        for name in slices:
+            filepath = os.path.normpath(os.path.join(p.unique_path, rel_path, name))
+            keep.add(filepath)
+            keep.update(rendition_file(p, rendition, filepath) for rendition in renditions)
+
+    for root in [p.unique_path] + [rendition_path(p, rendition) for rendition in renditions]:
+        for path, dirs, files in os.walk(root):
+            for file in files:
+                filepath = os.path.normpath(os.path.join(path, file))
+
+                if file.endswith(PARTIAL_SUFFIX) or (file.startswith("tmp_file_") and filepath not in keep):
+                    os.remove(filepath)
+                    logger.debug(f"Remove partial output {filepath}")
+                    removed += 1
+
+    return removed
+
+# Restore interrupted run, returns tasks that still need slicing
+def resume_tasks(p, images):
+    logger = logging.getLogger()
+    p.run_id = p.resume
+    p.unique_path = os.path.join(p.output, p.run_id)
+    state = load_journal(p)
+
+    if not state or not state["header"]:
+        logger.error(f"No journal found for run: {p.unique_path}\n")
+        p.cont = False
+        return []
+
+    if state["finished"]:
+        logger.info(f"Run {p.run_id} has already finished\n")
+        p.cont = False
+        return []
+
+    # Use the settings of the original run so the output matches
+    for name, value in state["header"]["settings"].items():
+        setattr(p, name, value)
+
+    p.renditions = state["header"].get("renditions", [])
+
+    sources = {journal_source(p, image): image.id for image in images.values()}
+    tasks = []
+
+    if not state["rename"]:
+        for source in state["header"]["tasks"]:
+            if source in state["done"]:
+                continue
+
+            if source in sources:
+                tasks.append(sources[source])
+            else:
+                logger.warning(f"Image from interrupted run not found: {source}")
+
+        removed = clean_partial_output(p, state["done"])
+        logger.info(f"Resume {p.run_id}: {len(state['done'])} images done, {len(tasks)} left, removed {removed} partial files")
+    else:
+        logger.info(f"Resume {p.run_id}: all images done, finishing rename")
+
+    p.resume_state = state
+
+    return tasks
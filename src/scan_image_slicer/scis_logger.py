@@ -2,6 +2,7 @@
 
 import os
 import sys
+import signal
 import logging
 import logging.handlers
 
@@ -24,7 +25,12 @@ def listener_configurer(p):
     logger.addHandler(stream_handler)
     logger.addHandler(file_handler)
 
+# Keep helper processes running on Ctrl-C, they are stopped by the main process
+def ignore_sigint():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
 def listener_process(p, queue, configurer):
+    ignore_sigint()
     configurer(p)
     while True:
         try:
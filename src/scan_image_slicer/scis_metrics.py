@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+
+from multiprocessing.managers import SyncManager
+
+from .scis_logger import ignore_sigint
+from .scis_journal import write_atomic
+
+# Seconds between updates of the progress display
+DISPLAY_INTERVAL = 1.0
+
+# Counters of a run, shared by all workers
+# Runs inside a manager process, workers report once per image through a proxy
+class RunMetrics:
+    def __init__(self, run_id, mode, tasks):
+        self.lock = threading.Lock()
+        self.run_id = run_id
+        self.mode = mode
+        self.tasks = tasks
+        self.start = time.time()
+        self.counters = {"images": 0, "slices": 0, "megapixels": 0.0, "bytes_written": 0}
+        self.workers = {}
+        self.queue_depth = 0
+
+    # Record finished image, busy is the time the worker spent on it
+    def record(self, worker, busy, megapixels, slices, bytes_written):
+        with self.lock:
+            self.counters["images"] += 1
+            self.counters["slices"] += slices
+            self.counters["megapixels"] += megapixels
+            self.counters["bytes_written"] += bytes_written
+
+            first = self.workers.setdefault(worker, {"start": time.time() - busy, "busy": 0.0})
+            first["busy"] += busy
+
+    def set_queue_depth(self, depth):
+        self.queue_depth = depth
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            workers = {}
+
+            for worker, state in self.workers.items():
+                workers[worker] = {
+                    "busy_seconds": state["busy"],
+                    "utilization": min(state["busy"] / max(now - state["start"], 1e-6), 1.0),
+                }
+
+            return {
+                "time": now,
+                "run": self.run_id,
+                "mode": self.mode,
+                "tasks": self.tasks,
+                "elapsed": now - self.start,
+                "queue_depth": self.queue_depth,
+                "workers": workers,
+                **self.counters,
+            }
+
+class MetricsManager(SyncManager):
+    pass
+
+MetricsManager.register("RunMetrics", RunMetrics)
+
+# Reads metrics in the main process, shows rates in the progress bar and writes the metrics file
+class MetricsReporter(threading.Thread):
+    def __init__(self, p, metrics, manager):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.manager = manager
+        self.path = p.metrics_file
+        self.format = p.metrics_format
+        self.interval = p.metrics_interval
+        self.stats = p.progress_stats
+        self.stop_event = threading.Event()
+        self.pbar = None
+        self.last = None
+        self.last_write = 0
+
+    def attach(self, pbar):
+        self.pbar = pbar
+
+    def run(self):
+        tick = min(self.interval, DISPLAY_INTERVAL) if self.stats else self.interval
+
+        while not self.stop_event.wait(tick):
+            self.update()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.update(final=True)
+
+    # Rates since the last update
+    def rates(self, snap):
+        last = self.last or {"time": snap["time"] - max(snap["elapsed"], 1e-6), "images": 0, "slices": 0, "megapixels": 0.0, "bytes_written": 0}
+        seconds = max(snap["time"] - last["time"], 1e-6)
+
+        return {name + "_per_second": (snap[name] - last[name]) / seconds for name in ["images", "slices", "megapixels", "bytes_written"]}
+
+    def update(self, final=False):
+        snap = self.metrics.snapshot()
+        snap.update(self.rates(snap))
+
+        if self.stats and self.pbar is not None:
+            self.pbar.set_postfix_str(progress_stats(snap))
+
+        if self.path and (final or snap["time"] - self.last_write >= self.interval):
+            try:
+                write_metrics(self.path, self.format, snap)
+            except OSError:
+                self.path = None
+
+            self.last_write = snap["time"]
+
+        self.last = snap
+
+# Short summary for the progress bar
+def progress_stats(snap):
+    utilization = [worker["utilization"] for worker in snap["workers"].values()]
+    stats = f"{snap['megapixels_per_second']:.1f} MP/s, {snap['slices_per_second']:.1f} slices/s, {snap['bytes_written_per_second'] / 2**20:.1f} MB/s"
+    stats += f", queue {snap['queue_depth']}"
+
+    if utilization:
+        stats += f", util {100 * sum(utilization) / len(utilization):.0f}%"
+
+    return stats
+
+# Metrics in Prometheus text format (for node exporter textfile collector)
+def prometheus_text(snap):
+    labels = f'run="{snap["run"]}",mode="{snap["mode"]}"'
+    lines = []
+
+    def metric(name, kind, help, value, extra=""):
+        if not any(line.startswith(f"# TYPE scis_{name} ") for line in lines):
+            lines.append(f"# HELP scis_{name} {help}")
+            lines.append(f"# TYPE scis_{name} {kind}")
+
+        lines.append(f"scis_{name}{{{labels}{extra}}} {value}")
+
+    metric("tasks", "gauge", "Images to process in the run", snap["tasks"])
+    metric("images_total", "counter", "Processed images", snap["images"])
+    metric("slices_total", "counter", "Detected or written slices", snap["slices"])
+    metric("megapixels_total", "counter", "Megapixels of processed images", round(snap["megapixels"], 3))
+    metric("bytes_written_total", "counter", "Bytes of written slices", snap["bytes_written"])
+    metric("images_per_second", "gauge", "Processed images per second", round(snap["images_per_second"], 3))
+    metric("slices_per_second", "gauge", "Slices per second", round(snap["slices_per_second"], 3))
+    metric("megapixels_per_second", "gauge", "Megapixels per second", round(snap["megapixels_per_second"], 3))
+    metric("bytes_written_per_second", "gauge", "Bytes written per second", round(snap["bytes_written_per_second"], 1))
+    metric("queue_depth", "gauge", "Images submitted to workers and not finished", snap["queue_depth"])
+    metric("elapsed_seconds", "gauge", "Seconds since the run started", round(snap["elapsed"], 1))
+
+    for worker, state in snap["workers"].items():
+        metric("worker_busy_seconds_total", "counter", "Seconds the worker spent on images", round(state["busy_seconds"], 3), f',worker="{worker}"')
+
+    for worker, state in snap["workers"].items():
+        metric("worker_utilization", "gauge", "Share of time the worker was busy (0-1)", round(state["utilization"], 3), f',worker="{worker}"')
+
+    return "\n".join(lines) + "\n"
+
+# Prometheus file is replaced atomically, JSON lines get one line per update
+def write_metrics(path, format, snap):
+    if format == "prometheus":
+        write_atomic(path, prometheus_text(snap).encode())
+    else:
+        with open(path, "a") as outfile:
+            outfile.write(json.dumps(snap) + "\n")
+
+# Start shared metrics and reporter if they are used, attaches the proxy to params
+def start_metrics(p, tasks):
+    if not p.metrics_file and not p.progress_stats:
+        p.metrics = None
+        return None
+
+    manager = MetricsManager()
+    manager.start(ignore_sigint)
+    p.metrics = manager.RunMetrics(p.run_id, p.run_mode.split()[0], tasks)
+    reporter = MetricsReporter(p, p.metrics, manager)
+    reporter.start()
+
+    return reporter
+
+# Nothing is queued anymore when the final metrics are written
+def stop_metrics(p, reporter):
+    if reporter:
+        p.metrics.set_queue_depth(0)
+        reporter.stop()
+        reporter.manager.shutdown()
+
+    del p.metrics
+
+# Worker processes are known by their pid, worker threads also by their name
+def worker_name():
+    thread = threading.current_thread()
+
+    if thread is threading.main_thread():
+        return str(os.getpid())
+
+    return f"{os.getpid()}-{thread.name}"
+
+# Report image to shared metrics (if enabled)
+def record_image(p, start, reader, slices, bytes_written):
+    metrics = getattr(p, "metrics", None)
+
+    if metrics:
+        metrics.record(worker_name(), time.time() - start, reader.width * reader.height / 1e6, slices, bytes_written)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of a single sequential read
+PREFETCH_CHUNK = 8 * 2**20
+
+# Give the kernel a hint about how a file is going to be read (Linux and other POSIX systems)
+def advise(fd, advice):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+# Read whole file with large sequential reads, decoders then read from memory
+def read_file(filepath):
+    with open(filepath, "rb", buffering=0) as infile:
+        size = os.fstat(infile.fileno()).st_size
+        advise(infile.fileno(), getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+        data = bytearray(size)
+        view = memoryview(data)
+        pos = 0
+
+        while pos < size:
+            n = infile.readinto(view[pos:pos + PREFETCH_CHUNK])
+
+            if not n:
+                break
+
+            pos += n
+
+    return bytes(view[:pos]) if pos < size else data
+
+# Pull file into the page cache so the worker that opens it does not wait for the network
+def read_ahead(filepath):
+    buffer = bytearray(PREFETCH_CHUNK)
+    total = 0
+
+    with open(filepath, "rb", buffering=0) as infile:
+        advise(infile.fileno(), getattr(os, "POSIX_FADV_WILLNEED", 0))
+
+        while n := infile.readinto(buffer):
+            total += n
+
+    return total
+
+# Mount point of path, reads of the same mount share a concurrency limit
+def mount_point(path):
+    path = os.path.realpath(path)
+
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+
+        if parent == path:
+            break
+
+        path = parent
+
+    return path
+
+# Read files of upcoming tasks ahead of the workers with a pool of threads
+# Files read ahead but not yet done stay within the byte budget, and each mount
+# only gets a limited number of reads at a time so the storage is not flooded
+class Prefetcher:
+    def __init__(self, budget, threads, mount_limit):
+        self.budget = budget
+        self.mount_limit = mount_limit
+        self.pending = deque()
+        self.sizes = {}
+        self.finished = set()
+        self.mounts = {}
+        self.ahead = 0
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="prefetch")
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def add(self, filepath, size):
+        with self.cond:
+            self.pending.append((filepath, size))
+            self.cond.notify()
+
+    # Task of the file is done, its bytes no longer count against the budget
+    def done(self, filepath):
+        with self.cond:
+            if filepath in self.sizes:
+                self.ahead -= self.sizes.pop(filepath)
+            else:
+                self.finished.add(filepath)
+
+            self.cond.notify()
+
+    # Always allow one file so files larger than the budget are read too
+    def fits(self, size):
+        return not self.ahead or self.ahead + size <= self.budget
+
+    def dispatch(self):
+        while True:
+            with self.cond:
+                while not self.stopped and not (self.pending and self.fits(self.pending[0][1])):
+                    self.cond.wait()
+
+                if self.stopped:
+                    return
+
+                filepath, size = self.pending.popleft()
+
+                # Workers got to the file first
+                if filepath in self.finished:
+                    self.finished.discard(filepath)
+                    continue
+
+                self.ahead += size
+                self.sizes[filepath] = size
+                mount = mount_point(os.path.dirname(filepath))
+                limit = self.mounts.setdefault(mount, threading.Semaphore(self.mount_limit))
+
+            self.executor.submit(self.fetch, filepath, limit)
+
+    def fetch(self, filepath, limit):
+        logger = logging.getLogger()
+
+        with limit:
+            if self.stopped:
+                return
+
+            try:
+                read_ahead(filepath)
+            except OSError as e:
+                logger.debug(f"Prefetch failed for {filepath}: {e}")
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+        self.dispatcher.join()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+# Start reading the images of the tasks ahead (if enabled)
+def start_prefetch(p, images):
+    if not p.prefetch_mb:
+        return None
+
+    prefetcher = Prefetcher(p.prefetch_mb * 2**20, p.prefetch_threads, p.prefetch_mount_limit)
+
+    for image in images:
+        prefetcher.add(image.filepath, image.size)
+
+    return prefetcher
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from datetime import datetime
+from concurrent.futures import wait, FIRST_COMPLETED
+from time import strftime, localtime
+from .scis_api import SETTING_NAMES
+from .scis_encoder import SliceEncoder
+from .scis_image import ScanImageSlicerImage
+from .scis_journal import RunJournal, start_journal, journal_source, write_atomic, remove_stale_slices, PARTIAL_SUFFIX
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+from .scis_metrics import start_metrics, stop_metrics
+from .scis import sequential_parallel_rename
+from .utils import image_format
+
+# Header of the queued run, written last so workers only see complete queues
+QUEUE_HEADER = "queue.json"
+
+# Lock taken by the worker that renames the slices once all tasks are done
+FINISH_LOCK = "finish.lock"
+
+# File touched to read the clock of the shared filesystem
+CLOCK_FILE = ".clock"
+
+# Heartbeats per lease, a lease has to miss several before it is taken back
+HEARTBEATS_PER_LEASE = 4
+
+# Work queue of a slice run on a shared directory (e.g. NFS)
+# Every task is a file that moves pending -> leased -> done with atomic renames,
+# so only one worker can claim or complete it
+# Leased files are named <task>@<worker> and touched as heartbeat, leases whose
+# heartbeat is older than the lease time are moved back to pending
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self.pending = os.path.join(path, "pending")
+        self.leased = os.path.join(path, "leased")
+        self.done = os.path.join(path, "done")
+
+    def header(self):
+        try:
+            with open(os.path.join(self.path, QUEUE_HEADER)) as infile:
+                return json.load(infile)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def write_header(self, header):
+        write_atomic(os.path.join(self.path, QUEUE_HEADER), json.dumps(header).encode())
+
+    # Create queue for a run, tasks of an earlier finished run are removed
+    def create(self, header, tasks):
+        for name in [QUEUE_HEADER, FINISH_LOCK]:
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+
+        for folder in [self.pending, self.leased, self.done]:
+            os.makedirs(folder, exist_ok=True)
+
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+
+        for i, task in enumerate(tasks):
+            write_atomic(os.path.join(self.pending, f"{i:08d}.json"), json.dumps(task).encode())
+
+        self.write_header(header)
+
+    # Current time of the shared filesystem, so clocks of the hosts don't need to match
+    def shared_now(self):
+        clock = os.path.join(self.path, CLOCK_FILE)
+
+        with open(clock, "a"):
+            os.utime(clock)
+
+        return os.stat(clock).st_mtime
+
+    # Claim next pending task, returns (lease, task) or None
+    def claim(self, worker):
+        for name in sorted(os.listdir(self.pending)):
+            if name.endswith(PARTIAL_SUFFIX):
+                continue
+
+            lease = os.path.join(self.leased, f"{name}@{worker}")
+
+            try:
+                os.rename(os.path.join(self.pending, name), lease)
+            except FileNotFoundError:
+                continue
+
+            os.utime(lease)
+
+            with open(lease) as infile:
+                return lease, json.load(infile)
+
+        return None
+
+    # Returns False if the lease was taken back
+    def heartbeat(self, lease):
+        try:
+            os.utime(lease)
+            return True
+        except FileNotFoundError:
+            return False
+
+    # Move task to done with its result, returns False if the lease was taken back
+    # Result is renamed into done before the lease is removed, so every done task has its result
+    # A lease taken back in between only makes another worker slice the task again
+    def complete(self, lease, result):
+        name = os.path.basename(lease).split("@")[0]
+
+        if not os.path.exists(lease):
+            return False
+
+        write_atomic(os.path.join(self.done, name), json.dumps(result).encode())
+
+        try:
+            os.remove(lease)
+        except FileNotFoundError:
+            pass
+
+        return True
+
+    # Give task back without result (worker is stopping)
+    def release(self, lease):
+        name = os.path.basename(lease).split("@")[0]
+
+        try:
+            os.rename(lease, os.path.join(self.pending, name))
+        except FileNotFoundError:
+            pass
+
+    # Move leases with an old heartbeat back to pending, returns the taken back leases
+    def reap(self, lease_time):
+        now = self.shared_now()
+        reaped = []
+
+        for name in os.listdir(self.leased):
+            lease = os.path.join(self.leased, name)
+
+            try:
+                if now - os.stat(lease).st_mtime > lease_time:
+                    os.rename(lease, os.path.join(self.pending, name.split("@")[0]))
+                    reaped.append(name)
+            except FileNotFoundError:
+                continue
+
+        return reaped
+
+    def count(self, folder):
+        return len(os.listdir(folder))
+
+    def results(self):
+        results = []
+
+        for name in sorted(os.listdir(self.done)):
+            if name.endswith(PARTIAL_SUFFIX):
+                continue
+
+            with open(os.path.join(self.done, name)) as infile:
+                results.append(json.load(infile))
+
+        return results
+
+    # Only one worker gets the lock (exclusive create works on NFS too)
+    def finish_lock(self):
+        try:
+            os.close(os.open(os.path.join(self.path, FINISH_LOCK), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+# Put tasks of a slice run into the work queue, workers on any host slice them
+def enqueue_tasks(p, tasks, images):
+    logger = logging.getLogger()
+    work_queue = WorkQueue(p.queue_path)
+    header = work_queue.header()
+
+    if header and not header.get("finished"):
+        logger.error(f"Work queue has an unfinished run: {header['run_id']}\n")
+        return
+
+    p.run_id = p.project_name + "_{:%Y_%m_%d_%H_%M_%S}".format(datetime.now())
+    p.unique_path = os.path.join(p.output, p.run_id)
+
+    # Run journal lets the run be finished with --resume if the last worker is lost
+    start_journal(p, tasks, images).close()
+
+    work_queue.create({
+        "run_id": p.run_id,
+        "input": p.input,
+        "output": p.output,
+        "lease": p.queue_lease,
+        "settings": {name: getattr(p, name) for name in SETTING_NAMES},
+        "renditions": p.renditions,
+        "finished": False,
+    }, [{"id": task, "source": journal_source(p, images[task])} for task in tasks])
+
+    logger.info(f"Queued {len(tasks)} tasks for run {p.run_id}")
+    logger.info(f"Start workers with: scan-image-slicer --worker-mode --queue-path {p.queue_path}\n")
+
+# Create image of a task, None if the file is gone
+def task_image(p, task):
+    filepath = os.path.join(p.input, task["source"])
+
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    path, name = os.path.split(filepath)
+
+    return ScanImageSlicerImage(task["id"], path, name, image_format(name), stat.st_mtime, stat.st_size)
+
+# Claim tasks from the work queue and slice them until the queue is empty
+def work_queue(queue, p):
+    logger = logging.getLogger()
+    work_queue = WorkQueue(p.queue_path)
+    header = work_queue.header()
+
+    if not header or header.get("finished"):
+        logger.info(f"No queued run found at: {p.queue_path}\n")
+        return
+
+    # Use the paths and settings of the queued run
+    p.run_id = header["run_id"]
+    p.input = header["input"]
+    p.output = header["output"]
+    p.unique_path = os.path.join(p.output, p.run_id)
+
+    for name, value in header["settings"].items():
+        setattr(p, name, value)
+
+    p.renditions = header.get("renditions", [])
+
+    # Queued runs save separate files and don't share a hash index
+    p.output_archive = "none"
+    p.dedup_mode = "off"
+
+    suffix = SliceEncoder(p).suffix
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    lease_time = header["lease"]
+    interval = lease_time / HEARTBEATS_PER_LEASE
+    executor = create_executor(p.executor, p.workers, ignore_sigint)
+    running = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    result = 0
+
+    logger.info("%s started @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Worker {worker} slicing run {p.run_id} with {p.workers} workers")
+
+    # Keep leases of running tasks alive
+    def heartbeat():
+        while not stop.wait(interval):
+            with lock:
+                leases = [lease for lease, task, image in running.values()]
+
+            for lease in leases:
+                if not work_queue.heartbeat(lease):
+                    logger.warning(f"Lease lost: {os.path.basename(lease)}")
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+
+    # Metrics count the tasks of this worker only
+    metrics = start_metrics(p, work_queue.count(work_queue.pending))
+
+    try:
+        while True:
+            # Fill all workers with tasks
+            while len(running) < p.workers:
+                claim = work_queue.claim(worker)
+
+                if not claim:
+                    break
+
+                lease, task = claim
+                image = task_image(p, task)
+
+                if not image:
+                    logger.error(f"[ID:{task['id']}] - ({task['source']}) - Image not found")
+                    work_queue.complete(lease, {**task, "slices": [], "error": "Image not found"})
+                    continue
+
+                remove_stale_slices(p, image, suffix)
+
+                with lock:
+                    running[executor.submit(image.save_slices, queue, p)] = (lease, task, image)
+
+            if not running:
+                work_queue.reap(lease_time)
+
+                # Done when no other worker holds a lease either
+                if not work_queue.count(work_queue.pending) and not work_queue.count(work_queue.leased):
+                    break
+
+                time.sleep(interval)
+                continue
+
+            if metrics:
+                p.metrics.set_queue_depth(len(running))
+
+            finished, _ = wait(list(running), timeout=interval, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                with lock:
+                    lease, task, image = running.pop(future)
+
+                try:
+                    count = future.result()
+                    record = {**task, "slices": [image.tmp_filename(i, suffix) for i in range(count)]}
+                except Exception as e:
+                    logger.error(f"[ID:{task['id']}] - ({task['source']}) - {e}")
+                    count = 0
+                    record = {**task, "slices": [], "error": str(e)}
+
+                if work_queue.complete(lease, record):
+                    result += count
+                else:
+                    logger.warning(f"[ID:{task['id']}] - ({task['source']}) - Lease was taken back, another worker slices it")
+
+            for name in work_queue.reap(lease_time):
+                logger.warning(f"Abandoned task back in queue: {name}")
+
+    except KeyboardInterrupt:
+        logger.info(f"Stopping {p.run_mode}, giving {len(running)} tasks back to the queue")
+
+        with lock:
+            for future, (lease, task, image) in running.items():
+                future.cancel()
+                work_queue.release(lease)
+
+            running.clear()
+
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        stop_metrics(p, metrics)
+        logger.info(f"Sliced {result} images\n")
+        return
+
+    stop.set()
+    executor.shutdown()
+    stop_metrics(p, metrics)
+
+    logger.info("%s finished @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Sliced {result} images\n")
+
+    # Last worker renames the slices of the whole run
+    if work_queue.finish_lock():
+        finish_run(p, work_queue, header)
+
+# Journal the results of all workers and rename the slices
+def finish_run(p, work_queue, header):
+    logger = logging.getLogger()
+    journal = RunJournal(p.unique_path)
+
+    for record in work_queue.results():
+        journal.write({"done": record["source"], "slices": record["slices"]})
+
+    journal.close()
+    sequential_parallel_rename(p)
+
+    header["finished"] = True
+    work_queue.write_header(header)
+
+    logger.info(f"Run {p.run_id} finished")
+    logger.info(f"Output: {p.unique_path}\n")
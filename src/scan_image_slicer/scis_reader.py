@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+import logging
+import cv2 as cv
+import numpy as np
+
+from io import BytesIO
+from .utils import *
+from .scis_prefetch import read_file
+from .scis_slicer import DETECT_WIDTH
+
+# Max size of a single band when building the overview in tiled mode
+TILED_BAND_BYTES = 64 * 2**20
+
+# Reductions JPEG files can be decoded at (DCT scaling)
+DECODE_REDUCTIONS = [8, 4, 2, 1]
+
+# Read the whole scanned image into memory
+class ScanImageReader:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.img = None
+        self.width = 0
+        self.height = 0
+
+        # Pixels of img are reduced by this factor, width and height are always in full resolution
+        self.reduce = 1
+
+    def open(self):
+        img = pil_open_image(self.filepath)
+
+        if not img:
+            return False
+
+        self.img = pil_to_cv(img)
+        self.height, self.width = self.img.shape[:2]
+
+        return True
+
+    # Create resized image used for slice detection
+    def overview(self, w):
+        return cv_resize(self.img, w=w)
+
+    # Bounding box [x, y, w, h] of contour (detected from overview) in full resolution
+    def box(self, img_resized, cnt):
+        cnt = cnt.copy()
+        cnt[:,:,0] = cnt[:,:,0] * (self.width / img_resized.shape[1])
+        cnt[:,:,1] = cnt[:,:,1] * (self.height / img_resized.shape[0])
+
+        return list(cv.boundingRect(cnt))
+
+    # Read box region (x0, y0, x1, y1) in full resolution (reduced if the pixels are)
+    def region(self, box):
+        return self.img[
+            box[1] // self.reduce:-(-box[3] // self.reduce),
+            box[0] // self.reduce:-(-box[2] // self.reduce)
+        ]
+
+    # Read box region scaled down for refining the detection
+    def detail(self, box, scale):
+        region = self.region(box)
+        w = max(1, round((box[2] - box[0]) * scale))
+        h = max(1, round((box[3] - box[1]) * scale))
+
+        if region.shape[1] <= w:
+            return region
+
+        return cv.resize(region, (w, h), interpolation=cv.INTER_AREA)
+
+    # Slice contour area (detected from overview) in full resolution
+    def slice(self, img_resized, cnt, pfix):
+        return cv_slice_img(self.img, img_resized, cnt, pfix)
+
+# Decode the scan only as large as the scaled slices need
+# Slices are detected from a first decode that is just large enough for the overview,
+# then decode() is called with the reduction the slices allow
+# JPEG files are decoded with DCT scaling, other formats are reduced before the conversion to OpenCV
+class ReducedImageReader(ScanImageReader):
+    def open(self):
+        self.pil = pil_open_image(self.filepath)
+
+        if not self.pil:
+            return False
+
+        self.width, self.height = self.pil.size
+        self.reduce = 0
+        self.decode(max(r for r in DECODE_REDUCTIONS if -(-self.width // r) >= min(DETECT_WIDTH, self.width)))
+
+        return True
+
+    def decode(self, reduce):
+        if reduce == self.reduce:
+            return
+
+        img = self.pil
+
+        if img.format == "JPEG":
+            # Draft only works before the pixels are loaded, open the file again
+            if self.img is not None:
+                if hasattr(self.filepath, "seek"):
+                    self.filepath.seek(0)
+
+                img = pil_open_image(self.filepath)
+
+            img.draft(img.mode, (-(-self.width // reduce), -(-self.height // reduce)))
+            self.img = pil_to_cv(img)
+
+            # Decoder picks the scale, use the one it decoded at
+            self.reduce = next((r for r in DECODE_REDUCTIONS if self.img.shape[1] == -(-self.width // r)), 1)
+
+            return
+
+        self.img = pil_to_cv(img.reduce(reduce) if reduce > 1 else img)
+        self.reduce = reduce
+
+    # Drop the source image once the slices are decoded
+    def done(self):
+        self.pil = None
+
+# Read only the parts of the scanned image that are needed
+# Works with uncompressed TIFF and BMP files, others are read as a whole
+class TiledImageReader(ScanImageReader):
+    def open(self):
+        logger = logging.getLogger()
+        img = pil_open_lazy(self.filepath)
+
+        if not img:
+            return False
+
+        with img:
+            self.width, self.height = img.size
+            tiled = pil_region_tiles(img, (0, 0, self.width, self.height)) is not None
+
+            # Rotated images need to be decoded as a whole
+            if img.getexif().get(0x0112, 1) != 1:
+                tiled = False
+
+        if not tiled:
+            logger.debug(f"Tiled read not supported for {self.filepath}, reading whole image")
+            return super().open()
+
+        return True
+
+    def overview(self, w):
+        if self.img is not None:
+            return super().overview(w)
+
+        logger = logging.getLogger()
+        h = int(self.height * w / self.width)
+
+        # Use a reduced-resolution frame if the file has one
+        with pil_open_lazy(self.filepath) as img:
+            if pil_reduced_frame(img, w):
+                logger.debug(f"Build overview from reduced-resolution frame {img.size}")
+                return cv.resize(pil_to_cv(img), (w, h), interpolation=cv.INTER_AREA)
+
+        # Build overview from horizontal bands of the full image
+        rows = max(1, TILED_BAND_BYTES // (self.width * 3))
+        bands = []
+
+        for y0 in range(0, self.height, rows):
+            y1 = min(y0 + rows, self.height)
+            band_h = int(y1 * h / self.height) - int(y0 * h / self.height)
+
+            if band_h <= 0:
+                continue
+
+            band = self.region((0, y0, self.width, y1))
+            bands.append(cv.resize(band, (w, band_h), interpolation=cv.INTER_AREA))
+
+        logger.debug(f"Build overview ({w}x{h}) from {len(bands)} bands")
+
+        return np.vstack(bands)
+
+    # Read box region (x0, y0, x1, y1) in full resolution
+    def region(self, box):
+        if self.img is not None:
+            return super().region(box)
+
+        return pil_read_region(self.filepath, box)
+
+    def slice(self, img_resized, cnt, pfix):
+        if self.img is not None:
+            return super().slice(img_resized, cnt, pfix)
+
+        # Scale contour to full resolution
+        cnt[:,:,0] = cnt[:,:,0] * (self.width / img_resized.shape[1])
+        cnt[:,:,1] = cnt[:,:,1] * (self.height / img_resized.shape[0])
+
+        # Perspective fix might need the whole rotated rectangle
+        if pfix != 0:
+            x, y, w, h = cv.boundingRect(np.int64(cv.boxPoints(cv.minAreaRect(cnt))))
+        else:
+            x, y, w, h = cv.boundingRect(cnt)
+
+        box = (
+            max(x, 0),
+            max(y, 0),
+            min(x + w, self.width),
+            min(y + h, self.height)
+        )
+
+        # Read the region and move contour inside it
+        region = self.region(box)
+        cnt[:,:,0] -= box[0]
+        cnt[:,:,1] -= box[1]
+
+        return cv_slice_img(region, region, cnt, pfix)
+
+# Memory-map the pixel data of uncompressed images
+# Regions are strided views into the file so only the touched pages are read
+# and workers reading the same file share the page cache
+class MemmapImageReader(TiledImageReader):
+    def open(self):
+        logger = logging.getLogger()
+        img = pil_open_lazy(self.filepath)
+
+        if not img:
+            return False
+
+        with img:
+            self.width, self.height = img.size
+            layout = pil_raw_layout(img)
+
+            # Rotated images need to be decoded as a whole
+            if img.getexif().get(0x0112, 1) != 1:
+                layout = None
+
+        if not layout:
+            logger.debug(f"Memory-mapping not supported for {self.filepath}, reading whole image")
+            return ScanImageReader.open(self)
+
+        offset, stride, rawmode, orientation = layout
+        bpp = PIL_RAW_BYTES[rawmode]
+
+        try:
+            data = np.memmap(self.filepath, dtype=np.uint8, mode="r", offset=offset, shape=(self.height, stride))
+        except (ValueError, OSError) as e:
+            logger.error(e)
+            return False
+
+        view = data[:, :self.width * bpp].reshape(self.height, self.width, bpp)
+
+        # Bottom-up images (BMP) store the last row first
+        if orientation == -1:
+            view = view[::-1]
+
+        # Reorder channels to BGR without copying
+        match rawmode:
+            case "RGB": view = view[..., ::-1]
+            case "RGBA" | "RGBX": view = view[..., 2::-1]
+            case "BGRA" | "BGRX": view = view[..., :3]
+
+        self.view = view
+
+        return True
+
+    def region(self, box):
+        if self.img is not None:
+            return super().region(box)
+
+        return self.view[box[1]:box[3], box[0]:box[2]]
+
+# Wrap image that is already decoded into memory (BGR array)
+class ArrayImageReader(ScanImageReader):
+    def __init__(self, img):
+        super().__init__(None)
+        self.img = img
+
+    def open(self):
+        self.height, self.width = self.img.shape[:2]
+
+        return True
+
+# Create reader for the scanned image based on params
+# Reduced decoding is used for slices that are scaled down (pillow backend)
+def open_image_reader(filepath, p, reduced=False):
+    logger = logging.getLogger()
+    reader_class = ScanImageReader
+
+    if reduced and (p.scale_factor or p.scale_width or p.scale_height):
+        reader_class = ReducedImageReader
+
+    if p.read_backend == "mmap":
+        reader = MemmapImageReader(filepath)
+    elif p.read_backend == "tiled":
+        reader = TiledImageReader(filepath)
+
+    # With prefetch the file is read in large chunks and decoded from memory
+    elif getattr(p, "prefetch_mb", 0):
+        try:
+            reader = reader_class(BytesIO(read_file(filepath)))
+        except OSError as e:
+            logger.error(e)
+            return None
+    else:
+        reader = reader_class(filepath)
+
+    if not reader.open():
+        return None
+
+    return reader
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import os
+import cv2 as cv
+
+from .scis_encoder import SliceEncoder
+
+# Settings a rendition takes from the main output unless it sets them
+ENCODER_SETTINGS = [
+    "save_format",
+    "encoder",
+    "png_optimize",
+    "png_compression",
+    "jpeg_optimize",
+    "jpeg_quality",
+    "webp_lossless",
+    "webp_method",
+    "webp_quality",
+]
+
+# Options of a rendition spec and their types
+RENDITION_OPTIONS = {"width": int, "height": int, "scale": float, "format": str, "quality": int}
+
+# Extra copy of every slice with its own size and file format, e.g. "web:width=1600,format=webp,quality=80"
+# Renditions are made from the filtered slice of the main output and saved into a parallel output tree
+class Rendition:
+    def __init__(self, spec, p):
+        name, _, options = spec.partition(":")
+        self.name = name.strip()
+        self.width = 0
+        self.height = 0
+        self.scale = 0.0
+
+        for setting in ENCODER_SETTINGS:
+            setattr(self, setting, getattr(p, setting))
+
+        if not self.name or not self.name.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"Rendition name should only have letters, numbers, - and _: {spec}")
+
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            key = key.strip()
+
+            if key not in RENDITION_OPTIONS:
+                raise ValueError(f"Unknown rendition option '{key}': {spec}")
+
+            try:
+                value = RENDITION_OPTIONS[key](value.strip())
+            except ValueError:
+                raise ValueError(f"Invalid value of rendition option '{key}': {spec}")
+
+            match key:
+                case "format": self.save_format = value
+                case "quality":
+                    if not value in range(1, 96):
+                        raise ValueError(f"Rendition quality should be between 1 and 95: {spec}")
+
+                    self.jpeg_quality = value
+                    self.webp_quality = value
+                case _: setattr(self, key, value)
+
+        if self.save_format not in ["jpeg", "png", "webp"]:
+            raise ValueError(f"Rendition format should be one of jpeg, png or webp: {spec}")
+
+        if self.width < 0 or self.height < 0 or not 0.0 <= self.scale <= 1.0:
+            raise ValueError(f"Rendition width/height should be positive and scale between 0.0 and 1.0: {spec}")
+
+        self.suffix = SliceEncoder(self).suffix
+
+    # Size of the rendition, never larger than the slice
+    def size(self, w, h):
+        fit = 1.0
+
+        if self.scale:
+            fit = min(fit, self.scale)
+
+        if self.width:
+            fit = min(fit, self.width / w)
+
+        if self.height:
+            fit = min(fit, self.height / h)
+
+        return max(1, round(w * fit)), max(1, round(h * fit))
+
+# Renditions of the params, raises ValueError for invalid specs
+def renditions_from_p(p):
+    return [Rendition(spec, p) for spec in getattr(p, "renditions", None) or []]
+
+# Output tree of a rendition next to the output of the run
+def rendition_path(p, rendition):
+    return p.unique_path + "_" + rendition.name
+
+# Same directory in the output tree of the rendition
+def rendition_dir(p, rendition, path):
+    return os.path.normpath(os.path.join(rendition_path(p, rendition), os.path.relpath(path, p.unique_path)))
+
+# Same file in the output tree of the rendition
+def rendition_file(p, rendition, filepath):
+    path, name = os.path.split(filepath)
+    return os.path.join(rendition_dir(p, rendition, path), os.path.splitext(name)[0] + rendition.suffix)
+
+# Scale filtered slice down to every rendition, largest first so each one is made from the previous one
+def render(img, renditions):
+    h, w = img.shape[:2]
+    sizes = sorted(((rendition.size(w, h), rendition) for rendition in renditions), key=lambda item: -item[0][0] * item[0][1])
+
+    for size, rendition in sizes:
+        if size != (img.shape[1], img.shape[0]):
+            img = cv.resize(img, size, interpolation=cv.INTER_AREA)
+
+        yield rendition, img
+
+# Renames of the renditions that match the renames of the main output
+def rendition_renames(p, renditions, renames):
+    extra = []
+
+    for rendition in renditions:
+        for src, dst in renames:
+            src = rendition_file(p, rendition, src)
+
+            if os.path.exists(src):
+                extra.append([src, rendition_file(p, rendition, dst)])
+
+    return extra
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import json
+import time
+import asyncio
+import logging
+import tarfile
+
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, parse_qsl
+from time import strftime, localtime
+from .scis_api import Settings, SETTING_NAMES, batch_task
+from .scis_encoder import SliceEncoder
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+# Error returned to the client as JSON
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Parse query value using the type of the default setting
+def parse_setting(name, value):
+    default = getattr(Settings, name)
+
+    if isinstance(default, bool):
+        return value.lower() in ["1", "true", "yes"]
+
+    return type(default)(value)
+
+# Serve detection and slicing over HTTP using a persistent process pool
+# Endpoints:
+#   GET  /health
+#   POST /detect  -> JSON with regions
+#   POST /slice   -> tar with index.jsonl and encoded slices
+# Image is the request body or ?path= relative to the input directory
+class SliceServer:
+    def __init__(self, p):
+        self.p = p
+        self.settings = {name: getattr(p, name) for name in SETTING_NAMES}
+        self.executor = None
+        self.slots = None
+        self.running = 0
+        self.waiting = 0
+        self.served = 0
+
+    def start_executor(self):
+        self.executor = create_executor(self.p.executor, self.p.workers, ignore_sigint)
+
+    # Replace a broken pool once, other requests that failed on the same pool don't start more
+    def restart_executor(self, broken):
+        if self.executor is broken:
+            self.start_executor()
+            broken.shutdown(wait=False)
+
+    # Create settings for request, query values override config values
+    def request_settings(self, query):
+        settings = dict(self.settings)
+
+        for name, value in query.items():
+            if name == "path":
+                continue
+
+            if name not in SETTING_NAMES:
+                raise RequestError(400, f"Unknown setting: {name}")
+
+            try:
+                settings[name] = parse_setting(name, value)
+            except ValueError:
+                raise RequestError(400, f"Invalid value for {name}: {value}")
+
+        try:
+            return Settings(**settings)
+        except ValueError as e:
+            raise RequestError(400, str(e))
+
+    # Resolve local path inside the input directory
+    def request_path(self, path):
+        input = os.path.realpath(self.p.input)
+        filepath = os.path.realpath(os.path.join(input, path))
+
+        if os.path.commonpath([input, filepath]) != input:
+            raise RequestError(400, "Path should be inside the input directory")
+
+        if not os.path.isfile(filepath):
+            raise RequestError(404, f"Image not found: {path}")
+
+        return filepath
+
+    # Run job in the process pool, the worker slot is held until the job really ends
+    async def run_job(self, image, settings, encode):
+        loop = asyncio.get_running_loop()
+        await self.slots.acquire()
+        executor = self.executor
+
+        try:
+            future = executor.submit(batch_task, image, settings, encode)
+        except BaseException as e:
+            self.slots.release()
+
+            if isinstance(e, BrokenProcessPool):
+                self.restart_executor(executor)
+
+            raise
+
+        self.running += 1
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release_slot))
+
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self.restart_executor(executor)
+            raise
+
+    def release_slot(self):
+        self.running -= 1
+        self.slots.release()
+
+    # Slice image, requests over the queue limit are rejected right away
+    async def process(self, image, settings, encode):
+        if self.waiting >= self.p.serve_queue:
+            raise RequestError(503, "Server is busy, try again later")
+
+        self.waiting += 1
+
+        try:
+            return await asyncio.wait_for(self.run_job(image, settings, encode), self.p.serve_timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(504, f"Request took longer than {self.p.serve_timeout} seconds")
+        except BrokenProcessPool:
+            raise RequestError(500, "Worker crashed, try again")
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        finally:
+            self.waiting -= 1
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+
+        if url.path == "/health":
+            if method != "GET":
+                raise RequestError(405, "Use GET")
+
+            return 200, "application/json", json.dumps({
+                "status": "ok",
+                "workers": self.p.workers,
+                "running": self.running,
+                "waiting": max(0, self.waiting - self.running),
+                "served": self.served,
+            }).encode()
+
+        if url.path not in ["/detect", "/slice"]:
+            raise RequestError(404, f"Unknown endpoint: {url.path}")
+
+        if method != "POST":
+            raise RequestError(405, "Use POST")
+
+        settings = self.request_settings(query)
+
+        if "path" in query:
+            image = self.request_path(query["path"])
+        elif body:
+            image = body
+        else:
+            raise RequestError(400, "Send the image as request body or use ?path=")
+
+        encode = url.path == "/slice"
+        slices = await self.process(image, settings, encode)
+        self.served += 1
+
+        if not encode:
+            regions = [region for region, _ in slices]
+            return 200, "application/json", json.dumps({"regions": regions}).encode()
+
+        return 200, "application/x-tar", create_slice_tar(slices, SliceEncoder(settings).suffix)
+
+    async def handle(self, reader, writer):
+        logger = logging.getLogger()
+        start = time.monotonic()
+        method, target = "-", "-"
+
+        try:
+            status, content_type, data = 400, "application/json", b""
+
+            try:
+                line = await asyncio.wait_for(reader.readline(), self.p.serve_timeout)
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), self.p.serve_timeout)
+
+                    if line in [b"\r\n", b"\n", b""]:
+                        break
+
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+
+                if length > self.p.serve_max_upload * 2**20:
+                    raise RequestError(413, f"Upload is larger than {self.p.serve_max_upload} MB")
+
+                body = await asyncio.wait_for(reader.readexactly(length), self.p.serve_timeout)
+                status, content_type, data = await self.route(method, target, body)
+
+            except RequestError as e:
+                status, data = e.status, json.dumps({"error": str(e)}).encode()
+            except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                status, data = 400, json.dumps({"error": "Malformed request"}).encode()
+            except Exception as e:
+                logger.error(f"{method} {target} - {e}")
+                status, data = 500, json.dumps({"error": str(e)}).encode()
+
+            header = (
+                f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                + ("Retry-After: 1\r\n" if status == 503 else "")
+                + "Connection: close\r\n\r\n"
+            )
+
+            writer.write(header.encode("latin-1"))
+            writer.write(data)
+            await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+        logger.info(f"{method} {target} {status} {len(data)} bytes {time.monotonic() - start:.2f}s")
+
+    async def serve(self):
+        self.slots = asyncio.Semaphore(self.p.workers)
+        server = await asyncio.start_server(self.handle, self.p.serve_host, self.p.serve_port)
+
+        async with server:
+            await server.serve_forever()
+
+# Pack encoded slices into tar, index.jsonl comes first and lists the regions
+def create_slice_tar(slices, suffix):
+    names = [f"slice_{i + 1}{suffix}" for i in range(len(slices))]
+    index = "".join(
+        json.dumps({"name": name, "region": region, "size": len(data)}) + "\n"
+        for name, (region, data) in zip(names, slices)
+    ).encode()
+
+    with io.BytesIO() as buf:
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            for name, data in [("index.jsonl", index)] + [(n, d) for n, (_, d) in zip(names, slices)]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+
+        return buf.getvalue()
+
+# Run the HTTP service until Ctrl-C
+def serve_requests(p):
+    logger = logging.getLogger()
+    server = SliceServer(p)
+    server.start_executor()
+
+    logger.info("%s started @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Listening on http://{p.serve_host}:{p.serve_port} with {p.workers} workers")
+    logger.info("Press Ctrl-C to stop\n")
+
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error(f"Could not start server: {e}")
+
+    server.executor.shutdown(cancel_futures=True)
+
+    logger.info("%s finished @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Served {server.served} requests\n")
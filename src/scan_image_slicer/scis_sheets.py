@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import html
+import math
+import cv2 as cv
+import numpy as np
+
+from .scis_journal import write_atomic
+
+# Height of the caption under every overlay
+CAPTION_HEIGHT = 40
+
+# Space around overlays
+TILE_MARGIN = 8
+
+# Overlays are fit into a 4:3 box above the caption
+TILE_ASPECT = 3 / 4
+
+# Caption colors (BGR format), images without valid slices get the warning color
+CAPTION_COLOR = (40, 40, 40)
+WARNING_COLOR = (30, 30, 200)
+
+SHEET_BACKGROUND = 235
+SHEET_QUALITY = 85
+
+# Size of the box the workers fit the overlays into
+def tile_size(p):
+    return p.tile_width, round(p.tile_width * TILE_ASPECT)
+
+# Contact sheets of detection overlays for headless test mode
+# Overlays go on the sheets in task order, a sheet is written as soon as all of its overlays are done
+# so only the overlays of unfinished sheets are kept in memory
+class ContactSheets:
+    def __init__(self, p, total):
+        self.path = p.unique_path
+        self.run_id = p.run_id
+        self.per_sheet = p.sheet_tiles
+        self.tile_width, self.tile_height = tile_size(p)
+        self.columns = min(math.ceil(math.sqrt(self.per_sheet)), self.per_sheet)
+        self.total = total
+        self.entries = [None] * total
+        self.pending = {}
+        self.next_sheet = 0
+        self.sheets = []
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def sheet_name(self, sheet):
+        return f"sheet_{sheet + 1:04d}.jpg"
+
+    # Add finished overlay of the i-th task
+    def add(self, i, tile):
+        self.pending[i] = tile.pop("jpeg")
+        self.entries[i] = tile
+
+        while self.next_sheet * self.per_sheet < self.total:
+            first = self.next_sheet * self.per_sheet
+            last = min(first + self.per_sheet, self.total)
+
+            if any(self.entries[n] is None for n in range(first, last)):
+                break
+
+            self.write_sheet(self.next_sheet, first, last)
+            self.next_sheet += 1
+
+    def write_sheet(self, sheet, first, last):
+        rows = math.ceil((last - first) / self.columns)
+        cell_w = self.tile_width + 2 * TILE_MARGIN
+        cell_h = self.tile_height + CAPTION_HEIGHT + 2 * TILE_MARGIN
+        img = np.full((rows * cell_h, self.columns * cell_w, 3), SHEET_BACKGROUND, dtype=np.uint8)
+        name = self.sheet_name(sheet)
+
+        for n in range(first, last):
+            entry = self.entries[n]
+            row, column = divmod(n - first, self.columns)
+            x = column * cell_w + TILE_MARGIN
+            y = row * cell_h + TILE_MARGIN
+            jpeg = self.pending.pop(n)
+
+            if jpeg:
+                tile = cv.imdecode(np.frombuffer(jpeg, np.uint8), cv.IMREAD_COLOR)
+                h, w = tile.shape[:2]
+                ox = x + (self.tile_width - w) // 2
+                oy = y + (self.tile_height - h) // 2
+                img[oy:oy + h, ox:ox + w] = tile
+
+            color = CAPTION_COLOR if entry["valid"] else WARNING_COLOR
+            label = f"{entry['id']}: {os.path.basename(entry['source'])}"
+            counts = f"{entry['valid']} valid, {entry['rejected']} rejected" if jpeg else "not readable"
+
+            cv_caption(img, label, x, y + self.tile_height + 16, self.tile_width, color)
+            cv_caption(img, counts, x, y + self.tile_height + 34, self.tile_width, color)
+
+            entry["sheet"] = name
+            entry["tile"] = n - first + 1
+
+        write_atomic(os.path.join(self.path, name), cv.imencode(".jpg", img, [cv.IMWRITE_JPEG_QUALITY, SHEET_QUALITY])[1].tobytes())
+        self.sheets.append(name)
+
+    # Write the index of the finished overlays
+    def close(self):
+        entries = [entry for entry in self.entries if entry and "sheet" in entry]
+        index = {
+            "run_id": self.run_id,
+            "images": len(entries),
+            "valid": sum(entry["valid"] for entry in entries),
+            "rejected": sum(entry["rejected"] for entry in entries),
+            "sheets": self.sheets,
+            "entries": entries,
+        }
+
+        write_atomic(os.path.join(self.path, "index.json"), json.dumps(index, indent=1).encode())
+        write_atomic(os.path.join(self.path, "index.html"), index_html(index).encode())
+
+        return index
+
+# Caption text cut to fit the tile width
+def cv_caption(img, text, x, y, width, color):
+    font = cv.FONT_HERSHEY_SIMPLEX
+    scale = 0.45
+
+    while len(text) > 4 and cv.getTextSize(text, font, scale, 1)[0][0] > width:
+        text = text[:-4] + ".."
+
+    cv.putText(img, text, (x, y), font, scale, color, 1, cv.LINE_AA)
+
+# Page with the summary, a table of all images and the sheets
+def index_html(index):
+    title = html.escape(f"{index['run_id']} - detection test")
+    none = sum(1 for entry in index["entries"] if not entry["valid"])
+    rows = []
+
+    for entry in index["entries"]:
+        cls = "" if entry["valid"] else ' class="none"'
+        rows.append(
+            f"<tr{cls}><td>{entry['id']}</td><td>{html.escape(entry['source'])}</td>"
+            f"<td>{entry['valid']}</td><td>{entry['rejected']}</td>"
+            f"<td><a href=\"#{entry['sheet']}\">{entry['sheet']}</a> #{entry['tile']}</td></tr>"
+        )
+
+    sheets = [f"<h2 id=\"{name}\">{name}</h2>\n<img src=\"{name}\" loading=\"lazy\" alt=\"{name}\">" for name in index["sheets"]]
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+td, th {{ padding: 2px 10px; text-align: left; border-bottom: 1px solid #ddd; }}
+tr.none {{ color: #c81e1e; }}
+img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>{index['images']} images, {index['valid']} valid and {index['rejected']} rejected regions, {none} images without valid regions</p>
+<table>
+<tr><th>ID</th><th>Image</th><th>Valid</th><th>Rejected</th><th>Sheet</th></tr>
+{chr(10).join(rows)}
+</table>
+{chr(10).join(sheets)}
+</body>
+</html>
+"""
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import threading
+import numpy as np
+
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+
+# Max size of released buffers kept for reuse
+SHM_CACHE_BYTES = 512 * 2**20
+
+# Picklable reference to an array in shared memory, sent to workers instead of the array
+class SharedArrayRef:
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+# Array in shared memory owned by the parent process
+# Lives as long as it has references, the pool takes it back after the last release
+class SharedArray:
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.ref = SharedArrayRef(shm.name, shape, np.dtype(dtype).str)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self.refs = 1
+        self.reuse = True
+
+# Pool of shared memory buffers for passing images to workers without copying them
+# Released buffers are reused for the next arrays that fit, up to the cache size
+class SharedBufferPool:
+    def __init__(self, cache_bytes=SHM_CACHE_BYTES):
+        self.cache_bytes = cache_bytes
+        self.lock = threading.Lock()
+        self.free = []
+        self.live = set()
+
+    # Uninitialized shared array
+    def empty(self, shape, dtype=np.uint8):
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+
+        with self.lock:
+            fits = [shm for shm in self.free if shm.size >= nbytes]
+
+            if fits:
+                shm = min(fits, key=lambda shm: shm.size)
+                self.free.remove(shm)
+            else:
+                shm = SharedMemory(create=True, size=nbytes)
+
+            shared = SharedArray(shm, shape, dtype)
+            self.live.add(shared)
+
+        return shared
+
+    # Copy array into shared memory
+    def put(self, array):
+        shared = self.empty(array.shape, array.dtype)
+        shared.array[...] = array
+
+        return shared
+
+    # Take ownership of an array a worker created with export()
+    def adopt(self, ref):
+        shared = SharedArray(SharedMemory(ref.name), ref.shape, ref.dtype)
+
+        # Sized for one slice, not worth keeping for scans
+        shared.reuse = False
+
+        with self.lock:
+            self.live.add(shared)
+
+        return shared
+
+    def acquire(self, shared):
+        with self.lock:
+            shared.refs += 1
+
+    def release(self, shared):
+        with self.lock:
+            shared.refs -= 1
+
+            if shared.refs > 0:
+                return
+
+            self.live.discard(shared)
+            shared.array = None
+
+            if shared.reuse and sum(shm.size for shm in self.free) + shared.shm.size <= self.cache_bytes:
+                self.free.append(shared.shm)
+            else:
+                unlink(shared.shm)
+
+    # Remove all buffers, arrays of the pool can't be used after this
+    def close(self):
+        with self.lock:
+            for shm in self.free + [shared.shm for shared in self.live]:
+                unlink(shm)
+
+            self.free = []
+            self.live = set()
+
+def unlink(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Views to the buffer still exist, the mapping goes away with them
+        pass
+
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+# View of shared array inside a worker, the view can't be used after the block
+@contextmanager
+def attach(ref):
+    shm = SharedMemory(ref.name)
+
+    try:
+        yield np.ndarray(ref.shape, dtype=ref.dtype, buffer=shm.buf)
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+# Copy array into new shared memory inside a worker, the parent adopts it
+def export(array):
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    ref = SharedArrayRef(shm.name, array.shape, array.dtype.str)
+    shm.close()
+
+    return ref
+
+# Process pool that gets shared arrays as references
+# Thread workers are in the same address space, callers give them the arrays directly
+class SharedWorkers:
+    def __init__(self, workers, executor="process"):
+        self.threads = executor == "thread"
+
+        # Workers have to share the resource tracker of the parent, otherwise buffers
+        # they export would be removed when they exit
+        if not self.threads:
+            resource_tracker.ensure_running()
+
+        self.executor = create_executor(executor, workers, ignore_sigint)
+        self.pool = SharedBufferPool()
+
+    # Run fn(ref, *args) in a worker, the array stays alive until the worker is done
+    def submit(self, fn, shared, *args):
+        self.pool.acquire(shared)
+        future = self.executor.submit(fn, shared.ref, *args)
+        future.add_done_callback(lambda future: self.pool.release(shared))
+
+        return future
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import os
+import cv2 as cv
+import numpy as np
+
+from .utils import *
+
+# Shared slicing pipeline used by the slice modes and the embeddable API
+# Works on any image reader, so it does not care where the image comes from
+
+# Max width of the overview used for fixed detection
+DETECT_WIDTH = 900
+
+# Padding around a coarse slice in overview pixels, covers the error of the coarse pass
+REFINE_PADDING = 3
+
+# Refined slice has to cover this part of the coarse slice, otherwise the coarse one is kept
+REFINE_MIN_AREA = 0.5
+
+# Reduced slices have to be a bit larger than the output, covers rounding of the slice edges
+REDUCE_MARGIN = 0.98
+
+# Detect valid slices from the overview image
+def detect_slices(img_resized, p):
+    for cnt in cv_detect_slices(cv_apply_wt(img_resized, p.white_threshold)):
+
+        # Make sure the area is between min/max sizes
+        if cv_is_cnt_in_range(img_resized, cnt, p.minimum_size, p.maximum_size):
+            yield cnt
+
+# Overview used for slice detection, a small one for the coarse pass of pyramid detection
+def detect_overview(reader, p):
+    width = p.coarse_width if p.detect_mode == "pyramid" else DETECT_WIDTH
+    return reader.overview(min(width, reader.width))
+
+# Detect slices of the scan and return the overview with the slice contours
+# Pyramid detection finds the slices in a small overview and refines each one from a crop of the scan
+def detect_scan(reader, p):
+    img_resized = detect_overview(reader, p)
+    cnts = list(detect_slices(img_resized, p))
+
+    if p.detect_mode == "pyramid":
+        cnts = [refine_slice(reader, img_resized, cnt, p) for cnt in cnts]
+
+    return img_resized, cnts
+
+# Find the edges of a coarse slice again from a crop of the scan at higher resolution
+# Returns contour in overview coordinates with sub-pixel precision (float32)
+def refine_slice(reader, img_resized, cnt, p):
+    fx = reader.width / img_resized.shape[1]
+    fy = reader.height / img_resized.shape[0]
+    x, y, w, h = cv.boundingRect(cnt)
+
+    box = (
+        max(int((x - REFINE_PADDING) * fx), 0),
+        max(int((y - REFINE_PADDING) * fy), 0),
+        min(int(np.ceil((x + w + REFINE_PADDING) * fx)), reader.width),
+        min(int(np.ceil((y + h + REFINE_PADDING) * fy)), reader.height)
+    )
+
+    box_w = box[2] - box[0]
+    box_h = box[3] - box[1]
+    crop = reader.detail(box, min(1.0, p.refine_size / max(box_w, box_h)))
+    sx = crop.shape[1] / box_w
+    sy = crop.shape[0] / box_h
+
+    # Slice is the largest area in the crop, parts of the neighbours are at the edges
+    cnts = cv_detect_slices(cv_apply_wt(crop, p.white_threshold))
+    refined = max(cnts, key=cv.contourArea) if cnts else None
+
+    if refined is None or cv.contourArea(refined) < REFINE_MIN_AREA * w * fx * sx * h * fy * sy:
+        return np.float32(cnt)
+
+    refined = np.float32(refined)
+    refined[:,:,0] = (refined[:,:,0] / sx + box[0]) / fx
+    refined[:,:,1] = (refined[:,:,1] / sy + box[1]) / fy
+
+    return refined
+
+# Largest decode reduction that keeps every slice larger than its scaled output
+def slice_reduction(reader, img_resized, cnts, p):
+    fx = reader.width / img_resized.shape[1]
+    fy = reader.height / img_resized.shape[0]
+    reduce = 8
+
+    for cnt in cnts:
+        x, y, w, h = cv.boundingRect(cnt)
+        w, h = w * fx, h * fy
+
+        # Perspective fix can make the slice smaller than its bounding box
+        if p.perspective_fix:
+            w = h = min(cv.minAreaRect(cnt)[1]) * min(fx, fy)
+
+        # Last scale option sets the output size
+        if p.scale_height:
+            scale = p.scale_height / max(h, 1) / REDUCE_MARGIN
+        elif p.scale_width:
+            scale = p.scale_width / max(w, 1) / REDUCE_MARGIN
+        else:
+            scale = p.scale_factor
+
+        while reduce > 1 and reduce * scale > 1.0:
+            reduce //= 2
+
+    return reduce
+
+# Decode scan again only as large as the scaled slices need (if the reader can)
+def reduce_scan(reader, img_resized, cnts, p):
+    if cnts and hasattr(reader, "decode"):
+        reader.decode(slice_reduction(reader, img_resized, cnts, p))
+        reader.done()
+
+# Slice contour in full resolution, then scale and auto-rotate it
+def process_slice(reader, img_resized, cnt, p):
+
+    # Size the slice gets from the full resolution scan (contour is scaled in place by slice)
+    if reader.reduce > 1:
+        size = scaled_size(*cv_slice_size((reader.height, reader.width), img_resized, cnt, p.perspective_fix), p)
+
+    sliced_img = reader.slice(img_resized, cnt, p.perspective_fix)
+
+    # Reduced slice is resized straight to that size, its own edges are rounded to whole reduced pixels
+    if reader.reduce > 1:
+        sliced_img = cv.resize(sliced_img, size, interpolation=cv.INTER_AREA)
+
+    # Resize the slice
+    else:
+        if p.scale_factor:
+            sliced_img = cv_resize(sliced_img, scale=p.scale_factor)
+
+        if p.scale_width:
+            sliced_img = cv_resize(sliced_img, w=p.scale_width)
+
+        if p.scale_height:
+            sliced_img = cv_resize(sliced_img, h=p.scale_height)
+
+    # Auto-rotate the slice
+    if p.auto_rotate in ["cw", "ccw"]:
+        sliced_img = cv_auto_rotate(sliced_img, p.auto_rotate)
+
+    return sliced_img
+
+# Output size of a w x h slice, same steps and rounding as the resizes of process_slice
+def scaled_size(w, h, p):
+    if p.scale_factor:
+        w, h = round(w * p.scale_factor), round(h * p.scale_factor)
+
+    if p.scale_width:
+        w, h = p.scale_width, int(h * (p.scale_width / float(w)))
+
+    if p.scale_height:
+        w, h = int(w * (p.scale_height / float(h))), p.scale_height
+
+    return max(w, 1), max(h, 1)
+
+# Filters as the list used by the encoder and pil_filter_image
+def slice_filters(p):
+    return [
+        p.filter_color,
+        p.filter_contrast,
+        p.filter_brightness,
+        p.filter_sharpness,
+        p.filter_denoise,
+        p.filter_lut_strength,
+        p.filter_lut_path
+    ]
+
+# Validate the settings used for detecting, slicing and encoding
+# Returns a list of errors, shared by the command-line tool and the API
+def check_slice_values(p):
+    errors = []
+
+    # Make sure we have valid LUT file
+    if p.filter_lut_path:
+        if os.path.isfile(p.filter_lut_path):
+            if not p.filter_lut_path.lower().endswith(".cube"):
+                errors.append(f"LUT should be a valid .cube file")
+        else:
+            errors.append(f"Could not find LUT file at: {p.filter_lut_path}")
+
+    if not p.read_backend in ["pillow", "tiled", "mmap"]:
+        errors.append("Value of '-read/--read-backend' should be one of pillow, tiled or mmap")
+
+    if not p.detect_mode in ["fixed", "pyramid"]:
+        errors.append("Value of '-detect/--detect-mode' should be one of fixed or pyramid")
+
+    if not p.coarse_width in range(100, 1001):
+        errors.append("Value of '-coarseW/--coarse-width' should be between 100 and 1000")
+
+    if not p.refine_size in range(100, 4001):
+        errors.append("Value of '-refineS/--refine-size' should be between 100 and 4000")
+
+    if not p.white_threshold in range(1, 256):
+        errors.append("Value of '-white/--white-threshold' should be between 1 and 255")
+
+    if not int(p.minimum_size) in range(1, 101):
+        errors.append("Value of '-min/--minimum-size' should be between 1 and 100")
+
+    if not int(p.maximum_size) in range(1, 101):
+        errors.append("Value of '-max/--maximum-size' should be between 1 and 100")
+
+    if not p.filter_denoise in range(0, 6):
+        errors.append("Value of '-denoise/--filter-denoise' should be between 0 and 5")
+
+    if not int(p.filter_color * 100.0) in range(0, 201):
+        errors.append("Value of '-color/--filter-color' should be between 0.0 and 2.0")
+
+    if not int(p.filter_contrast * 100.0) in range(0, 201):
+        errors.append("Value of '-contrast/--filter-contrast' should be between 0.0 and 2.0")
+
+    if not int(p.filter_brightness * 100.0) in range(0, 201):
+        errors.append("Value of '-brightness/--filter-brightness' should be between 0.0 and 2.0")
+
+    if not int(p.filter_sharpness * 100.0) in range(0, 201):
+        errors.append("Value of '-sharpness/--filter-sharpness' should be between 0.0 and 2.0")
+
+    if not int(p.filter_lut_strength * 100.0) in range(0, 101):
+        errors.append("Value of '-lutS/--filter-lut-strength' should be between 0.0 and 1.0")
+
+    if not p.perspective_fix in range(0, 90):
+        errors.append("Value of '-pfix/--perspective-fix' should be between 0 and 89")
+
+    if not p.auto_rotate in ["disable", "cw", "ccw"]:
+        errors.append("Value of '-autoR/--auto-rotate' should be one of disable, cw or ccw")
+
+    if not p.save_format in ["jpeg", "png", "webp"]:
+        errors.append("Value of '-save/--save-format' should be one of jpeg, png or webp")
+
+    if not p.encoder in ["auto", "pillow", "opencv"]:
+        errors.append("Value of '-enc/--encoder' should be one of auto, pillow or opencv")
+
+    if not p.png_compression in range(0, 10):
+        errors.append("Value of '-pngC/--png-compression' should be between 0 and 9")
+
+    if not p.jpeg_quality in range(0, 96):
+        errors.append("Value of '-jpegQ/--jpeg-quality' should be between 0 and 95")
+
+    if not p.webp_method in range(0, 7):
+        errors.append("Value of '-webpM/--webp-method' should be between 0 and 6")
+
+    if not p.webp_quality in range(1, 101):
+        errors.append("Value of '-webpQ/--webp-quality' should be between 1 and 100")
+
+    return errors
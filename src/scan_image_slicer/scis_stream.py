@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import tarfile
+
+from collections import deque
+from time import strftime, localtime
+from .scis_api import settings_from_p, batch_task
+from .scis_encoder import SliceEncoder
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+from .utils import create_slice_name, image_format
+
+# Number of scans per worker read ahead from the stream
+STREAM_BUFFER = 2
+
+# Size of a single read from the input stream
+STREAM_CHUNK = 2**20
+
+# Buffered reader that can look ahead in a pipe
+class StreamBuffer:
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf = bytearray()
+
+    # Make sure the buffer has at least n bytes, returns False at the end of stream
+    def fill(self, n):
+        while len(self.buf) < n:
+            chunk = self.fp.read(max(n - len(self.buf), STREAM_CHUNK))
+
+            if not chunk:
+                return False
+
+            self.buf += chunk
+
+        return True
+
+    def peek(self, n):
+        self.fill(n)
+        return bytes(self.buf[:n])
+
+    def read(self, n=-1):
+        if n < 0:
+            while self.fill(len(self.buf) + STREAM_CHUNK):
+                pass
+            n = len(self.buf)
+
+        self.fill(n)
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+
+        return data
+
+    # Length of the image at the start of the buffer
+    # Only formats that store their own length can be split from a stream
+    def image_length(self):
+        head = self.peek(12)
+
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return "png", self.png_length()
+
+        if head.startswith(b"\xff\xd8"):
+            return "jpeg", self.jpeg_length()
+
+        if head.startswith(b"BM") and len(head) >= 6:
+            return "bmp", int.from_bytes(head[2:6], "little")
+
+        if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+            size = int.from_bytes(head[4:8], "little")
+            return "webp", 8 + size + size % 2
+
+        if head[:4] in [b"II*\x00", b"MM\x00*"]:
+            raise ValueError("TIFF files can't be split from a stream of images, send them as tar")
+
+        raise ValueError("Unknown image format in stream")
+
+    def png_length(self):
+        pos = 8
+
+        while self.fill(pos + 8):
+            length = int.from_bytes(self.buf[pos:pos + 4], "big")
+            chunk_type = bytes(self.buf[pos + 4:pos + 8])
+            pos += 12 + length
+
+            if chunk_type == b"IEND":
+                return pos
+
+        raise ValueError("PNG ended before IEND chunk")
+
+    def jpeg_length(self):
+        pos = 2
+
+        while self.fill(pos + 2):
+            if self.buf[pos] != 0xFF:
+                raise ValueError("Corrupted JPEG in stream")
+
+            marker = self.buf[pos + 1]
+
+            # Fill bytes before marker
+            if marker == 0xFF:
+                pos += 1
+                continue
+
+            if marker == 0xD9:
+                return pos + 2
+
+            # Markers without length
+            if marker in [0x01, 0xD8] or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+
+            if not self.fill(pos + 4):
+                break
+
+            pos += 2 + int.from_bytes(self.buf[pos + 2:pos + 4], "big")
+
+            # Skip entropy coded data, FF is followed by 00 or a restart marker inside it
+            if marker == 0xDA:
+                while True:
+                    found = self.buf.find(b"\xff", pos)
+
+                    if found < 0 or found + 1 >= len(self.buf):
+                        pos = found if found >= 0 else max(pos, len(self.buf))
+
+                        if not self.fill(len(self.buf) + STREAM_CHUNK):
+                            raise ValueError("JPEG ended before EOI marker")
+
+                        continue
+
+                    following = self.buf[found + 1]
+
+                    if following == 0x00 or 0xD0 <= following <= 0xD7:
+                        pos = found + 2
+                        continue
+
+                    pos = found
+                    break
+
+        raise ValueError("JPEG ended before EOI marker")
+
+# Read scans from tar stream or from concatenated image files
+# Yields (name, data), name keeps the folders of tar members
+def read_scans(fp):
+    stream = StreamBuffer(fp)
+    head = stream.peek(512)
+
+    if len(head) == 512 and head[257:262] == b"ustar":
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if member.isfile() and image_format(member.name):
+                    yield member.name, tar.extractfile(member).read()
+        return
+
+    count = 0
+
+    while stream.peek(1):
+        format, length = stream.image_length()
+        count += 1
+        yield f"stream_{count}.{format}", stream.read(length)
+
+# Write slices of one scan into output tar, named like slice mode names them
+class StreamWriter:
+    def __init__(self, fp, suffix):
+        self.tar = tarfile.open(fileobj=fp, mode="w|")
+        self.suffix = suffix
+        self.counters = {}
+        self.index = []
+        self.count = 0
+
+    def add(self, name, slices):
+        rel_path = os.path.normpath(os.path.dirname(name) or ".")
+
+        for region, data in slices:
+            self.counters[rel_path] = self.counters.get(rel_path, 0) + 1
+            member = create_slice_name(rel_path, self.counters[rel_path], self.suffix)
+
+            if rel_path != ".":
+                member = "/".join(rel_path.split(os.sep) + [member])
+
+            self.add_member(member, data)
+            self.index.append({"name": member, "source": name, "region": region, "size": len(data)})
+            self.count += 1
+
+    def add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+
+    # Index of all slices goes last, the slices are already streamed
+    def close(self):
+        self.add_member("index.jsonl", "".join(json.dumps(entry) + "\n" for entry in self.index).encode())
+        self.tar.close()
+
+# Slice scans from stdin (or named pipe) and write the slices as tar stream to stdout
+def stream_slices(p):
+    logger = logging.getLogger()
+    settings = settings_from_p(p)
+    source = sys.stdin.buffer if p.stream_input == "-" else open(p.stream_input, "rb")
+    writer = StreamWriter(sys.stdout.buffer, SliceEncoder(settings).suffix)
+    executor = create_executor(p.executor, p.workers, ignore_sigint)
+    pending = deque()
+    scan_id = 0
+
+    logger.info("%s started @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+
+    # Write slices in the same order the scans arrived
+    def write_next():
+        id, name, future = pending.popleft()
+
+        try:
+            slices = future.result()
+        except Exception as e:
+            logger.error(f"[ID:{id}] - ({name}) - {e}")
+            return
+
+        if not slices:
+            logger.warning(f"[ID:{id}] - ({name}) - No images found, skipping it..")
+            return
+
+        writer.add(name, slices)
+        logger.info(f"[ID:{id}] - ({name}) - Sliced {len(slices)} images")
+
+    try:
+        try:
+            for name, data in read_scans(source):
+                pending.append((scan_id, name, executor.submit(batch_task, data, settings, True)))
+                scan_id += 1
+
+                while len(pending) >= p.workers * STREAM_BUFFER:
+                    write_next()
+
+        except (ValueError, tarfile.TarError) as e:
+            logger.error(f"Could not read input stream: {e}")
+        except KeyboardInterrupt:
+            logger.info(f"Stopping {p.run_mode}, waiting for {len(pending)} images to finish")
+
+        while pending:
+            write_next()
+
+        writer.close()
+
+    except BrokenPipeError:
+        logger.error("Output stream was closed")
+
+    executor.shutdown(cancel_futures=True)
+
+    if source is not sys.stdin.buffer:
+        source.close()
+
+    logger.info("%s finished @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Sliced {writer.count} images from {scan_id} scans\n")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import glob
+import json
+import bisect
+import fnmatch
+
+from datetime import datetime
+from .scis_journal import JOURNAL_NAME
+
+# Index over collected images for selecting tasks with set operations
+# Mtime and size are kept sorted so ranges are found with binary search
+class TaskIndex:
+    def __init__(self, images, input):
+        self.images = images
+        self.ids = set(images)
+        self.sources = {}
+        self.folders = {}
+        self.formats = {}
+
+        # Images are found under input path, so cutting the prefix is enough (relpath is slow)
+        prefix = os.path.join(input, "")
+
+        for id, image in images.items():
+            if image.filepath.startswith(prefix):
+                source = image.filepath[len(prefix):]
+            else:
+                source = os.path.relpath(image.filepath, input)
+
+            source = source.replace(os.sep, "/")
+            folder = source.rpartition("/")[0]
+            format = "jpeg" if image.format == "jpg" else image.format
+
+            self.sources[id] = source
+            self.folders.setdefault(folder, set()).add(id)
+            self.formats.setdefault(format, set()).add(id)
+
+        self.by_mtime = sorted((image.mtime, id) for id, image in images.items())
+        self.by_size = sorted((image.size, id) for id, image in images.items())
+
+    # Images between low and high (None = open end) from sorted (value, id) list
+    def range(self, items, low, high):
+        start = bisect.bisect_left(items, (low, -1)) if low is not None else 0
+        end = bisect.bisect_left(items, (high, -1)) if high is not None else len(items)
+
+        return {id for _, id in items[start:end]}
+
+    def newest(self, n):
+        return {id for _, id in self.by_mtime[-n:]} if n else set()
+
+    def oldest(self, n):
+        return {id for _, id in self.by_mtime[:n]}
+
+    def glob(self, patterns):
+        return {id for id, source in self.sources.items() if any(fnmatch.fnmatch(source, pattern) for pattern in patterns)}
+
+    def regex(self, pattern):
+        regex = re.compile(pattern)
+        return {id for id, source in self.sources.items() if regex.search(source)}
+
+    # Images inside folders and their subfolders
+    def folder(self, folders):
+        folders = [os.path.normpath(folder).replace(os.sep, "/").strip("/") for folder in folders]
+        ids = set()
+
+        for path, folder_ids in self.folders.items():
+            if any(path == folder or path.startswith(folder + "/") for folder in folders):
+                ids |= folder_ids
+
+        return ids
+
+    def format(self, formats):
+        ids = set()
+
+        for format in formats:
+            format = format.lower().lstrip(".")
+            ids |= self.formats.get("jpeg" if format == "jpg" else format, set())
+
+        return ids
+
+    def modified(self, after, before):
+        after = after.timestamp() if after else None
+        before = before.timestamp() if before else None
+
+        return self.range(self.by_mtime, after, before)
+
+    def size(self, min_mb, max_mb):
+        low = min_mb * 2**20 if min_mb else None
+        high = max_mb * 2**20 + 1 if max_mb else None
+
+        return self.range(self.by_size, low, high)
+
+    # Images that have no slices in earlier runs inside output directory
+    def not_sliced(self, output):
+        sliced = sliced_sources(output)
+        return {id for id, source in self.sources.items() if source not in sliced and not self.images[id].last_run}
+
+# Sources (relative to input) sliced by earlier runs
+# Read from run journals and archive indexes inside output directory
+def sliced_sources(output):
+    sources = set()
+    runs = os.path.join(glob.escape(output), "*")
+    indexes = [(filepath, "done") for filepath in glob.glob(os.path.join(runs, JOURNAL_NAME))]
+
+    for filepath in glob.glob(os.path.join(runs, "*.jsonl")):
+        stem = os.path.splitext(filepath)[0]
+
+        if os.path.isfile(stem + ".tar") or os.path.isfile(stem + ".zip"):
+            indexes.append((filepath, "source"))
+
+    for filepath, key in indexes:
+        with open(filepath) as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                if key in entry:
+                    sources.add(entry[key].replace(os.sep, "/"))
+
+    return sources
+
+# Parse date (YYYY-MM-DD) or date with time, returns None if invalid
+def parse_date(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+# Task options that add images
+def add_options(p):
+    return [p.add_all, p.add_id, p.add_new, p.add_old, p.add_random, p.add_glob, p.add_regex, p.add_folder]
+
+# Task options that narrow down the added images
+def only_options(p):
+    return [p.only_format, p.only_after, p.only_before, p.only_min_size, p.only_max_size, p.only_not_sliced]
+
+def has_task_options(p):
+    return any(add_options(p) + only_options(p) + [p.remove_id])
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import logging
+
+from .scis_journal import write_atomic
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+
+# Thumbnail cache inside the config directory, shared by all projects
+THUMB_CACHE_DIR = "thumbnails"
+
+# Max size of the thumbnail cache, least recently used thumbnails are removed first
+THUMB_CACHE_BYTES = 256 * 2**20
+
+# Settings that change the detection overlay of a thumbnail
+THUMB_SETTINGS = ["white_threshold", "minimum_size", "maximum_size", "detect_mode", "coarse_width", "refine_size"]
+
+# Size of the box thumbnails are fit into
+def thumb_size(p):
+    return p.thumb_width, round(p.thumb_width * 3 / 4)
+
+# Detection overlays of scans saved as small JPEG files with the slice counts
+# Entries are keyed by the file, its size and mtime and the detection settings,
+# so changed scans or settings simply get new entries
+class ThumbnailCache:
+    def __init__(self, path, max_bytes=THUMB_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, image, p):
+        settings = [getattr(p, name) for name in THUMB_SETTINGS]
+        text = json.dumps([image.filepath, image.size, image.mtime, settings, thumb_size(p)])
+
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def files(self, key):
+        return os.path.join(self.path, key + ".jpg"), os.path.join(self.path, key + ".json")
+
+    # Cached tile or None, used entries are touched so they are removed last
+    def get(self, key):
+        jpeg_file, info_file = self.files(key)
+
+        try:
+            with open(info_file) as infile:
+                tile = json.load(infile)
+
+            with open(jpeg_file, "rb") as infile:
+                tile["jpeg"] = infile.read()
+
+            os.utime(info_file)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        return tile
+
+    def put(self, key, tile):
+        if not tile.get("jpeg"):
+            return
+
+        jpeg_file, info_file = self.files(key)
+
+        try:
+            write_atomic(jpeg_file, tile["jpeg"])
+            write_atomic(info_file, json.dumps({name: value for name, value in tile.items() if name != "jpeg"}).encode())
+        except OSError as e:
+            logging.getLogger().debug(f"Could not cache thumbnail: {e}")
+
+    # Remove least recently used entries over the size limit
+    def prune(self):
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+
+            jpeg_file, info_file = self.files(name[:-5])
+
+            try:
+                size = os.path.getsize(jpeg_file) + os.path.getsize(info_file)
+                entries.append((os.path.getmtime(info_file), size, jpeg_file, info_file))
+            except OSError:
+                continue
+
+            total += size
+
+        for mtime, size, jpeg_file, info_file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            for filepath in [info_file, jpeg_file]:
+                try:
+                    os.remove(filepath)
+                except OSError:
+                    pass
+
+            total -= size
+
+# Loads thumbnails of a list of images for the grid browser
+# Cached thumbnails are read right away, missing ones are rendered by workers in the background
+# Only the requested (visible) cells are rendered, requests for cells that scrolled away are cancelled
+class ThumbnailLoader:
+    def __init__(self, p, queue, images):
+        self.p = p
+        self.queue = queue
+        self.images = images
+        self.cache = ThumbnailCache(os.path.join(p.path_config_dir, THUMB_CACHE_DIR))
+        self.executor = create_executor(p.executor, max(p.workers, 1), ignore_sigint)
+        self.running = {}
+        self.tiles = {}
+        self.keep = 0
+
+    # Load or render thumbnails of the indexes, returns the indexes that are ready right away
+    def request(self, indexes):
+        indexes = [i for i in indexes if i in range(len(self.images))]
+        ready = []
+
+        # Thumbnails out of view don't need to be rendered or kept
+        for i in [i for i in self.running if i not in indexes]:
+            if self.running[i].cancel():
+                del self.running[i]
+
+        self.keep = max(self.keep, 4 * len(indexes))
+
+        if len(self.tiles) > self.keep:
+            for i in [i for i in self.tiles if i not in indexes]:
+                del self.tiles[i]
+
+        for i in indexes:
+            if i in self.tiles or i in self.running:
+                continue
+
+            tile = self.cache.get(self.cache.key(self.images[i], self.p))
+
+            if tile:
+                self.tiles[i] = tile
+                ready.append(i)
+            else:
+                self.running[i] = self.executor.submit(self.images[i].create_test_tile, self.queue, self.p, *thumb_size(self.p))
+
+        return ready
+
+    # Collect rendered thumbnails, returns their indexes
+    def poll(self):
+        ready = []
+
+        for i, future in list(self.running.items()):
+            if not future.done():
+                continue
+
+            del self.running[i]
+
+            if future.cancelled():
+                continue
+
+            try:
+                tile = future.result()
+            except Exception as e:
+                logging.getLogger().error(f"[ID:{self.images[i].id}] - ({self.images[i].name}) - {e}")
+                tile = {"id": self.images[i].id, "valid": 0, "rejected": 0, "jpeg": None}
+
+            self.cache.put(self.cache.key(self.images[i], self.p), tile)
+            self.tiles[i] = tile
+            ready.append(i)
+
+        return ready
+
+    def busy(self):
+        return bool(self.running)
+
+    # Detection settings changed, thumbnails have to be rendered again
+    def reset(self):
+        for future in self.running.values():
+            future.cancel()
+
+        self.running = {}
+        self.tiles = {}
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.cache.prune()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import logging
+
+from datetime import datetime
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from time import strftime, localtime
+from .scis_image import ScanImageSlicerImage
+from .scis_archive import start_archive, stop_archive
+from .scis_dedup import start_dedup, stop_dedup
+from .scis_encoder import SliceEncoder
+from .scis_journal import journal_source
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+from .scis_rendition import renditions_from_p, rendition_renames
+from .utils import *
+
+# Number of polls between full rescans (catches files that were changed in place)
+WATCH_FULL_SCAN = 30
+
+# Keep track of compatible images inside the input directory
+# Only directories with a changed mtime are listed again between full rescans
+class InputWatcher:
+    def __init__(self, input):
+        self.input = os.path.normpath(input)
+        self.dirs = {}
+        self.polls = 0
+
+    def scan_dir(self, path):
+        files = {}
+        subdirs = []
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                    continue
+
+                format = image_format(entry.name)
+
+                if format and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = [path, entry.name, format, stat.st_mtime, stat.st_size]
+
+        return files, subdirs
+
+    # Return all compatible images as {filepath: [path, file, format, mtime, size]}
+    def poll(self):
+        full_scan = self.polls % WATCH_FULL_SCAN == 0
+        self.polls += 1
+        images = {}
+        dirs = {}
+        stack = [self.input]
+
+        while stack:
+            path = stack.pop()
+
+            try:
+                mtime = os.stat(path).st_mtime
+
+                if full_scan or self.dirs.get(path, [None])[0] != mtime:
+                    files, subdirs = self.scan_dir(path)
+                else:
+                    mtime, files, subdirs = self.dirs[path]
+            except OSError:
+                continue
+
+            dirs[path] = [mtime, files, subdirs]
+            images.update(files)
+            stack.extend(subdirs)
+
+        self.dirs = dirs
+
+        return images
+
+# Rename temporary slices of one image, counters continue between images
+def rename_slices(p, image, count, counters, suffix):
+    logger = logging.getLogger()
+    rel_path = os.path.normpath(os.path.relpath(image.path, p.input))
+    save_path = os.path.normpath(os.path.join(p.unique_path, rel_path))
+    renames = []
+
+    for i in range(count):
+        counters[rel_path] = counters.get(rel_path, 0) + 1
+        src = os.path.join(save_path, image.tmp_filename(i, suffix))
+        dst = os.path.join(save_path, create_slice_name(rel_path, counters[rel_path], suffix))
+        renames.append([src, dst])
+
+    for src, dst in renames + rendition_renames(p, renditions_from_p(p), renames):
+        try:
+            os.rename(src, dst)
+            logger.debug(f"Rename {src} to {dst}")
+        except OSError as e:
+            logger.error(e)
+
+# Watch input directory and slice new or changed images once they are fully written
+def watch_input(queue, p):
+    logger = logging.getLogger()
+
+    # Create unique run id and path for the whole watch session
+    p.run_id = p.project_name + "_{:%Y_%m_%d_%H_%M_%S}".format(datetime.now())
+    p.unique_path = os.path.join(p.output, p.run_id)
+
+    watcher = InputWatcher(p.input)
+    suffix = SliceEncoder(p).suffix
+    use_archive = p.output_archive != "none"
+    counters = {}
+    pending = {}
+    futures = {}
+    next_id = 0
+    result = 0
+
+    # Images that already exist are not sliced
+    known = {fp: (image[3], image[4]) for fp, image in watcher.poll().items()}
+
+    logger.info("%s started @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Watching {p.input} with {p.workers} workers (skipped {len(known)} existing images)")
+    logger.info("Press Ctrl-C to stop\n")
+
+    if use_archive:
+        archive = start_archive(p, p.workers)
+
+    if p.dedup_mode != "off":
+        dedup = start_dedup(p)
+
+    # Workers finish their images when the user stops watch mode with Ctrl-C
+    executor = create_executor(p.executor, p.workers, ignore_sigint)
+
+    # Replace a broken pool once, all of its images fail with the same error
+    def restart(broken):
+        nonlocal executor
+
+        if executor is broken:
+            broken.shutdown(wait=True, cancel_futures=True)
+            executor = create_executor(p.executor, p.workers, ignore_sigint)
+
+    def submit(image):
+        try:
+            futures[executor.submit(image.save_slices, queue, p)] = image, executor
+        except BrokenProcessPool:
+            restart(executor)
+            futures[executor.submit(image.save_slices, queue, p)] = image, executor
+
+    def collect(done):
+        nonlocal result
+
+        for future in done:
+            image, pool = futures.pop(future)
+
+            try:
+                count = future.result()
+            except Exception as e:
+                # Worker process died, keep watching with a new pool
+                if isinstance(e, BrokenProcessPool):
+                    restart(pool)
+
+                logger.error(f"[ID:{image.id}] - ({image.name}) - {e}")
+
+                if p.dedup_mode != "off":
+                    p.dedup_index.discard(journal_source(p, image))
+
+                continue
+
+            # Hashes are saved once the slices of the image are written
+            if p.dedup_mode != "off":
+                p.dedup_index.commit(journal_source(p, image))
+
+            if count and not use_archive:
+                rename_slices(p, image, count, counters, suffix)
+
+            if count:
+                logger.info(f"[ID:{image.id}] - ({image.name}) - Sliced {count} images")
+
+            result += count
+
+    try:
+        while True:
+            now = time.monotonic()
+
+            # Queue new and changed images
+            for fp, image in watcher.poll().items():
+                if known.get(fp) != (image[3], image[4]) and fp not in pending:
+                    pending[fp] = [image, None, now]
+
+            # Wait until the image has not changed for the settle time
+            for fp in list(pending):
+                image, last_stat, since = pending[fp]
+
+                try:
+                    stat = os.stat(fp)
+                except OSError:
+                    del pending[fp]
+                    continue
+
+                stat = (stat.st_mtime, stat.st_size)
+
+                if stat != last_stat:
+                    pending[fp] = [image, stat, now]
+                    continue
+
+                if now - since < p.watch_settle:
+                    continue
+
+                del pending[fp]
+                known[fp] = stat
+
+                image = ScanImageSlicerImage(next_id, image[0], image[1], image[2], stat[0], stat[1])
+                submit(image)
+                next_id += 1
+
+            # Collect finished images while waiting for the next poll
+            if futures:
+                done, _ = wait(futures, timeout=p.watch_interval, return_when=FIRST_COMPLETED)
+                collect(done)
+            else:
+                time.sleep(p.watch_interval)
+
+    except KeyboardInterrupt:
+        logger.info(f"Stopping {p.run_mode}, waiting for {len(futures)} images to finish")
+
+    # Finish images already handed to the workers
+    collect(wait(futures).done)
+    executor.shutdown()
+
+    if use_archive:
+        stop_archive(p, archive)
+
+    if p.dedup_mode != "off":
+        stop_dedup(p, dedup)
+
+    logger.info("%s finished @ %s", p.run_mode.capitalize(), strftime("%a %d %b %Y %H:%M:%S", localtime()))
+    logger.info(f"Sliced {result} images\n")
+    logger.info(f"Output: {p.unique_path}\n")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import signal
+import logging
+
+from multiprocessing.managers import SyncManager
+from concurrent.futures.process import BrokenProcessPool
+
+from .scis_journal import journal_source, write_atomic
+from .scis_logger import ignore_sigint
+from .scis_executor import create_executor
+
+# Quarantine list inside output directory, shared by all runs
+QUARANTINE_NAME = ".scis_quarantine.jsonl"
+
+# Report of slow, stopped and failed images inside the run directory
+REPORT_NAME = "report.json"
+
+# Seconds between checks of the running tasks
+WATCHDOG_INTERVAL = 1.0
+
+# Runs in the worker: note the worker process and the start time of the task, then run it
+def run_started(started, key, fn, *args):
+    started[key] = (os.getpid(), time.time())
+
+    return fn(*args)
+
+# Workers of a batch run
+# Workers note when they start a task, so time limits don't count the time the task waits in the queue
+# A worker process that dies breaks its pool: the pool is replaced and the tasks that were not running
+# in the dead worker can run again. With a hard time limit every worker is its own pool (lane) running
+# one task at a time, so a worker that runs too long is killed without touching the tasks of the others
+class BatchWorkers:
+    def __init__(self, executor, workers, isolated, initializer=None):
+        self.executor = executor
+        self.initializer = initializer
+        self.isolated = isolated
+        self.lane_workers = 1 if isolated else workers
+        self.lanes = [self.start_lane() for _ in range(workers if isolated else 1)]
+        self.futures = {}
+        self.dead = set()
+        self.manager = None
+
+        # Threads share the dict, processes write to it through a manager
+        if executor == "thread":
+            self.started = {}
+        else:
+            self.manager = SyncManager()
+            self.manager.start(ignore_sigint)
+            self.started = self.manager.dict()
+
+    def start_lane(self):
+        return create_executor(self.executor, self.lane_workers, self.initializer)
+
+    # Isolated workers only get a task when they are free
+    def free_lane(self):
+        if not self.isolated:
+            return 0
+
+        busy = [lane for lane, executor, key in self.futures.values()]
+
+        return next(i for i in range(len(self.lanes)) if i not in busy)
+
+    # Run fn(*args) as the task key, a pool that broke since the last task is replaced first
+    def submit(self, key, fn, *args):
+        lane = self.free_lane()
+
+        try:
+            future = self.lanes[lane].submit(run_started, self.started, key, fn, *args)
+        except BrokenProcessPool:
+            self.restart(lane)
+            future = self.lanes[lane].submit(run_started, self.started, key, fn, *args)
+
+        self.futures[future] = (lane, self.lanes[lane], key)
+
+        return future
+
+    # Start times of the running tasks
+    def start_times(self):
+        return {key: start for key, (pid, start) in self.started.copy().items()}
+
+    # Task is collected, its worker takes the next one
+    def done(self, future):
+        lane, executor, key = self.futures.pop(future)
+        self.started.pop(key, None)
+
+    # Replace a broken pool, its workers that did not exit by the pool's own terminate died on their own
+    def restart(self, lane):
+        executor = self.lanes[lane]
+        processes = list(executor._processes.values())
+        executor.shutdown(wait=True, cancel_futures=True)
+
+        dead = {process.pid for process in processes if process.exitcode != -signal.SIGTERM}
+
+        # Worker was stopped from outside, any of the running tasks may have been the cause
+        self.dead |= dead or {process.pid for process in processes}
+        self.lanes[lane] = self.start_lane()
+
+    # Task failed with a broken pool, the pool is replaced once
+    # Returns if the task was started and if it was running in the worker that died
+    def crashed(self, future):
+        lane, executor, key = self.futures.pop(future)
+
+        if self.lanes[lane] is executor:
+            self.restart(lane)
+
+        start = self.started.pop(key, None)
+
+        return start is not None, start is not None and start[0] in self.dead
+
+    # Kill the isolated worker of the task and start a new one
+    def kill(self, future):
+        lane, executor, key = self.futures.pop(future)
+        self.started.pop(key, None)
+
+        # Executor has no API for stopping a running task
+        for process in list(executor._processes.values()):
+            process.kill()
+
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.lanes[lane] = self.start_lane()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        for executor in self.lanes:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+        if self.manager:
+            self.manager.shutdown()
+
+# Watches the time of running tasks
+# Tasks get a warning after the soft limit and are stopped after the hard limit (0 = no limit)
+class Watchdog:
+    def __init__(self, soft, hard):
+        self.soft = soft
+        self.hard = hard
+        self.warned = set()
+
+    # Wait time between checks, None when there are no limits
+    def interval(self):
+        return WATCHDOG_INTERVAL if self.soft or self.hard else None
+
+    # Returns tasks over the soft limit (once) and tasks over the hard limit with their time
+    # Futures map to their task keys, started has the start times of the tasks the workers began
+    def check(self, futures, started):
+        now = time.time()
+        slow = []
+        expired = []
+
+        for future, key in futures.items():
+            if key not in started:
+                continue
+
+            seconds = now - started[key]
+
+            if self.hard and seconds > self.hard:
+                expired.append((future, seconds))
+            elif self.soft and seconds > self.soft and future not in self.warned:
+                self.warned.add(future)
+                slow.append((future, seconds))
+
+        return slow, expired
+
+    def forget(self, future):
+        self.warned.discard(future)
+
+# Images that hung or crashed a worker, skipped by later runs until the file changes
+class Quarantine:
+    def __init__(self, output):
+        self.path = os.path.join(output, QUARANTINE_NAME)
+        self.entries = {}
+
+        if os.path.isfile(self.path):
+            with open(self.path) as infile:
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    self.entries[entry["path"]] = entry
+
+    def contains(self, image):
+        entry = self.entries.get(image.filepath)
+
+        return bool(entry) and entry["size"] == image.size and entry["mtime"] == image.mtime
+
+    def add(self, image, run_id, reason):
+        entry = {"path": image.filepath, "size": image.size, "mtime": image.mtime, "run_id": run_id, "reason": reason}
+        self.entries[image.filepath] = entry
+
+        with open(self.path, "a") as outfile:
+            outfile.write(json.dumps(entry) + "\n")
+
+# Slow, stopped, failed and skipped images of a run
+class RunReport:
+    def __init__(self, p):
+        self.p = p
+        self.images = []
+
+    def add(self, kind, image, **info):
+        self.images.append({"kind": kind, "id": image.id, "source": journal_source(self.p, image), **info})
+
+    def count(self, kind):
+        return sum(1 for entry in self.images if entry["kind"] == kind)
+
+    # Report goes into the run directory, only written if something happened
+    def write(self, tasks, stopped):
+        if not self.images:
+            return None
+
+        os.makedirs(self.p.unique_path, exist_ok=True)
+        filepath = os.path.join(self.p.unique_path, REPORT_NAME)
+        write_atomic(filepath, json.dumps({
+            "run_id": self.p.run_id,
+            "mode": self.p.run_mode,
+            "tasks": tasks,
+            "stopped": stopped,
+            "soft_timeout": self.p.soft_timeout,
+            "hard_timeout": self.p.hard_timeout,
+            "images": self.images,
+        }, indent=1).encode())
+
+        return filepath
+
+# Drop quarantined images from the tasks
+def skip_quarantined(p, tasks, images, report):
+    logger = logging.getLogger()
+    quarantine = Quarantine(p.output)
+    keep = []
+
+    for task in tasks:
+        if quarantine.contains(images[task]):
+            logger.warning(f"[ID:{task}] - ({images[task].name}) - Quarantined by an earlier run, skipping it..")
+            report.add("quarantined", images[task])
+        else:
+            keep.append(task)
+
+    return keep, quarantine
@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
 
+import os
 import logging
 import random
+import functools
+import threading
 import cv2 as cv
 import imutils as im
 import numpy as np
-import ruamel.yaml
 
 from io import BytesIO
-from PIL import Image, ImageTk, ImageEnhance, UnidentifiedImageError
-from pillow_lut import load_cube_file
+from PIL import Image, ImageFile, ImageEnhance, UnidentifiedImageError
 
-from .imutils.perspective import four_point_transform
+from .imutils.perspective import four_point_transform, four_point_size
 
 def cv_auto_rotate(img, direction):
     logger = logging.getLogger()
@@ -27,12 +28,40 @@ def cv_auto_rotate(img, direction):
 
     return img
 
+# Rotated rect of contour if it is tilted more than the perspective fix allows, otherwise None
+def cv_pfix_rect(cnt, pfix):
+    if pfix == 0:
+        return None
+
+    rot_rect = cv.minAreaRect(cnt)
+
+    # Calculate tilt angle
+    tilt_angle = abs(rot_rect[2])
+
+    # Enable perspective fix if the tilt angle is larger than the maximum allowed tilt angle
+    if tilt_angle > pfix and tilt_angle < (90 - pfix):
+        return rot_rect
+
+    return None
+
+# Size (w, h) of the slice cv_slice_img cuts from an image of the given shape (h, w)
+def cv_slice_size(shape, img_resized, cnt, pfix):
+    cnt = cnt.copy()
+    cnt[:,:,0] = cnt[:,:,0] * (shape[1] / img_resized.shape[1])
+    cnt[:,:,1] = cnt[:,:,1] * (shape[0] / img_resized.shape[0])
+    rot_rect = cv_pfix_rect(cnt, pfix)
+
+    if rot_rect:
+        return four_point_size(np.int64(cv.boxPoints(rot_rect)))
+
+    x, y, w, h = cv.boundingRect(cnt)
+
+    return min(x + w, shape[1]) - x, min(y + h, shape[0]) - y
+
 # Slice contour area from image
 def cv_slice_img(img, img_resized, cnt, pfix):
     logger = logging.getLogger()
     out_slice = None
-    rot_rect = None
-    slice_with_pfix = False
 
     x_fac = img.shape[1] / img_resized.shape[1]
     y_fac = img.shape[0] / img_resized.shape[0]
@@ -40,24 +69,17 @@ def cv_slice_img(img, img_resized, cnt, pfix):
     cnt[:,:,1] = cnt[:,:,1] * y_fac
 
     # Do we need perspective fix?
-    if pfix != 0:
-        rot_rect = cv.minAreaRect(cnt)
+    rot_rect = cv_pfix_rect(cnt, pfix)
 
-        # Calculate tilt angle
+    # Slice image with pfix
+    if rot_rect:
         tilt_angle = abs(rot_rect[2])
 
-        # Enable perspective fix if the tilt angle is larger than the maximum allowed tilt angle
-        if tilt_angle > pfix and tilt_angle < (90 - pfix):
-
-            if tilt_angle < 45.0:
-                logger.debug(f"Perspective fix image for {tilt_angle} degree tilt")
-            else:
-                logger.debug(f"Perspective fix image for {90 - tilt_angle} degree tilt")
-
-            slice_with_pfix = True
+        if tilt_angle < 45.0:
+            logger.debug(f"Perspective fix image for {tilt_angle} degree tilt")
+        else:
+            logger.debug(f"Perspective fix image for {90 - tilt_angle} degree tilt")
 
-    # Slice image with pfix
-    if slice_with_pfix:
         pts = np.int64(cv.boxPoints(rot_rect))
         out_slice = four_point_transform(img, pts, (255, 255, 255))
 
@@ -109,6 +131,15 @@ def cv_apply_wt(img, wt):
     logger.debug(f"Apply threshold with value {wt}")
     return img_wt_thresh
 
+# Perceptual difference hash (64 bits) of OpenCV image
+# Compares the brightness of neighbouring pixels in 9x8 grayscale thumbnail
+def cv_dhash(img):
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    small = cv.resize(gray, (9, 8), interpolation=cv.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
 def cv_to_pil(img):
     return Image.fromarray(cv.cvtColor(img, cv.COLOR_BGR2RGB))
 
@@ -183,12 +214,25 @@ def pil_resize(img, w=None, h=None, scale=None):
         else:
             return img
 
-def pil_open_image(filepath):
+# Pillow reads the decompression bomb limit from a global while opening, so opens take
+# turns with the lazy opens that switch the check off (opening only reads the header)
+PIL_OPEN_LOCK = threading.Lock()
+
+def pil_open_image(filepath, check_size=True):
     logger = logging.getLogger()
     img = None
 
     try:
-        img = Image.open(filepath)
+        with PIL_OPEN_LOCK:
+            max_pixels = Image.MAX_IMAGE_PIXELS
+
+            if not check_size:
+                Image.MAX_IMAGE_PIXELS = None
+
+            try:
+                img = Image.open(filepath)
+            finally:
+                Image.MAX_IMAGE_PIXELS = max_pixels
     except (FileNotFoundError, UnidentifiedImageError) as e:
         logger.error(e)
 
@@ -197,6 +241,155 @@ def pil_open_image(filepath):
 def pil_to_cv(img):
     return cv.cvtColor(np.array(img), cv.COLOR_RGB2BGR)
 
+# Open image lazily without the decompression bomb check
+# Only use this when the image is never decoded as a whole
+def pil_open_lazy(filepath):
+    return pil_open_image(filepath, check_size=False)
+
+# Bytes per pixel of the raw modes we can read partially
+PIL_RAW_BYTES = {
+    "L": 1,
+    "RGB": 3,
+    "BGR": 3,
+    "RGBA": 4,
+    "RGBX": 4,
+    "BGRA": 4,
+    "BGRX": 4,
+}
+
+# Create tile descriptor for the PIL decoder (named tuple in newer Pillow)
+def pil_tile(codec, extents, offset, args):
+    if hasattr(ImageFile, "_Tile"):
+        return ImageFile._Tile(codec, extents, offset, args)
+
+    return (codec, extents, offset, args)
+
+# Create raw tiles that only decode the box region of the image
+# Returns None if the image data is compressed or otherwise not addressable
+def pil_region_tiles(img, box):
+    x0, y0, x1, y1 = box
+    tiles = []
+
+    for codec, extents, offset, args in img.tile:
+        if isinstance(args, str):
+            args = (args, 0, 1)
+
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        bpp = PIL_RAW_BYTES.get(rawmode)
+
+        if codec != "raw" or not bpp or orientation not in [1, -1]:
+            return None
+
+        tx0, ty0, tx1, ty1 = extents
+        stride = stride or (tx1 - tx0) * bpp
+
+        # Intersect the tile with the box
+        cx0, cy0 = max(tx0, x0), max(ty0, y0)
+        cx1, cy1 = min(tx1, x1), min(ty1, y1)
+
+        if cx0 >= cx1 or cy0 >= cy1:
+            continue
+
+        # Bottom-up images (BMP) store the last row first
+        if orientation == 1:
+            row = cy0 - ty0
+        else:
+            row = ty1 - cy1
+
+        tiles.append(pil_tile(
+            "raw",
+            (cx0 - x0, cy0 - y0, cx1 - x0, cy1 - y0),
+            offset + row * stride + (cx0 - tx0) * bpp,
+            (rawmode, stride, orientation)
+        ))
+
+    return tiles
+
+# Find the layout of uncompressed pixel data stored as one contiguous block
+# Returns (offset, stride, rawmode, orientation) or None
+def pil_raw_layout(img):
+    layout = None
+    next_offset = None
+
+    for codec, extents, offset, args in sorted(img.tile, key=lambda tile: tile[1][1]):
+        if isinstance(args, str):
+            args = (args, 0, 1)
+
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        bpp = PIL_RAW_BYTES.get(rawmode)
+
+        # Only 3 or 4 channel full width strips can be mapped
+        if codec != "raw" or not bpp or bpp < 3 or extents[0] != 0 or extents[2] != img.width:
+            return None
+
+        stride = stride or img.width * bpp
+
+        if layout is None:
+            layout = (offset, stride, rawmode, orientation)
+
+        # Strips have to follow each other in the file
+        elif next_offset != offset or layout[1:] != (stride, rawmode, orientation) or orientation != 1:
+            return None
+
+        next_offset = offset + (extents[3] - extents[1]) * stride
+
+    return layout
+
+# Decode only the box region (x0, y0, x1, y1) of the image
+def pil_read_region(filepath, box):
+    logger = logging.getLogger()
+    img = pil_open_lazy(filepath)
+
+    if not img:
+        return None
+
+    with img:
+        tiles = pil_region_tiles(img, box)
+
+        if tiles is None:
+            return None
+
+        # Point the decoder at the region only
+        img._size = (box[2] - box[0], box[3] - box[1])
+        img.tile = tiles
+        img.load()
+
+        logger.debug(f"PIL Read region {box} using {len(tiles)} tiles")
+
+        return pil_to_cv(img)
+
+# Find the smallest reduced-resolution frame that is at least w pixels wide
+def pil_reduced_frame(img, w):
+    width, height = img.size
+    best_frame = 0
+    best_width = width
+
+    if not hasattr(img, "tag_v2"):
+        return best_frame
+
+    for frame in range(1, getattr(img, "n_frames", 1)):
+        img.seek(frame)
+
+        # Only accept frames marked as reduced-resolution (NewSubfileType)
+        if not img.tag_v2.get(254, 0) & 1:
+            continue
+
+        # Frame has to keep the aspect ratio of the full image
+        if abs(img.width / img.height - width / height) > 0.01:
+            continue
+
+        if w <= img.width < best_width:
+            best_frame = frame
+            best_width = img.width
+
+    img.seek(best_frame)
+
+    return best_frame
+
 def pil_to_buffer(img):
     with BytesIO() as buf:
         img.save(buf, format="PNG")
@@ -204,6 +397,22 @@ def pil_to_buffer(img):
 
     return output
 
+# Load LUT once per process, long running workers keep it cached
+@functools.lru_cache(maxsize=4)
+def pil_load_lut(lut_path):
+    from pillow_lut import load_cube_file
+
+    return load_cube_file(lut_path)
+
+# Check if any of the PIL filters would change the image
+def pil_filters_active(filters):
+    color, contrast, brightness, sharpness, denoise, lut_str, lut_path = filters
+
+    if lut_path and lut_str > 0.0:
+        return True
+
+    return any(value != 1.0 for value in [color, contrast, brightness, sharpness])
+
 def pil_filter_image(img, filters):
     logger = logging.getLogger()
     color = filters[0]
@@ -220,7 +429,7 @@ def pil_filter_image(img, filters):
         img_filter = cv_to_pil(img)
 
     if lut_path and lut_str > 0.0:
-        lut = load_cube_file(lut_path)
+        lut = pil_load_lut(lut_path)
         img_filter_lut = img_filter.filter(lut)
         img_filter = Image.blend(img_filter, img_filter_lut, lut_str)
 
@@ -249,8 +458,7 @@ def pil_filter_image(img, filters):
     return img_filter
 
 def random_string(rand1, rand2, rand3):
-    random.seed(rand1 + rand2 + rand3)
-    return str(random.random()).replace("0.", "")
+    return str(random.Random(rand1 + rand2 + rand3).random()).replace("0.", "")
 
 def remove_suffix(this):
     count = 0
@@ -265,6 +473,41 @@ def remove_suffix(this):
 
     return this[:-first_dot_index - 1]
 
+# Only accept these formats for the Image
+ACCEPTED_FORMATS = [
+    ".bmp",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".webp",
+    ".tiff",
+]
+
+# Return format of compatible image file or empty string
+def image_format(file):
+    format = ""
+
+    for suffix in ACCEPTED_FORMATS:
+        if file.lower().endswith(suffix):
+            format = suffix[1:]
+
+    return format
+
+# Create name prefix for slices based on the relative directory
+# Example: Birthdays/2010 -> Birthdays_2010
+def create_slice_prefix(rel_path):
+    rel_path = os.path.normpath(rel_path)
+
+    # Handle files that are in the root dir (.)
+    if rel_path == ".":
+        return "output"
+
+    return "_".join(rel_path.split(os.sep))
+
+# Create final name for slice number counter
+def create_slice_name(rel_path, counter, suffix):
+    return create_slice_prefix(rel_path) + "_" + str(counter) + suffix
+
 def convert_bytes(size):
     power = 2**10
     n = 0
@@ -277,6 +520,8 @@ def convert_bytes(size):
     return str(round(size)) + str(labels[n])
 
 def yaml_change_value(path, yaml_key, new_val):
+    import ruamel.yaml
+
     with open(path, 'r') as f:
         yaml = ruamel.yaml.YAML()
         yaml.preserve_quotes = True